@@ -2,7 +2,7 @@ import sys
 import json
 
 sys.path.append("./")
-from communication import getAPIRequest
+from communication import getDefaultClient
 
-def getAgentList() -> json:
-    return getAPIRequest("/api/v2/agents")
\ No newline at end of file
+def getAgentList(client=None) -> json:
+    return (client or getDefaultClient()).getAPIRequest("/api/v2/agents")
\ No newline at end of file
@@ -1,30 +1,201 @@
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# (connect timeout, read timeout) in seconds
+defaultTimeout = (10, 120)
+# max connections kept alive to one MC, also the default number of mapRequests workers
+defaultPoolSize = 16
+
+class jsonCodec:
+    """
+    Encodes and decodes JSON bodies as bytes with orjson when it's installed, with json module otherwise.
+    Decode errors are raised as ValueError either way
+    """
+    def loads(self, data):
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+    def dumps(self, obj):
+        if orjson is not None:
+            return orjson.dumps(obj)
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+defaultCodec = jsonCodec()
+
+class mcRequestError(requests.HTTPError):
+    """
+    MC answered with error status. body is the decoded error response if it was JSON.
+    Connection errors and timeouts are raised as requests exceptions, like before
+    """
+    def __init__(self, message, statusCode=None, body=None):
+        super().__init__(message)
+        self.statusCode = statusCode
+        self.body = body
+
+class mcClient:
+    """
+    Connection to one Management Console. Requests reuse kept-alive connections of the client's session,
+    so one client should be shared by all threads talking to the same MC; several clients talk to several MCs.
+
+    throttle - object with request(method, path) context manager, e.g. throttle.Throttle from ../Python3
+    verify - verify MC certificate
+    """
+    def __init__(self, url, port, token, timeout=defaultTimeout, poolSize=defaultPoolSize, throttle=None,
+                 verify=True, session=None):
+        self.url = url
+        self.port = port
+        self.token = "Token " + token
+        self.timeout = timeout
+        self.poolSize = poolSize
+        self.throttle = throttle
+        self.verify = verify
+        self.codec = defaultCodec
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def sendRequest(self, method, APIReq, **kwargs) -> requests.Response:
+        URL = self.url + ":" + str(self.port) + APIReq
+        kwargs.setdefault("timeout", self.timeout)
+        kwargs.setdefault("verify", self.verify)
+        if self.throttle is None:
+            return self.session.request(method, URL, **kwargs)
+        with self.throttle.request(method, APIReq) as slot:
+            req = self.session.request(method, URL, **kwargs)
+            slot.status = req.status_code
+        return req
+
+    def request(self, method, APIReq, bodyData=None, checkStatus=True) -> json:
+        """
+        Send request and decode JSON response.
+        With checkStatus error statuses raise mcRequestError, otherwise error responses are returned as they are
+        (MC reports errors as {"code": ..., "message": ...})
+        """
+        headersData = {"Authorization": self.token}
+        data = None
+        if bodyData is not None:
+            data = self.codec.dumps(bodyData)
+            headersData["Content-Type"] = "application/json"
+            headersData["Content-Length"] = str(len(data))
+        req = self.sendRequest(method, APIReq, headers=headersData, data=data)
+        if req.status_code < 400:
+            return self.codec.loads(req.content) if req.content else None
+        try:
+            body = self.codec.loads(req.content)
+        except ValueError:
+            # e.g. HTML page of a proxy in front of MC
+            body = None
+        if checkStatus or body is None:
+            message = body.get("message", "") if isinstance(body, dict) else req.text[:200]
+            raise mcRequestError(method + " " + APIReq + " failed with status " + str(req.status_code) + ": " + message,
+                                 req.status_code, body)
+        return body
+
+    def get(self, APIReq, checkStatus=True) -> json:
+        return self.request("GET", APIReq, checkStatus=checkStatus)
+
+    def post(self, APIReq, bodyData, checkStatus=True) -> json:
+        return self.request("POST", APIReq, bodyData, checkStatus=checkStatus)
+
+    def put(self, APIReq, bodyData=None, checkStatus=True) -> json:
+        return self.request("PUT", APIReq, bodyData, checkStatus=checkStatus)
+
+    def delete(self, APIReq, checkStatus=True) -> json:
+        return self.request("DELETE", APIReq, checkStatus=checkStatus)
+
+    # same results as the module functions: JSON error responses are returned, not raised
+    def getAPIRequest(self, APIReq) -> json:
+        return self.request("GET", APIReq, checkStatus=False)
+
+    def postAPIRequest(self, APIReq, bodyData) -> json:
+        return self.request("POST", APIReq, bodyData, checkStatus=False)
+
+    def mapRequests(self, requestList, workers=None, checkStatus=True) -> list:
+        """
+        Send many requests concurrently over the client's connection pool.
+        requestList - iterable of (method, APIReq) or (method, APIReq, bodyData) tuples
+        Returns list of decoded responses in the same order; a failed request gives its exception
+        in place of the response, so one failure doesn't hide results of other requests
+        """
+        def send(item):
+            try:
+                return self.request(*item, checkStatus=checkStatus)
+            except (requests.RequestException, ValueError) as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=workers or self.poolSize) as executor:
+            return list(executor.map(send, requestList))
+
+    def mapGet(self, APIReqs, workers=None, checkStatus=True) -> list:
+        return self.mapRequests([("GET", APIReq) for APIReq in APIReqs], workers, checkStatus)
+
+# Module level functions use the default client set up by initializeMCParams.
+# Globals below are kept for scripts reading them
 mcURL = ""
 mcPort = -1
 mcToken = ""
+mcThrottle = None
+# keep-alive connections shared by all requests and threads of the default client
+mcSession = requests.Session()
+mcSession.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=defaultPoolSize))
+mcSession.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=defaultPoolSize))
+defaultClient = None
+defaultClientLock = threading.Lock()
 
 def initializeMCParams(url, port, token):
   global mcURL
   global mcPort
   global mcToken
+  global defaultClient
   mcURL = url
   mcPort = port
   mcToken = "Token " + token
+  with defaultClientLock:
+    defaultClient = mcClient(url, port, token, throttle=mcThrottle, session=mcSession)
+
+def getDefaultClient() -> mcClient:
+  if defaultClient is None:
+    raise mcRequestError("MC parameters are not set, call initializeMCParams first")
+  return defaultClient
+
+# throttle is an object with request(method, path) context manager,
+# e.g. throttle.Throttle from ../Python3 shared with other clients of the same MC
+def setThrottle(throttle):
+  global mcThrottle
+  mcThrottle = throttle
+  if defaultClient is not None:
+    defaultClient.throttle = throttle
+
+def sendRequest(method, APIReq, **kwargs):
+    return getDefaultClient().sendRequest(method, APIReq, **kwargs)
 
 def getAPIRequest(APIReq) -> json:
-    URL = mcURL + ":" + str(mcPort) + APIReq
-    req = requests.get(URL, headers={"Authorization": mcToken})
-    return json.loads(req.content)
+    return getDefaultClient().getAPIRequest(APIReq)
 
 def postAPIRequest(APIReq, bodyData) -> json:
-    URL = mcURL + ":" + str(mcPort) + APIReq
-    bodyData = json.dumps(bodyData)
-    headersData = {
-        "Authorization": mcToken,
-        "Content-Type": "application/json",
-        "Content-Length": str(len(bodyData))
-    }
-    req = requests.post(URL, headers=headersData, data=bodyData)
-    return json.loads(req.content)
+    return getDefaultClient().postAPIRequest(APIReq, bodyData)
+
+def mapAPIRequests(requestList, workers=None) -> list:
+    # same as mcClient.mapRequests of the default client, error responses are returned like by getAPIRequest
+    return getDefaultClient().mapRequests(requestList, workers, checkStatus=False)
@@ -1,9 +1,16 @@
 import sys
 import json
 import time
+import heapq
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 
 sys.path.append("./")
-from communication import getAPIRequest, postAPIRequest
+from communication import getDefaultClient, mcRequestError
+
+log = logging.getLogger("jobs")
 
 def appendToJobAgentList(list, id, permission, path) -> json:
     list.append({
@@ -13,31 +20,94 @@ def appendToJobAgentList(list, id, permission, path) -> json:
     })
     return list
 
-def addJob(name, desc, type, agents) -> json:
+# functions below take optional client (communication.mcClient) to work with several MCs,
+# the default client set up by initializeMCParams is used otherwise
+def addJob(name, desc, type, agents, client=None) -> json:
     jobInfo = {
         "name": name,
         "description": desc,
         "type": type,
         "agents": agents
     }
-    return postAPIRequest("/api/v2/jobs", jobInfo)
+    return (client or getDefaultClient()).postAPIRequest("/api/v2/jobs", jobInfo)
 
-def startJob(jobID) -> json:
+def startJob(jobID, client=None) -> json:
     jobInfo = {
         "job_id": jobID
     }
-    return postAPIRequest("/api/v2/runs", jobInfo)
+    return (client or getDefaultClient()).postAPIRequest("/api/v2/runs", jobInfo)
+
+def getJobRunStatus(runID, client=None) -> json:
+    return (client or getDefaultClient()).getAPIRequest("/api/v2/runs/" + str(runID))
+
+def getJobRuns(params=None, client=None) -> json:
+    APIReq = "/api/v2/runs"
+    if params:
+        APIReq += "?" + urlencode(params)
+    runs = (client or getDefaultClient()).getAPIRequest(APIReq)
+    # list may be wrapped in {"data": [...]}
+    return runs.get("data", []) if isinstance(runs, dict) else runs
+
+# run statuses after which the run won't change anymore
+terminalRunStatuses = ("finished", "stopped", "failed")
+# run statuses meaning that transfer has not started yet
+waitingRunStatuses = ("queued", "scheduled", "pending")
+
+def getRunProgress(runStatus):
+    # fraction of data transferred, None if run doesn't report it
+    stats = runStatus.get("stats") or runStatus
+    total = stats.get("size_total")
+    completed = stats.get("size_completed")
+    if total and completed is not None:
+        return min(1.0, float(completed) / total)
+    progress = runStatus.get("progress")
+    if progress is not None:
+        return float(progress) / 100
+    return None
+
+class adaptivePollPolicy:
+    """
+    Chooses the next poll interval of a run from its observed progress:
+    the interval grows while the run is queued or stalled and shrinks when the run is close to completion.
+    """
+    def __init__(self, minInterval=1, maxInterval=60, backoffFactor=1.5):
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.backoffFactor = backoffFactor
+
+    def nextInterval(self, monitor, now) -> float:
+        progress = getRunProgress(monitor.lastRunStatus)
+        previousProgress, previousTime = monitor.lastProgress, monitor.lastProgressTime
+        monitor.lastProgress, monitor.lastProgressTime = progress, now
 
-def getJobRunStatus(runID) -> json:
-    return getAPIRequest("/api/v2/runs/" + str(runID))
+        stalled = (progress is not None and previousProgress is not None and progress <= previousProgress)
+        if monitor.monitorJobStatus in waitingRunStatuses or stalled:
+            return min(self.maxInterval, monitor.currentInterval * self.backoffFactor)
+
+        eta = monitor.lastRunStatus.get("eta")
+        if eta is None and progress is not None and previousProgress is not None and now > previousTime:
+            rate = (progress - previousProgress) / (now - previousTime)
+            eta = (1.0 - progress) / rate
+        if eta is None:
+            return monitor.monitorInterval
+        # poll twice per remaining ETA, so completion is noticed soon after it happens
+        return max(self.minInterval, min(monitor.monitorInterval, float(eta) / 2))
 
 class jobMonitor:
-    def __init__(self, runID, finishedCallbackFunction):
+    def __init__(self, runID, finishedCallbackFunction, statusChangedCallbackFunction=None, monitorInterval=5,
+                 client=None):
         self.monitorJobID = 0
         self.monitoredRunID = runID
         self.monitorJobStatus = ""
         self.monitorErrCode = 200
         self.monitorCallback = finishedCallbackFunction
+        self.monitorStatusCallback = statusChangedCallbackFunction
+        self.monitorInterval = monitorInterval
+        self.currentInterval = monitorInterval
+        self.lastRunStatus = {}
+        self.lastProgress = None
+        self.lastProgressTime = 0.0
+        self.client = client
 
     def getJobStatus(self) -> str:
         return self.monitorJobStatus
@@ -45,27 +115,189 @@ class jobMonitor:
     def getErrCode(self) -> int:
         return self.monitorErrCode
 
+    def isDone(self) -> bool:
+        return self.monitorJobStatus in terminalRunStatuses or self.monitorErrCode == 404
+
     def updateJobRunStatus(self):
-        runStatus = getJobRunStatus(self.monitoredRunID)
+        self.applyRunStatus(getJobRunStatus(self.monitoredRunID, self.client))
+
+    def applyRunStatus(self, runStatus):
+        # error responses (e.g. 404 for deleted run) have "code" and no run fields
+        self.monitorErrCode = runStatus.get("code", 0)
+        if "status" not in runStatus:
+            return
+        previousStatus = self.monitorJobStatus
+        self.lastRunStatus = runStatus
         self.monitorJobID = runStatus["job_id"]
         self.monitorJobStatus = runStatus["status"]
-        try:
-            self.monitorErrCode = runStatus["code"]
-        except:
-            self.monitorErrCode = 0
+        if (self.monitorStatusCallback is not None and self.monitorJobStatus != previousStatus):
+            self.monitorStatusCallback(self.monitoredRunID, previousStatus, self.monitorJobStatus)
         if (self.monitorJobStatus == "finished"):
             self.monitorCallback(self.monitorJobID)
 
-jobRuns = {}
+class jobRunMonitorEngine:
+    """
+    Monitors any number of job runs with a small pool of threads.
+    Runs are polled in order of their next poll time kept in a priority queue.
+
+    pollPolicy - adaptivePollPolicy to adjust poll interval of every run to its progress, None for fixed intervals
+    maxPollsPerSecond - poll budget of the whole engine, e.g. to share MC capacity with other scripts
+    coalesceQuery - params of GET /runs list query (e.g. {"job_id": 5}); when several runs are due at once
+        they are updated from one list query, runs missing in the list are polled one by one
+    client - communication.mcClient of MC the runs belong to, the default client if None
+    """
+    def __init__(self, workers=4, pollPolicy=None, maxPollsPerSecond=None, coalesceQuery=None, client=None):
+        self.workers = workers
+        self.pollPolicy = pollPolicy
+        self.maxPollsPerSecond = maxPollsPerSecond
+        self.coalesceQuery = coalesceQuery
+        self.client = client
+        self.nextBudgetTime = 0.0
+        self.monitors = {}
+        self.pollQueue = []
+        self.pollSeq = 0
+        self.condition = threading.Condition()
+        self.executor = None
+        self.scheduler = None
+        self.running = False
+
+    def addRun(self, runID, finishedCallbackFunction, statusChangedCallbackFunction=None, monitorInterval=5):
+        with self.condition:
+            if (runID in self.monitors):
+                return self.monitors[runID]
+            monitor = jobMonitor(runID, finishedCallbackFunction, statusChangedCallbackFunction, monitorInterval,
+                                 self.client)
+            self.monitors[runID] = monitor
+            self._schedule(runID, time.monotonic() + monitorInterval)
+            return monitor
+
+    def removeRun(self, runID):
+        with self.condition:
+            self.monitors.pop(runID, None)
+            self.condition.notify_all()
+
+    def isMonitored(self, runID) -> bool:
+        with self.condition:
+            return runID in self.monitors
+
+    def waitForRun(self, runID, timeout=None) -> bool:
+        # block until the run reaches terminal state, returns False on timeout
+        with self.condition:
+            return self.condition.wait_for(lambda: runID not in self.monitors, timeout)
+
+    def waitForAll(self, timeout=None) -> bool:
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.monitors, timeout)
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.scheduler = threading.Thread(target=self._schedulerLoop, name="job-run-monitor", daemon=True)
+        self.scheduler.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.scheduler is not None:
+            self.scheduler.join()
+            self.executor.shutdown(wait=True)
+            self.scheduler = None
+            self.executor = None
+
+    def _schedule(self, runID, pollTime):
+        # called with condition held
+        self.pollSeq += 1
+        heapq.heappush(self.pollQueue, (pollTime, self.pollSeq, runID))
+        self.condition.notify_all()
+
+    def _popDueRuns(self, now):
+        # called with condition held
+        dueRunIDs = []
+        while self.pollQueue and self.pollQueue[0][0] <= now:
+            _, _, runID = heapq.heappop(self.pollQueue)
+            if runID in self.monitors:
+                dueRunIDs.append(runID)
+            if self.coalesceQuery is None:
+                break
+        return dueRunIDs
+
+    def _schedulerLoop(self):
+        with self.condition:
+            while self.running:
+                if not self.pollQueue:
+                    self.condition.wait()
+                    continue
+                now = time.monotonic()
+                delay = max(self.pollQueue[0][0], self.nextBudgetTime) - now
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                dueRunIDs = self._popDueRuns(now)
+                if not dueRunIDs:
+                    continue
+                if self.maxPollsPerSecond:
+                    self.nextBudgetTime = max(self.nextBudgetTime, now) + 1.0 / self.maxPollsPerSecond
+                if len(dueRunIDs) > 1:
+                    self.executor.submit(self._pollMany, dueRunIDs)
+                else:
+                    self.executor.submit(self._poll, dueRunIDs[0])
+
+    def _poll(self, runID, runStatus=None):
+        with self.condition:
+            monitor = self.monitors.get(runID)
+        if monitor is None:
+            return
+        try:
+            if runStatus is None:
+                monitor.updateJobRunStatus()
+            else:
+                monitor.applyRunStatus(runStatus)
+        except mcRequestError as e:
+            # error response which is not JSON, e.g. 404 of a proxy for deleted run
+            if e.statusCode is not None:
+                monitor.monitorErrCode = e.statusCode
+            log.warning("Failed to update status of the run %s: %s", runID, e)
+        except Exception as e:
+            # keep monitoring, MC may be restarting
+            log.warning("Failed to update status of the run %s: %s", runID, e)
+        now = time.monotonic()
+        with self.condition:
+            if monitor.isDone():
+                self.monitors.pop(runID, None)
+                self.condition.notify_all()
+            elif runID in self.monitors:
+                if self.pollPolicy is not None:
+                    monitor.currentInterval = self.pollPolicy.nextInterval(monitor, now)
+                self._schedule(runID, now + monitor.currentInterval)
+
+    def _pollMany(self, runIDs):
+        try:
+            runs = {run["id"]: run for run in getJobRuns(self.coalesceQuery, self.client)}
+        except Exception as e:
+            log.warning("Failed to get list of runs: %s", e)
+            runs = {}
+        for runID in runIDs:
+            # runs not matching the list query are polled individually
+            self._poll(runID, runs.get(runID))
+
+defaultMonitorEngine = None
+defaultMonitorEngineLock = threading.Lock()
+
+def getMonitorEngine() -> jobRunMonitorEngine:
+    global defaultMonitorEngine
+    with defaultMonitorEngineLock:
+        if defaultMonitorEngine is None:
+            defaultMonitorEngine = jobRunMonitorEngine()
+            defaultMonitorEngine.start()
+        return defaultMonitorEngine
 
 def monitorJob(runID, finishedCallbackFunction, monitorInterval):
-    if (not runID in jobRuns):
-        # new job run to monitor
-        jobRuns[runID] = jobMonitor(runID, finishedCallbackFunction)
-
-    while ((jobRuns[runID].getJobStatus() != "finished") and (jobRuns[runID].getErrCode != 404)):
-        # this should become multi-threaded to monitor several jobs
-        time.sleep(monitorInterval)
-        jobRuns[runID].updateJobRunStatus()
-    # remove from the jobRuns dict
-    jobRuns.pop(runID, None)
+    # blocks until the run is done; all runs share one monitor engine,
+    # so several threads can call monitorJob for different runs at once
+    engine = getMonitorEngine()
+    engine.addRun(runID, finishedCallbackFunction, monitorInterval=monitorInterval)
+    engine.waitForRun(runID)
@@ -0,0 +1,172 @@
+from collections import defaultdict
+
+# agent attributes with hash index
+INDEXED_FIELDS = ('id', 'deviceid', 'name', 'ip', 'os', 'online')
+
+
+def _tag_keys(tag):
+    # tags are reported either as plain strings or as {'name': ..., 'value': ...} dicts,
+    # index both tag name and (name, value) pair
+    if isinstance(tag, dict):
+        name = tag.get('name')
+        return name, (name, tag.get('value'))
+    return (tag, )
+
+
+class AgentDirectory:
+    """
+    Agents list with hash indexes for O(1) lookups
+
+        directory = AgentDirectory(api._get_agents())
+        directory.by_deviceid(device_id)
+        directory.find(os='linux', tag='backup', online=True)
+        directory.refresh(api._get_agents())   # re-indexes only changed agents
+    """
+
+    def __init__(self, agents=(), fields=INDEXED_FIELDS):
+        """
+        :param agents: iterable of agent dicts as returned by /agents
+        :param fields: agent attributes to index, tags are always indexed
+        """
+
+        self._fields = tuple(fields)
+        self._agents = {}
+        self._indexes = {field: defaultdict(set) for field in self._fields}
+        self._tags = defaultdict(set)
+
+        for agent in agents:
+            self._add(agent)
+
+    @classmethod
+    def from_api(cls, api, **kwargs):
+        """
+        Build directory from /agents of ApiBaseCommands instance
+        """
+
+        return cls(api._get_agents(), **kwargs)
+
+    def __len__(self):
+        return len(self._agents)
+
+    def __iter__(self):
+        return iter(self._agents.values())
+
+    def __contains__(self, agent_id):
+        return agent_id in self._agents
+
+    def _add(self, agent):
+        agent_id = agent['id']
+        self._agents[agent_id] = agent
+
+        for field in self._fields:
+            value = agent.get(field)
+            if value is not None:
+                self._indexes[field][value].add(agent_id)
+
+        for tag in agent.get('tags') or ():
+            for key in _tag_keys(tag):
+                self._tags[key].add(agent_id)
+
+    def _remove(self, agent_id):
+        agent = self._agents.pop(agent_id)
+
+        for field in self._fields:
+            value = agent.get(field)
+            if value is not None:
+                self._discard(self._indexes[field], value, agent_id)
+
+        for tag in agent.get('tags') or ():
+            for key in _tag_keys(tag):
+                self._discard(self._tags, key, agent_id)
+
+    @staticmethod
+    def _discard(index, key, agent_id):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(agent_id)
+            if not ids:
+                del index[key]
+
+    def refresh(self, agents):
+        """
+        Apply new agents list, only added, changed and removed agents are re-indexed
+
+        :param agents: iterable of agent dicts as returned by /agents
+        :return: dict with numbers of 'added', 'changed' and 'removed' agents
+        """
+
+        added = changed = 0
+        seen = set()
+
+        for agent in agents:
+            agent_id = agent['id']
+            seen.add(agent_id)
+
+            current = self._agents.get(agent_id)
+            if current is None:
+                added += 1
+            elif current != agent:
+                changed += 1
+                self._remove(agent_id)
+            else:
+                continue
+
+            self._add(agent)
+
+        removed = [agent_id for agent_id in self._agents if agent_id not in seen]
+        for agent_id in removed:
+            self._remove(agent_id)
+
+        return {'added': added, 'changed': changed, 'removed': len(removed)}
+
+    def get(self, agent_id):
+        """
+        :return: agent dict or None
+        """
+
+        return self._agents.get(agent_id)
+
+    def by_deviceid(self, deviceid):
+        """
+        :return: agent dict or None
+        """
+
+        ids = self._ids('deviceid', deviceid)
+        return self._agents[next(iter(ids))] if ids else None
+
+    def _ids(self, field, value):
+        if field == 'tag':
+            return self._tags.get(value if not isinstance(value, list) else tuple(value), set())
+
+        if field in self._indexes:
+            return self._indexes[field].get(value, set())
+
+        return None
+
+    def find(self, **criteria):
+        """
+        Find agents matching all criteria, e.g. find(os='linux', tag='backup', online=True)
+
+        `tag` matches tag name or (name, value) pair. Criteria on indexed fields are resolved with index lookups,
+        other fields are compared against already narrowed candidates.
+
+        :return: list of agent dicts
+        """
+
+        indexed = []
+        scanned = []
+        for field, value in criteria.items():
+            ids = self._ids(field, value)
+            if ids is None:
+                scanned.append((field, value))
+            else:
+                indexed.append(ids)
+
+        if indexed:
+            indexed.sort(key=len)
+            candidates = set(indexed[0]).intersection(*indexed[1:])
+            agents = (self._agents[agent_id] for agent_id in candidates)
+        else:
+            agents = self._agents.values()
+
+        return [agent for agent in agents if all(agent.get(field) == value for field, value in scanned)]
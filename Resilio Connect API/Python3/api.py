@@ -1,88 +1,442 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 from enum import Enum
 from functools import wraps
 from json import JSONDecodeError
+import time
 import requests
+from requests.adapters import HTTPAdapter
 
-from errors import ApiConnectionError, ApiUnauthorizedError, ApiError
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+from cache import ResponseCache
+from codec import default_codec
+from errors import ApiConnectionError, ApiError, api_error_for_status
 from logger import logger
+from models import iter_models, parse_list
+from metrics import call_hooks_complete, call_hooks_error, call_hooks_response, call_hooks_start
+from retry import RetryPolicy, RetryState, RetryStats
+from throttle import NO_THROTTLE
 
 BASE_API_URL = '/api/v2'
 
+# number of per-host connection pools kept by the session
+DEFAULT_POOL_CONNECTIONS = 4
+# max connections kept alive to a single host (one per concurrent thread)
+DEFAULT_POOL_MAXSIZE = 16
+# (connect timeout, read timeout) in seconds
+DEFAULT_TIMEOUT = (10, 120)
+# number of items requested per page by iter_* methods
+DEFAULT_PAGE_SIZE = 500
+# bytes of streamed page looked at to tell paged response from plain list
+STREAM_PEEK_SIZE = 64
+
+
+def _response_size(response, kwargs):
+    # streamed body is not read yet, don't load it to count bytes
+    if kwargs.get('stream'):
+        return int(response.headers.get('Content-Length', 0))
+    return len(response.content)
+
+
+def page_items(page, offset):
+    """
+    Items of a list page and total number of items, used by sync and async clients
+
+    :return: (items, total), total is None if MC didn't report it. Response without paging (plain list) is the
+        whole list, its total ends iteration
+    """
+
+    if isinstance(page, dict):
+        return page.get('data', []), page.get('total')
+    return page, offset + len(page)
+
+
+def has_next_page(items, total, offset, page_size):
+    """
+    :param offset: offset after items
+    """
+
+    # more items than requested: MC ignored paging and returned everything
+    if not items or len(items) > page_size:
+        return False
+    if total is not None:
+        return offset < total
+    return len(items) == page_size
+
+
+class _PrependedReader:
+    """
+    File-like object reading `head` bytes already taken from `raw` and then the rest of `raw`
+    """
+
+    def __init__(self, head, raw):
+        self._head = head
+        self._raw = raw
+
+    def read(self, size=-1):
+        # ijson reads 0 bytes first to check the type of data
+        if self._head and size:
+            if size < 0:
+                size = len(self._head)
+            head, self._head = self._head[:size], self._head[size:]
+            return head
+        return self._raw.read(size)
+
 
 def authorized_api_request(func):
+    method = func.__name__.strip('_').upper()
+
     @wraps(func)
     def wrapper(self, url, *args, **kwargs):
-        kwargs['headers'] = {
-            'Authorization': 'Token {}'.format(self._token),
-            'Content-Type': 'application/json'
-        }
+        headers = kwargs.get('headers')
+        kwargs['headers'] = self._headers if not headers else dict(self._headers, **headers)
         kwargs['verify'] = self._verify
+        kwargs.setdefault('timeout', self._timeout)
+
+        # per call policy overrides client one, e.g. self._post(url, retry=policy.copy(retry_post=True))
+        retry = RetryState(kwargs.pop('retry', None) or self._retry, method, self.retry_stats)
 
+        if 'json' in kwargs:
+            kwargs['data'] = self._codec.dumps(kwargs.pop('json'))
+
+        path = url
         url = self._base_url + url
+        hooks = self._hooks
+        attempt = 0
 
+        started = time.perf_counter()
         try:
-            response = func(self, url, *args, **kwargs)
-        except requests.RequestException as e:
-            raise ApiConnectionError('Connection to Management Console failed', e)
+            while True:
+                attempt += 1
+                try:
+                    with self._throttle.request(method, path) as slot:
+                        if hooks:
+                            call = call_hooks_start(hooks, method, path, attempt, kwargs.get('data'))
+                        try:
+                            response = func(self, url, *args, **kwargs)
+                        except BaseException as e:
+                            if hooks:
+                                call_hooks_error(hooks, call, e)
+                            raise
+                        slot.status = response.status_code
+                        if hooks:
+                            call_hooks_response(hooks, call, response.status_code, _response_size(response, kwargs))
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    delay = retry.retry_delay()
+                    if delay is None:
+                        retry.finish(failed=True)
+                        raise ApiConnectionError('Connection to Management Console failed', e)
+                    reason = e
+                except requests.RequestException as e:
+                    retry.finish(failed=True)
+                    raise ApiConnectionError('Connection to Management Console failed', e)
+                else:
+                    delay = retry.retry_delay(response.status_code, response.headers.get('Retry-After'))
+                    if delay is None:
+                        break
+                    reason = 'status {}'.format(response.status_code)
+
+                logger.warning("%s %s failed (%s), retrying in %.2fs", method, url, reason, delay)
+                time.sleep(delay)
+
+            retry.finish(failed=response.status_code >= 400)
+
+            if response.status_code >= 400:
+                try:
+                    message = self._codec.loads(response.content).get('message', '')
+                except JSONDecodeError:
+                    message = response.text
+
+                raise api_error_for_status(response.status_code, message)
+        except ApiError as e:
+            if hooks:
+                call_hooks_complete(hooks, call, started, e)
+            raise
+        if hooks:
+            call_hooks_complete(hooks, call, started)
+
+        if method != 'GET':
+            if self._cache is not None:
+                self._cache.invalidate(path, self._base_url)
+            if self._snapshot is not None:
+                self._snapshot.expire(path)
+            if self._single_flight is not None:
+                self._single_flight.invalidate()
 
-        if response.status_code >= 400:
-            try:
-                message = response.json().get('message', '')
-            except JSONDecodeError:
-                message = response.text
+        return response
+    return wrapper
 
-            if response.status_code == 401:
-                raise ApiUnauthorizedError(message)
 
-            raise ApiError(message)
+def make_session(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 pool_block=False, keep_alive=True):
+    """
+    Create HTTP session with keep-alive connection pool
 
-        return response
-    return wrapper
+    Session is safe to share between threads and between several ApiBaseCommands instances,
+    auth headers are not stored in it.
+
+    :param pool_connections: number of per-host connection pools to cache
+    :param pool_maxsize: max number of connections kept open to a single host
+    :param pool_block: block when all pool_maxsize connections are busy instead of opening extra ones
+    :param keep_alive: reuse connections between requests
+    :return: requests.Session object
+    """
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize,
+                          pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+
+    return session
 
 
 class ApiBaseCommands:
-    def __init__(self, address, token, verify):
+    def __init__(self, address, token, verify, session=None, timeout=DEFAULT_TIMEOUT,
+                 pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 pool_block=False, keep_alive=True, retry=None, throttle=None, cache=None,
+                 snapshot=None, codec=None, hooks=None, single_flight=None):
+        """
+        :param address: Management Console address, e.g. https://mc.example.com:8443
+        :param token: API access token
+        :param verify: verify MC certificate
+        :param session: requests.Session to share with other clients, see make_session().
+            If not set, client creates its own session and closes it in close()
+        :param timeout: (connect, read) timeouts in seconds or single value for both
+        :param pool_connections: see make_session()
+        :param pool_maxsize: see make_session()
+        :param pool_block: see make_session()
+        :param keep_alive: see make_session()
+        :param retry: RetryPolicy for failed requests, by default GET/PUT/DELETE are retried on connection
+            errors and 429/502/503/504 statuses. Use retry.NO_RETRY to disable
+        :param throttle: throttle.Throttle limiting request rate and concurrency, may be shared between clients
+        :param cache: cache.ResponseCache for GET responses, not cached if None
+        :param snapshot: snapshot.InventorySnapshot serving agents, groups and jobs lists while it's fresh enough
+        :param codec: codec.JsonCodec for request and response bodies, the fastest installed one by default
+        :param hooks: list of metrics.RequestHooks called around every request attempt,
+            e.g. [metrics.RequestMetrics()]
+        :param single_flight: singleflight.SingleFlight sharing one request between identical concurrent GETs,
+            may be shared between clients
+        """
+
         self._token = token
         self._address = address
         self._base_url = address + BASE_API_URL
         self._verify = verify
+        self._timeout = timeout
+        self._retry = retry if retry is not None else RetryPolicy()
+        self.retry_stats = RetryStats()
+        self._throttle = throttle if throttle is not None else NO_THROTTLE
+        self._cache = cache
+        self._snapshot = snapshot
+        self._codec = codec if codec is not None else default_codec
+        self._hooks = tuple(hooks or ())
+        self._single_flight = single_flight
+
+        self._headers = {
+            'Authorization': 'Token {}'.format(token),
+            'Content-Type': 'application/json'
+        }
+
+        self._owns_session = session is None
+        if session is None:
+            session = make_session(pool_connections, pool_maxsize, pool_block, keep_alive)
+        self._session = session
+
+    def close(self):
+        """
+        Close connection pool if it's owned by the client
+        """
+
+        if self._owns_session:
+            self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
     # Request methods
     @authorized_api_request
     def _get(self, *args, **kwargs):
-        return requests.get(*args, **kwargs)
+        return self._session.get(*args, **kwargs)
 
     @authorized_api_request
     def _post(self, *args, **kwargs):
-        return requests.post(*args, **kwargs)
+        return self._session.post(*args, **kwargs)
 
     @authorized_api_request
     def _put(self, *args, **kwargs):
-        return requests.put(*args, **kwargs)
+        return self._session.put(*args, **kwargs)
 
     @authorized_api_request
     def _delete(self, *args, **kwargs):
-        return requests.delete(*args, **kwargs)
+        return self._session.delete(*args, **kwargs)
 
     # Helpers
     def _create(self, *args, **kwargs):
         r = self._post(*args, **kwargs)
         try:
-            return r.json()['id']
+            return self._codec.loads(r.content)['id']
         except JSONDecodeError as e:
             raise ApiError('Response is not a json: {}. {}'.format(r.text, e))
 
-    def _get_json(self, *args, **kwargs):
-        r = self._get(*args, **kwargs)
+    def _get_json(self, url, **kwargs):
+        single_flight = self._single_flight
+        # calls with extra headers or per call options are not coalesced
+        if single_flight is None or set(kwargs) - {'params'}:
+            return self._fetch_json(url, **kwargs)
+
+        key = ResponseCache.key(url, kwargs.get('params'), self._base_url, self._token)
+        return single_flight.do(key, lambda: self._fetch_json(url, **kwargs))
+
+    def _fetch_json(self, url, **kwargs):
+        cache = self._cache
+        entry = None
+        if cache is not None:
+            key = cache.key(url, kwargs.get('params'), self._base_url, self._token)
+            entry = cache.lookup(key)
+            if entry is not None:
+                if entry.fresh:
+                    return entry.data
+                kwargs['headers'] = dict(kwargs.get('headers') or {}, **entry.validators())
+
+        r = self._get(url, **kwargs)
+
+        if entry is not None and r.status_code == 304:
+            cache.revalidated(key, entry)
+            return entry.data
+
         try:
-            return r.json()
+            data = self._codec.loads(r.content)
         except JSONDecodeError as e:
             raise ApiError('Response is not a json: {}. {}'.format(r.text, e))
 
+        if cache is not None:
+            cache.store(key, data, r)
+
+        return data
+
+    def _get_inventory(self, kind, url):
+        if self._snapshot is None:
+            return self._get_json(url)
+
+        records = self._snapshot.load(kind)
+        if records is None:
+            records = self._get_json(url)
+            self._snapshot.store(kind, records)
+
+        return records
+
+    def _get_page(self, url, params, offset, page_size):
+        return page_items(self._get_json(url, params=dict(params, offset=offset, limit=page_size)), offset)
+
+    def _stream_page(self, url, params, offset, page_size):
+        """
+        Request page and decode its items while it's downloaded
+
+        :return: (generator of items, whole), whole is True for plain list response: it's the whole list like in
+            page_items()
+        """
+
+        r = self._get(url, params=dict(params, offset=offset, limit=page_size), stream=True)
+        r.raw.decode_content = True
+        try:
+            # items are in 'data' of paged response or at top level of plain list
+            head = r.raw.read(STREAM_PEEK_SIZE)
+        except BaseException:
+            r.close()
+            raise
+        whole = head.lstrip()[:1] == b'['
+        return self._stream_items(r, head, 'item' if whole else 'data.item'), whole
+
+    @staticmethod
+    def _stream_items(r, head, prefix):
+        try:
+            for item in ijson.items(_PrependedReader(head, r.raw), prefix, use_float=True):
+                yield item
+        except ijson.JSONError as e:
+            raise ApiError('Response is not a json: {}'.format(e))
+        finally:
+            r.close()
+
+    def _iter_paged(self, url, attrs, page_size, prefetch, incremental):
+        """
+        Iterate over items of paged list, next page is requested when the current one is exhausted
+
+        :param prefetch: request next page in background while caller processes the current one
+        :param incremental: decode items one by one while page is downloaded (needs ijson), so that
+            memory doesn't depend on page size; pages are not prefetched in this mode
+        """
+
+        params = dict(attrs or {})
+        offset = params.pop('offset', 0)
+
+        if incremental and ijson is None:
+            logger.debug("ijson is not installed, pages are decoded as a whole")
+            incremental = False
+
+        if incremental:
+            previous_first = None
+            while True:
+                count = 0
+                stream, whole = self._stream_page(url, params, offset, page_size)
+                for item in stream:
+                    if not count:
+                        # MC ignoring offset returns the same page again
+                        if item == previous_first:
+                            stream.close()
+                            return
+                        first = item
+                    count += 1
+                    yield item
+                # MC ignoring paging returns more than requested or plain list, it's all the data there is
+                if whole or count != page_size:
+                    return
+                previous_first = first
+                offset += count
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            items, total = self._get_page(url, params, offset, page_size)
+            previous = None
+            while True:
+                # MC ignoring offset returns the same page again
+                if items == previous:
+                    return
+                offset += len(items)
+                has_next = has_next_page(items, total, offset, page_size)
+                if has_next and executor is not None:
+                    next_page = executor.submit(contextvars.copy_context().run, self._get_page, url, params, offset,
+                                                page_size)
+
+                for item in items:
+                    yield item
+
+                if not has_next:
+                    return
+                previous = items
+                items, total = next_page.result() if executor is not None else \
+                    self._get_page(url, params, offset, page_size)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
     # Agents
-    def _get_agents(self):
+    def _get_agents(self, model=None, fields=None):
         # https://connect-download-2-12-pr.resilio.com/#api-Agents-GetAgents
-        return self._get_json('/agents')
+        # model, e.g. models.Agent, and fields project agents into compact objects instead of decoded dicts
+        agents = self._get_inventory('agents', '/agents')
+        return agents if model is None else parse_list(model, agents, fields)
 
     def _get_agent(self, agent_id):
         # https://connect-download-2-12-pr.resilio.com/#api-Agents-GetAgent
@@ -103,7 +457,7 @@ class ApiBaseCommands:
     # Groups
     def _get_groups(self):
         # https://connect-download-2-12-pr.resilio.com/#api-Groups-GetGroups
-        return self._get_json('/groups')
+        return self._get_inventory('groups', '/groups')
 
     def _get_group(self, group_id):
         # https://connect-download-2-12-pr.resilio.com/#api-Groups-GetGroup
@@ -124,7 +478,7 @@ class ApiBaseCommands:
     # Jobs
     def _get_jobs(self):
         # https://connect-download-2-12-pr.resilio.com/#api-Jobs-GetJobs
-        return self._get_json('/jobs')
+        return self._get_inventory('jobs', '/jobs')
 
     def _get_job(self, job_id):
         # https://connect-download-2-12-pr.resilio.com/#api-Jobs-GetJob
@@ -171,6 +525,31 @@ class ApiBaseCommands:
         # https://connect-download-2-12-pr.resilio.com/#api-Runs-RunAgents
         return self._get_json('/runs/{}/agents'.format(job_run_id), params=attrs)
 
+    def iter_job_runs(self, attrs=None, page_size=DEFAULT_PAGE_SIZE, prefetch=True, incremental=False, model=None,
+                      fields=None):
+        """
+        Iterate over job runs page by page, see _get_job_runs() for attrs and _iter_paged() for other params
+
+        :param model: models.Model subclass, e.g. models.JobRun, runs are yielded as models instead of dicts
+        :param fields: fields copied into models, see models.Model
+        """
+
+        runs = self._iter_paged('/runs', attrs, page_size, prefetch, incremental)
+        return runs if model is None else iter_models(model, runs, fields)
+
+    def iter_job_run_agents(self, job_run_id, attrs=None, page_size=DEFAULT_PAGE_SIZE, prefetch=True,
+                            incremental=False, model=None, fields=None):
+        """
+        Iterate over agents of job run page by page, see _get_job_run_agents() for attrs and _iter_paged() for
+        other params
+
+        :param model: models.Model subclass, e.g. models.RunAgent, agents are yielded as models instead of dicts
+        :param fields: fields copied into models, see models.Model
+        """
+
+        agents = self._iter_paged('/runs/{}/agents'.format(job_run_id), attrs, page_size, prefetch, incremental)
+        return agents if model is None else iter_models(model, agents, fields)
+
     def _add_agent_to_job_run(self, job_run_id, attrs):
         # https://connect-download-2-12-pr.resilio.com/#api-Runs-AddAgentsToRun
         self._post('/runs/{}/agents'.format(job_run_id), json=attrs)
@@ -0,0 +1,396 @@
+import asyncio
+import time
+from functools import wraps
+from json import JSONDecodeError
+
+import aiohttp
+
+from api import BASE_API_URL, DEFAULT_PAGE_SIZE, DEFAULT_POOL_MAXSIZE, DEFAULT_TIMEOUT, has_next_page, page_items
+from cache import ResponseCache
+from codec import default_codec
+from errors import ApiConnectionError, ApiError, api_error_for_status
+from logger import logger
+from models import aiter_models, parse_list
+from metrics import call_hooks_complete, call_hooks_error, call_hooks_response, call_hooks_start
+from retry import RetryPolicy, RetryState, RetryStats
+
+# max number of requests in flight per client
+DEFAULT_CONCURRENCY = 64
+
+
+class AsyncApiResponse:
+    """
+    Fully read response, exposes the same attributes as requests.Response that client code uses
+    """
+
+    def __init__(self, status_code, headers, content, codec=default_codec):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self._codec = codec
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return self._codec.loads(self.content)
+
+
+def _encode_params(params):
+    # encode query params the same way requests does: skip None values, stringify the rest
+    if not params:
+        return None
+
+    return {key: str(value) for key, value in params.items() if value is not None}
+
+
+def async_authorized_api_request(func):
+    method = func.__name__.strip('_').upper()
+
+    @wraps(func)
+    async def wrapper(self, url, *args, **kwargs):
+        headers = kwargs.get('headers')
+        kwargs['headers'] = self._headers if not headers else dict(self._headers, **headers)
+        kwargs['params'] = _encode_params(kwargs.get('params'))
+        if not self._verify:
+            kwargs['ssl'] = False
+
+        retry = RetryState(kwargs.pop('retry', None) or self._retry, method, self.retry_stats)
+
+        if 'json' in kwargs:
+            kwargs['data'] = self._codec.dumps(kwargs.pop('json'))
+
+        path = url
+        url = self._base_url + url
+        hooks = self._hooks
+        attempt = 0
+
+        started = time.perf_counter()
+        try:
+            while True:
+                attempt += 1
+                async with self._semaphore:
+                    try:
+                        if hooks:
+                            call = call_hooks_start(hooks, method, path, attempt, kwargs.get('data'))
+                        try:
+                            response = await func(self, url, *args, **kwargs)
+                        except BaseException as e:
+                            if hooks:
+                                call_hooks_error(hooks, call, e)
+                            raise
+                        if hooks:
+                            call_hooks_response(hooks, call, response.status_code, len(response.content))
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        delay = retry.retry_delay()
+                        if delay is None:
+                            retry.finish(failed=True)
+                            raise ApiConnectionError('Connection to Management Console failed', e)
+                        reason = e
+                    else:
+                        delay = retry.retry_delay(response.status_code, response.headers.get('Retry-After'))
+                        if delay is None:
+                            break
+                        reason = 'status {}'.format(response.status_code)
+
+                # sleep outside of semaphore so that waiting retries don't block other requests
+                logger.warning("%s %s failed (%s), retrying in %.2fs", method, url, reason, delay)
+                await asyncio.sleep(delay)
+
+            retry.finish(failed=response.status_code >= 400)
+
+            if response.status_code >= 400:
+                try:
+                    message = self._codec.loads(response.content).get('message', '')
+                except JSONDecodeError:
+                    message = response.text
+
+                raise api_error_for_status(response.status_code, message)
+        except ApiError as e:
+            if hooks:
+                call_hooks_complete(hooks, call, started, e)
+            raise
+        if hooks:
+            call_hooks_complete(hooks, call, started)
+
+        if method != 'GET':
+            if self._cache is not None:
+                self._cache.invalidate(path, self._base_url)
+            if self._single_flight is not None:
+                self._single_flight.invalidate()
+
+        return response
+    return wrapper
+
+
+def make_async_session(limit=DEFAULT_POOL_MAXSIZE, limit_per_host=DEFAULT_POOL_MAXSIZE,
+                       keepalive_timeout=15, timeout=DEFAULT_TIMEOUT):
+    """
+    Create aiohttp session with keep-alive connection pool. Must be called from a running event loop
+
+    :param limit: max number of open connections
+    :param limit_per_host: max number of open connections to a single host
+    :param keepalive_timeout: seconds to keep idle connection open
+    :param timeout: (connect, read) timeouts in seconds or single value for both
+    :return: aiohttp.ClientSession object
+    """
+
+    if not isinstance(timeout, tuple):
+        timeout = (timeout, timeout)
+
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host,
+                                     keepalive_timeout=keepalive_timeout)
+    return aiohttp.ClientSession(connector=connector,
+                                 timeout=aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1]))
+
+
+class AsyncApiBaseCommands:
+    def __init__(self, address, token, verify, session=None, timeout=DEFAULT_TIMEOUT,
+                 concurrency=DEFAULT_CONCURRENCY, pool_maxsize=DEFAULT_POOL_MAXSIZE, retry=None,
+                 cache=None, codec=None, hooks=None, single_flight=None):
+        """
+        :param address: Management Console address, e.g. https://mc.example.com:8443
+        :param token: API access token
+        :param verify: verify MC certificate
+        :param session: aiohttp.ClientSession to share with other clients, see make_async_session().
+            If not set, client creates its own session on the first request and closes it in close()
+        :param timeout: (connect, read) timeouts in seconds or single value for both
+        :param concurrency: max number of requests this client sends at once, the rest wait in line
+        :param pool_maxsize: max number of connections to MC when client owns its session
+        :param retry: RetryPolicy for failed requests, see ApiBaseCommands
+        :param cache: cache.ResponseCache for GET responses, not cached if None
+        :param codec: codec.JsonCodec for request and response bodies, the fastest installed one by default
+        :param hooks: list of metrics.RequestHooks called around every request attempt, see ApiBaseCommands
+        :param single_flight: singleflight.AsyncSingleFlight sharing one request between identical concurrent GETs
+        """
+
+        self._token = token
+        self._address = address
+        self._base_url = address + BASE_API_URL
+        self._verify = verify
+        self._timeout = timeout
+        self._pool_maxsize = pool_maxsize
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._retry = retry if retry is not None else RetryPolicy()
+        self.retry_stats = RetryStats()
+        self._cache = cache
+        self._codec = codec if codec is not None else default_codec
+        self._hooks = tuple(hooks or ())
+        self._single_flight = single_flight
+
+        self._headers = {
+            'Authorization': 'Token {}'.format(token),
+            'Content-Type': 'application/json'
+        }
+
+        self._owns_session = session is None
+        self._session = session
+
+    async def close(self):
+        """
+        Close connection pool if it's owned by the client
+        """
+
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    # Request methods
+    async def _request(self, method, url, **kwargs):
+        if self._session is None:
+            self._session = make_async_session(self._pool_maxsize, self._pool_maxsize, timeout=self._timeout)
+
+        async with self._session.request(method, url, **kwargs) as r:
+            return AsyncApiResponse(r.status, r.headers, await r.read(), self._codec)
+
+    @async_authorized_api_request
+    async def _get(self, *args, **kwargs):
+        return await self._request('GET', *args, **kwargs)
+
+    @async_authorized_api_request
+    async def _post(self, *args, **kwargs):
+        return await self._request('POST', *args, **kwargs)
+
+    @async_authorized_api_request
+    async def _put(self, *args, **kwargs):
+        return await self._request('PUT', *args, **kwargs)
+
+    @async_authorized_api_request
+    async def _delete(self, *args, **kwargs):
+        return await self._request('DELETE', *args, **kwargs)
+
+    # Helpers
+    async def _create(self, *args, **kwargs):
+        r = await self._post(*args, **kwargs)
+        try:
+            return self._codec.loads(r.content)['id']
+        except JSONDecodeError as e:
+            raise ApiError('Response is not a json: {}. {}'.format(r.text, e))
+
+    async def _get_json(self, url, **kwargs):
+        single_flight = self._single_flight
+        # calls with extra headers or per call options are not coalesced
+        if single_flight is None or set(kwargs) - {'params'}:
+            return await self._fetch_json(url, **kwargs)
+
+        key = ResponseCache.key(url, kwargs.get('params'), self._base_url, self._token)
+        return await single_flight.do(key, lambda: self._fetch_json(url, **kwargs))
+
+    async def _fetch_json(self, url, **kwargs):
+        cache = self._cache
+        entry = None
+        if cache is not None:
+            key = cache.key(url, kwargs.get('params'), self._base_url, self._token)
+            entry = cache.lookup(key)
+            if entry is not None:
+                if entry.fresh:
+                    return entry.data
+                kwargs['headers'] = dict(kwargs.get('headers') or {}, **entry.validators())
+
+        r = await self._get(url, **kwargs)
+
+        if entry is not None and r.status_code == 304:
+            cache.revalidated(key, entry)
+            return entry.data
+
+        try:
+            data = self._codec.loads(r.content)
+        except JSONDecodeError as e:
+            raise ApiError('Response is not a json: {}. {}'.format(r.text, e))
+
+        if cache is not None:
+            cache.store(key, data, r)
+
+        return data
+
+    async def _get_page(self, url, params, offset, page_size):
+        return page_items(await self._get_json(url, params=dict(params, offset=offset, limit=page_size)), offset)
+
+    async def _iter_paged(self, url, attrs, page_size, prefetch):
+        """
+        Iterate over items of paged list, see ApiBaseCommands._iter_paged()
+        """
+
+        params = dict(attrs or {})
+        offset = params.pop('offset', 0)
+
+        next_page = None
+        try:
+            items, total = await self._get_page(url, params, offset, page_size)
+            previous = None
+            while True:
+                # MC ignoring offset returns the same page again
+                if items == previous:
+                    return
+                offset += len(items)
+                has_next = has_next_page(items, total, offset, page_size)
+                if has_next and prefetch:
+                    next_page = asyncio.ensure_future(self._get_page(url, params, offset, page_size))
+
+                for item in items:
+                    yield item
+
+                if not has_next:
+                    return
+                previous = items
+                items, total = await next_page if prefetch else await self._get_page(url, params, offset, page_size)
+                next_page = None
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    # Agents
+    async def _get_agents(self, model=None, fields=None):
+        agents = await self._get_json('/agents')
+        return agents if model is None else parse_list(model, agents, fields)
+
+    async def _get_agent(self, agent_id):
+        return await self._get_json('/agents/{}'.format(agent_id))
+
+    async def _update_agent(self, agent_id, attrs):
+        await self._put('/agents/{}'.format(agent_id), json=attrs)
+
+    async def _get_agent_config(self):
+        return await self._get_json('/agents/config')
+
+    async def _delete_agent(self, agent_id):
+        await self._delete('/agents/{}'.format(agent_id))
+
+    # Groups
+    async def _get_groups(self):
+        return await self._get_json('/groups')
+
+    async def _get_group(self, group_id):
+        return await self._get_json('/groups/{}'.format(group_id))
+
+    async def _create_group(self, attrs):
+        return int(await self._create('/groups', json=attrs))
+
+    async def _update_group(self, group_id, attrs):
+        await self._put('/groups/{}'.format(group_id), json=attrs)
+
+    async def _delete_group(self, group_id):
+        await self._delete('/groups/{}'.format(group_id))
+
+    # Jobs
+    async def _get_jobs(self):
+        return await self._get_json('/jobs')
+
+    async def _get_job(self, job_id):
+        return await self._get_json('/jobs/{}'.format(job_id))
+
+    async def _create_job(self, attrs, ignore_errors=False):
+        return int(await self._create('/jobs', params={'ignore_errors': ignore_errors}, json=attrs))
+
+    async def _update_job(self, job_id, attrs):
+        await self._put('/jobs/{}'.format(job_id), json=attrs)
+
+    async def _delete_job(self, job_id):
+        await self._delete('/jobs/{}'.format(job_id))
+
+    async def _get_job_groups(self, job_id):
+        return await self._get_json('/jobs/{}/groups'.format(job_id))
+
+    # Job Runs
+    async def _get_job_run(self, job_run_id):
+        return await self._get_json('/runs/{}'.format(job_run_id))
+
+    async def _get_job_runs(self, attrs=None):
+        return await self._get_json('/runs', params=attrs)
+
+    async def _create_job_run(self, attrs):
+        return int(await self._create('/runs', json=attrs))
+
+    async def _stop_job_run(self, job_run_id):
+        await self._put('/runs/{}/stop'.format(job_run_id))
+
+    async def _get_job_run_agent(self, job_run_id, agent_id):
+        return await self._get_json('/runs/{}/agents/{}'.format(job_run_id, agent_id))
+
+    async def _get_job_run_agents(self, job_run_id, attrs=None):
+        return await self._get_json('/runs/{}/agents'.format(job_run_id), params=attrs)
+
+    def iter_job_runs(self, attrs=None, page_size=DEFAULT_PAGE_SIZE, prefetch=True, model=None, fields=None):
+        runs = self._iter_paged('/runs', attrs, page_size, prefetch)
+        return runs if model is None else aiter_models(model, runs, fields)
+
+    def iter_job_run_agents(self, job_run_id, attrs=None, page_size=DEFAULT_PAGE_SIZE, prefetch=True, model=None,
+                            fields=None):
+        agents = self._iter_paged('/runs/{}/agents'.format(job_run_id), attrs, page_size, prefetch)
+        return agents if model is None else aiter_models(model, agents, fields)
+
+    async def _add_agent_to_job_run(self, job_run_id, attrs):
+        await self._post('/runs/{}/agents'.format(job_run_id), json=attrs)
+
+    async def _stop_run_on_agents(self, job_run_id, attrs):
+        await self._put('/runs/{}/agents/stop'.format(job_run_id), json=attrs)
+
+    async def _restart_agent_in_active_job_run(self, job_run_id, attrs):
+        await self._put('/runs/{}/agents/restart'.format(job_run_id), json=attrs)
@@ -0,0 +1,360 @@
+import asyncio
+import json
+import time
+from json import JSONDecodeError
+
+import aiohttp
+
+from async_api import AsyncApiBaseCommands
+from errors import ApiError
+from examples import AGENT_API_PORT, AGENT_FIELDS
+from logger import logger, operation
+from models import Agent
+
+
+class AsyncConnectApiExample(AsyncApiBaseCommands):
+    """
+    asyncio version of ConnectApiExample. Methods are coroutines with the same arguments and results,
+    so many of them can be awaited at once with asyncio.gather()
+    """
+
+    def __init__(self, address, token, verify=False, **kwargs):
+        super(AsyncConnectApiExample, self).__init__(address, token, verify, **kwargs)
+
+    async def get_agents(self):
+        """
+        Get list of all agents
+
+        :return: tuple of models.Agent with id, name, ip and os fields or None in case of error. Fields are read
+            as attributes or as keys: agent.id, agent['id']
+        """
+
+        try:
+            # only listed fields are kept, decoded agents are freed
+            agents = await self._get_agents(model=Agent, fields=AGENT_FIELDS)
+        except ApiError as e:
+            logger.error("Failed to fetch list of agents %s", e)
+            return None
+        else:
+            logger.info("Successfully fetched list of agents")
+            return tuple(agents)
+
+    @operation('create_group')
+    async def create_group(self, name, agents_ids, description=''):
+        """
+        Create group with agents
+
+        :param name: Group name
+        :param agents_ids: Agent IDs iterable object
+        :param description: Group description
+        :return: Group ID or None in case of error
+        """
+
+        attrs = {
+            'name': name,
+            'description': description,
+            'agents': [
+                {'id': agent_id} for agent_id in agents_ids
+            ]
+        }
+
+        try:
+            group_id = await self._create_group(attrs)
+            logger.debug("Created group with ID %s", group_id)
+        except ApiError as e:
+            logger.error("Failed to create group: %s", e)
+            return None
+        else:
+            logger.info("Successfully created group %s", attrs['name'])
+            return group_id
+
+    @operation('delete_group')
+    async def delete_group(self, group_id):
+        """
+        Delete group by id
+
+        :param group_id: Id of a group to be deleted
+        :return: True if operation was successful, otherwise False
+        """
+
+        try:
+            await self._delete_group(group_id)
+            logger.debug("Deleted group with id %s", group_id)
+        except ApiError as e:
+            logger.error("Failed to delete group %s", e)
+            return False
+        else:
+            logger.info("Successfully deleted group %s", group_id)
+            return True
+
+    @operation('add_agents_to_group')
+    async def add_agents_to_group(self, group_id, agents_ids):
+        """
+        Add new agents to existed group
+
+        :param group_id: Group ID
+        :param agents_ids: Agent IDs iterable object
+        :return: True if operation was successful, otherwise False
+        """
+
+        attrs = {
+            'agents': [
+                {'id': agent_id} for agent_id in agents_ids
+            ]
+        }
+
+        try:
+            await self._update_group(group_id, attrs)
+        except ApiError as e:
+            logger.error("Failed to add agents to group %s, %s", group_id, e)
+            return False
+        else:
+            logger.info("Successfully added agents to group %s", group_id)
+            return True
+
+    async def get_group_agents(self, group_id):
+        """
+        Get list of group agents
+
+        :param group_id: Group ID
+        :return: tuple object with agents ids or None in case of error
+        """
+
+        try:
+            response = await self._get_group(group_id)
+            agents_ids = tuple(d["id"] for d in response["agents"])
+        except ApiError as e:
+            logger.error("Failed to get group agents %s", e)
+            return None
+        else:
+            logger.info("Successfully fetched group agents")
+            return agents_ids
+
+    @operation('create_job')
+    async def create_job(self, job_name, job_type, description=None, groups_data=None):
+        """
+        Create a job
+
+        :param job_name: Job name
+        :param job_type: Job type: "consolidation", "distribution", "script", "sync"
+        :param description: Job description
+        :param groups_data: iterable object with group dict items, see ConnectApiExample.create_job
+        :return: Job ID or None in case of error
+        """
+
+        if description is None:
+            description = ''
+
+        if groups_data is None:
+            groups_data = []
+
+        attrs = {
+            'name': job_name,
+            'type': job_type,
+            'description': description,
+            'groups': list(groups_data)
+        }
+
+        try:
+            job_id = await self._create_job(attrs)
+            logger.debug("Created job with ID %s", job_id)
+        except ApiError as e:
+            logger.error("Failed to create job %s", e)
+            return None
+        else:
+            logger.info("Successfully created job")
+            return job_id
+
+    @operation('create_job_run')
+    async def create_job_run(self, job_id):
+        """
+        Create run for a job
+
+        :param job_id: Job ID
+        :return: Job Run ID or None in case of error
+        """
+
+        attrs = {
+            "job_id": job_id
+        }
+
+        try:
+            job_run_id = await self._create_job_run(attrs)
+            logger.debug("Created job run %s", job_run_id)
+        except ApiError as e:
+            logger.error("Failed to create job run %s", e)
+            return None
+        else:
+            logger.info("Successfully created job run %s", job_run_id)
+            return job_run_id
+
+    @operation('assign_jobs_to_group')
+    async def assign_jobs_to_group(self, group_id, jobs_data):
+        """
+        Assign existing jobs to existing group
+
+        :param group_id: Group ID
+        :param jobs_data: iterable object with job dict items, see ConnectApiExample.assign_jobs_to_group
+        :return: True if operation was successful, otherwise False
+        """
+
+        attrs = {
+            'jobs': list(jobs_data)
+        }
+
+        try:
+            await self._update_group(group_id, attrs)
+        except ApiError as e:
+            logger.error("Failed to assign jobs to group %s", e)
+            return False
+        else:
+            logger.info("Successfully assigned jobs to group")
+            return True
+
+    @operation('distribute_folder')
+    async def distribute_folder(self, job_name, job_desc, src_group_data, dst_groups_data):
+        """
+        Distribute folder from src to dst
+
+        :param job_name: Job name
+        :param job_desc: Job description
+        :param src_group_data: src group data as dict, see ConnectApiExample.distribute_folder
+        :param dst_groups_data: iterable object with dst group dict items
+        :return: Job Run ID or None in case of error
+        """
+
+        groups_data = [src_group_data, ]
+        groups_data.extend(dst_groups_data)
+
+        # create job first
+        job_id = await self.create_job(job_name, "distribution", description=job_desc, groups_data=groups_data)
+
+        if job_id is None:
+            raise ApiError("Failed to create job {}".format(job_name))
+
+        # start job by creating job run
+        job_run_id = await self.create_job_run(job_id)
+
+        return job_run_id
+
+    async def check_transfer_status(self, job_run_id, agents_ids=None):
+        """
+        Check job run status on a list of machines
+
+        :param job_run_id: Job Run ID
+        :param agents_ids: iterable object with agents ids, optional
+        :return: tuple with dict items:
+        {
+            "agent_id": <agent_id>,
+            "job_run_status": <status>
+        }
+        """
+
+        try:
+            statuses = tuple([
+                {
+                    "agent_id": item["agent_id"],
+                    "job_run_status": item["status"]
+                } async for item in self.iter_job_run_agents(job_run_id)
+                if agents_ids is None or item["agent_id"] in agents_ids
+            ])
+            logger.debug("Job run agents statuses: %s", statuses)
+        except ApiError as e:
+            logger.error("Failed to get agents info for job run %s", e)
+            return None
+        else:
+            logger.info("Successfully get agents info for job run %s", job_run_id)
+            return statuses
+
+    async def _get_local_agent_id(self):
+        """
+        Get local agent ID
+
+        :return: local agent ID or None in case of error
+        """
+
+        try:
+            # send request to local agent's api endpoint
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=3)) as session:
+                async with session.get('http://127.0.0.1:{}/api/v2/client'.format(AGENT_API_PORT)) as r:
+                    local_device_id = json.loads(await r.read())['data']['peerid']
+        except (aiohttp.ClientError, asyncio.TimeoutError, JSONDecodeError, KeyError) as e:
+            logger.error(e)
+            return None
+
+        all_agents = await self._get_agents(model=Agent, fields=('id', 'deviceid'))
+        logger.debug("All agents: %s", all_agents)
+
+        for a in all_agents:
+            if a["deviceid"] == local_device_id:
+                return a["id"]
+
+        return None
+
+    async def check_transfer_status_of_local_agent(self, job_run_id):
+        """
+        Check job run status on the local agent
+
+        !!! IMPORTANT: Agent's API v2 must be enabled in MC agent profile via 'client_api_enabled=true'
+
+        :param job_run_id: Job Run ID
+        :return: transfer status on the local agent
+        """
+
+        local_agent_id = await self._get_local_agent_id()
+
+        if local_agent_id is None:
+            logger.warning("Local agent not found")
+            return
+
+        try:
+            job_run_local_agent = await self._get_job_run_agent(job_run_id, local_agent_id)
+        except ApiError as e:
+            logger.error("Failed to fetch job run for local agent %s", e)
+            return None
+        else:
+            logger.info("Successfully fetched job run for local agent")
+            return job_run_local_agent["status"]
+
+    async def get_job_run_agents(self, job_run_id):
+        """
+        Get list of agents for the job run
+
+        :param job_run_id: Job Run ID
+        :return: tuple with agents ids
+        """
+
+        try:
+            agents_ids = tuple([agent['agent_id'] async for agent in self.iter_job_run_agents(job_run_id)])
+        except ApiError as e:
+            logger.error("Failed to get agents info for job run %s", e)
+            return None
+        else:
+            logger.info("Successfully get agents info for job run %s", job_run_id)
+
+        return agents_ids
+
+
+async def main():
+    mc_address = "https://mc.test.com:8443"
+    access_token = "fjfjsdlfsadlhfdfhlssjdfjlsh"
+
+    async with AsyncConnectApiExample(mc_address, access_token, concurrency=32) as connect_api:
+        # create groups concurrently
+        group_ids = await asyncio.gather(*(
+            connect_api.create_group("Async group {} {}".format(i, time.time()), (1, 107)) for i in range(10)
+        ))
+        print(group_ids)
+
+        # check status of the runs concurrently
+        job_runs = await connect_api._get_job_runs()
+        statuses = await asyncio.gather(*(
+            connect_api.check_transfer_status(job_run['id']) for job_run in job_runs['data']
+        ))
+        print(json.dumps(statuses, indent=4, sort_keys=True))
+
+        await asyncio.gather(*(connect_api.delete_group(group_id) for group_id in group_ids if group_id is not None))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
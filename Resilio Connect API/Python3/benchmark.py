@@ -0,0 +1,393 @@
+"""
+Benchmark API clients against mock Management Console, see mock_mc.py
+
+Usage:
+    python3 benchmark.py [--requests 2000] [--threads 1] [--agents 100]
+    python3 benchmark.py --certfile cert.pem --keyfile key.pem   # measure over TLS like real MC on :8443
+    python3 benchmark.py codec [--payload captured_agents.json]  # compare JSON codecs on API payloads
+    python3 benchmark.py workflows [--runs 500] [--latency 0.01] [--results benchmark_results.jsonl]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from api import ApiBaseCommands, BASE_API_URL
+from codec import CODECS, get_codec
+from errors import ApiError
+from examples import AGENT_FIELDS, ConnectApiExample
+from logger import logger
+from mock_mc import MockMc, MockMcProcess
+from models import Agent
+
+LEGACY_CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Python')
+
+
+def run(call, requests_count, threads):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for _ in executor.map(lambda _: call(), range(requests_count)):
+            pass
+    return requests_count / (time.perf_counter() - started)
+
+
+def per_call_request(address, token):
+    # the way client worked before: new connection and headers for every call
+    def call():
+        headers = {
+            'Authorization': 'Token {}'.format(token),
+            'Content-Type': 'application/json'
+        }
+        return requests.get(address + BASE_API_URL + '/agents', headers=headers, verify=False).json()
+    return call
+
+
+def sample_agents(count):
+    # shaped like /agents response of MC 2.12
+    return [
+        {
+            'id': i,
+            'name': 'agent-{:05d}.example.com'.format(i),
+            'deviceid': '{:040X}'.format(i * 7919),
+            'ip': '10.{}.{}.{}'.format(i // 65536, i // 256 % 256, i % 256),
+            'os': ('linux', 'win', 'osx')[i % 3],
+            'version': '2.12.{}'.format(i % 4),
+            'online': i % 5 != 0,
+            'last_seen': 1700000000 + i,
+            'tags': [{'name': 'site', 'value': 'dc{}'.format(i % 8)}, {'name': 'role', 'value': 'edge'}],
+            'groups': [{'id': i % 50, 'name': 'Group {}'.format(i % 50)}],
+            'storage_config': {'folders_storage_path': '/var/lib/resilio-agent', 'limits': {'down': 0, 'up': 0}},
+        } for i in range(count)
+    ]
+
+
+def sample_run_agents(count):
+    # shaped like /runs/{id}/agents response of MC 2.12
+    return {
+        'data': [
+            {
+                'agent_id': i,
+                'name': 'agent-{:05d}.example.com'.format(i),
+                'status': ('working', 'finished', 'queued')[i % 3],
+                'eta': 3600 - i % 3600,
+                'stats': {
+                    'files_total': 12000, 'files_completed': i % 12000,
+                    'size_total': 549755813888, 'size_completed': 1048576 * i,
+                    'down_speed': 1048576.5 * (i % 100), 'up_speed': 0.0,
+                },
+                'errors': [] if i % 50 else [{'code': 5, 'message': 'Access denied', 'path': '/data/file.bin'}],
+            } for i in range(count)
+        ],
+        'total': count,
+    }
+
+
+def measure(func, rounds):
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def benchmark_codecs(args):
+    payloads = {}
+    if args.payload:
+        with open(args.payload, 'rb') as f:
+            payloads[args.payload] = f.read()
+    else:
+        payloads['/agents ({} agents)'.format(args.agents)] = json.dumps(sample_agents(args.agents)).encode()
+        payloads['/runs/{{id}}/agents ({} agents)'.format(args.agents)] = \
+            json.dumps(sample_run_agents(args.agents)).encode()
+
+    for title, content in payloads.items():
+        obj = json.loads(content)
+        size = len(content) / 1e6
+        print('{}: {:.2f} MB'.format(title, size))
+
+        # the way responses were decoded before: bytes -> text -> json
+        baseline = measure(lambda: json.loads(content.decode('utf-8')), args.rounds)
+        print('    {:16} decode {:8.2f} MB/s'.format('json via text', size / baseline))
+
+        for name, (_, module) in CODECS.items():
+            if module is None:
+                continue
+            codec = get_codec(name)
+            decode = measure(lambda: codec.loads(content), args.rounds)
+            encode = measure(lambda: codec.dumps(obj), args.rounds)
+            print('    {:16} decode {:8.2f} MB/s ({:.1f}x)   encode {:8.2f} MB/s'.format(
+                name, size / decode, baseline / decode, size / encode))
+
+
+def benchmark_pool(args):
+    requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
+
+    with MockMc(agents=args.agents, certfile=args.certfile, keyfile=args.keyfile) as mc:
+        before = run(per_call_request(mc.address, mc.token), args.requests, args.threads)
+
+        with ApiBaseCommands(mc.address, mc.token, verify=False, pool_maxsize=args.threads) as api:
+            after = run(api._get_agents, args.requests, args.threads)
+
+    print('requests: {}, threads: {}, agents: {}'.format(args.requests, args.threads, args.agents))
+    print('per-call requests.get: {:10.1f} req/s'.format(before))
+    print('pooled session:        {:10.1f} req/s ({:.1f}x)'.format(after, after / before))
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def timed_ops(op, count, threads):
+    """
+    Call op(i) for i in range(count) in `threads` threads
+
+    :return: (list of latencies of successful ops in seconds, number of ops failed with ApiError)
+    """
+
+    def call(i):
+        started = time.perf_counter()
+        try:
+            op(i)
+        except ApiError:
+            return None
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = list(executor.map(call, range(count)))
+
+    return [latency for latency in latencies if latency is not None], latencies.count(None)
+
+
+def group_path(name):
+    return {'linux': '/data/' + name, 'win': 'C:\\\\data\\\\' + name, 'osx': '/data/' + name}
+
+
+def workflow_provisioning(mc, args):
+    # create a group of agents and a job distributing to it, like onboarding a new site
+    with ConnectApiExample(mc.address, mc.token, pool_maxsize=args.threads) as api:
+        agents_ids = [agent['id'] for agent in api.get_agents()]
+
+        def op(i):
+            group_id = api.create_group('Site {}'.format(i), agents_ids[i % len(agents_ids)::50])
+            if group_id is None:
+                raise ApiError('Failed to create group')
+            groups_data = [{'id': group_id, 'path': group_path('site'), 'permission': 'ro'}]
+            api.create_job('Provision site {}'.format(i), 'distribution', groups_data=groups_data)
+
+        latencies, errors = timed_ops(op, args.ops, args.threads)
+        return latencies, errors, {}
+
+
+def workflow_distribute_folder(mc, args):
+    src = {'id': 1, 'path': group_path('src'), 'permission': 'rw'}
+    dst = [{'id': 2, 'path': group_path('dst'), 'permission': 'ro'}]
+
+    with ConnectApiExample(mc.address, mc.token, pool_maxsize=args.threads) as api:
+        def op(i):
+            api.distribute_folder('Distribute {}'.format(i), '', src, dst)
+
+        latencies, errors = timed_ops(op, args.ops, args.threads)
+        return latencies, errors, {}
+
+
+def workflow_inventory(mc, args):
+    # keep agents list of every refresh, like a dashboard holding history; memory pass shows the size of kept
+    # agents, compact models by default or decoded dicts with --dicts
+    kept = []
+    with ConnectApiExample(mc.address, mc.token, pool_maxsize=args.threads) as api:
+        def op(i):
+            if args.dicts:
+                kept.append(api._get_agents())
+            else:
+                kept.append(api._get_agents(model=Agent, fields=AGENT_FIELDS))
+
+        latencies, errors = timed_ops(op, args.ops, args.threads)
+        return latencies, errors, {'models': not args.dicts}
+
+
+def workflow_monitor_runs(mc, args):
+    # start runs with Python3 client, then wait for all of them with legacy monitor engine
+    if LEGACY_CLIENT_DIR not in sys.path:
+        sys.path.append(LEGACY_CLIENT_DIR)
+    import communication
+    import jobs
+
+    finish_times = {}
+    with ConnectApiExample(mc.address, mc.token, pool_maxsize=args.threads) as api:
+        job_id = api.create_job('Monitored job', 'distribution',
+                                groups_data=[{'id': 1, 'path': group_path('src'), 'permission': 'rw'}])
+
+        def start(_):
+            run_id = api._create_job_run({'job_id': job_id})
+            finish_times[run_id] = time.perf_counter() + args.run_duration
+
+        _, errors = timed_ops(start, args.runs, args.threads)
+
+    # the moment every run was reported finished minus the moment it actually finished
+    lags = []
+    lock = threading.Lock()
+
+    def status_changed(run_id, previous, status):
+        if status == 'finished':
+            with lock:
+                lags.append(max(0.0, time.perf_counter() - finish_times[run_id]))
+
+    scheme, host, port = mc.address.split(':')
+    communication.initializeMCParams(scheme + ':' + host, int(port), mc.token)
+    engine = jobs.jobRunMonitorEngine(workers=args.threads,
+                                      pollPolicy=jobs.adaptivePollPolicy(minInterval=0.1, maxInterval=2))
+    engine.start()
+    try:
+        for run_id in finish_times:
+            engine.addRun(run_id, lambda job_id: None, status_changed, monitorInterval=1)
+        engine.waitForAll()
+    finally:
+        engine.stop()
+
+    return lags, errors, {'runs': args.runs}
+
+
+WORKFLOWS = {
+    'provisioning': workflow_provisioning,
+    'distribute_folder': workflow_distribute_folder,
+    'inventory': workflow_inventory,
+    'monitor_runs': workflow_monitor_runs,
+}
+
+
+def code_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def previous_result(path, workflow, params):
+    previous = None
+    try:
+        with open(path) as f:
+            for line in f:
+                result = json.loads(line)
+                if result['workflow'] == workflow and result['params'] == params:
+                    previous = result
+    except FileNotFoundError:
+        pass
+    return previous
+
+
+def run_workflow(name, args):
+    options = dict(agents=args.agents, latency=args.latency, error_rate=args.error_rate, padding=args.padding,
+                   run_duration=args.run_duration)
+
+    with MockMcProcess(**options) as mc:
+        started = time.perf_counter()
+        latencies, errors, params = WORKFLOWS[name](mc, args)
+        elapsed = time.perf_counter() - started
+        served = requests.get(mc.address + '/_mock/stats').json()['requests']
+
+    peak_memory = None
+    if args.memory:
+        # separate pass: tracemalloc slows allocations down and would distort timings
+        with MockMcProcess(**options) as mc:
+            tracemalloc.start()
+            try:
+                WORKFLOWS[name](mc, args)
+                peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+    params = dict(params, mock=options, ops=len(latencies), threads=args.threads)
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'version': args.label or code_version(),
+        'python': platform.python_version(),
+        'workflow': name,
+        'params': params,
+        'seconds': elapsed,
+        'errors': errors,
+        'throughput': len(latencies) / elapsed,
+        'requests': sum(served.values()),
+        'requests_per_second': sum(served.values()) / elapsed,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'peak_memory': peak_memory,
+    }
+
+
+def benchmark_workflows(args):
+    requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
+    if not args.log:
+        logger.logger.setLevel(logging.WARNING)
+
+    for name in args.workflows.split(','):
+        result = run_workflow(name, args)
+        previous = previous_result(args.results, name, result['params'])
+
+        print('{workflow}: {throughput:.1f} ops/s, {requests_per_second:.1f} req/s, '
+              'p50 {p50:.4f}s, p99 {p99:.4f}s, {errors} failed'.format(**result), end='')
+        if result['peak_memory'] is not None:
+            print(', peak memory {:.1f} MB'.format(result['peak_memory'] / 1e6), end='')
+        print()
+        if previous is not None:
+            print('    vs {}: throughput {:+.1f}%, p99 {:+.1f}%'.format(
+                previous['version'],
+                100.0 * (result['throughput'] / previous['throughput'] - 1),
+                100.0 * (result['p99'] / previous['p99'] - 1) if previous['p99'] else 0.0))
+
+        with open(args.results, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', nargs='?', default='pool', choices=('pool', 'codec', 'workflows'))
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--agents', type=int, default=100, help='number of agents in /agents and run payloads')
+    parser.add_argument('--certfile', help='serve mock MC over TLS with this certificate')
+    parser.add_argument('--keyfile')
+    parser.add_argument('--payload', help='codec mode: captured API response to decode instead of generated ones')
+    parser.add_argument('--rounds', type=int, default=20, help='codec mode: number of measurements per codec')
+    parser.add_argument('--workflows', default=','.join(WORKFLOWS), help='workflows mode: comma separated names')
+    parser.add_argument('--ops', type=int, default=200,
+                        help='workflows mode: provisioning/distribute_folder/inventory calls')
+    parser.add_argument('--runs', type=int, default=500, help='workflows mode: number of monitored runs')
+    parser.add_argument('--run-duration', type=float, default=3.0, help='workflows mode: seconds every run takes')
+    parser.add_argument('--latency', type=float, default=0.0, help='workflows mode: mock MC response delay')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='workflows mode: fraction of 503 responses')
+    parser.add_argument('--padding', type=int, default=0, help='workflows mode: bytes added to every API object')
+    parser.add_argument('--dicts', action='store_true', help='workflows mode: inventory keeps decoded agent dicts '
+                                                             'instead of models')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='workflows mode: skip memory pass')
+    parser.add_argument('--results', default='benchmark_results.jsonl', help='workflows mode: file results are '
+                                                                             'appended to')
+    parser.add_argument('--log', action='store_true', help='workflows mode: keep info logs of the client')
+    parser.add_argument('--label', help='workflows mode: version label of results, git describe by default')
+    args = parser.parse_args()
+
+    if args.mode == 'codec':
+        benchmark_codecs(args)
+    elif args.mode == 'workflows':
+        benchmark_workflows(args)
+    else:
+        benchmark_pool(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import contextvars
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# default number of requests bulk operations send at once
+DEFAULT_BULK_WORKERS = 8
+
+# group attributes holding lists of {'id': ...} items which are merged by bulk updates
+MERGED_LIST_ATTRS = ('agents', 'jobs')
+
+
+class BulkItemResult:
+    __slots__ = ('item', 'id', 'error', 'latency')
+
+    def __init__(self, item, id=None, error=None, latency=0.0):
+        """
+        :param item: input item of bulk operation
+        :param id: ID of created or changed object
+        :param error: exception raised by the operation, usually ApiError, None if it succeeded
+        :param latency: operation time in seconds
+        """
+
+        self.item = item
+        self.id = id
+        self.error = error
+        self.latency = latency
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return 'BulkItemResult(id={!r}, error={!r}, latency={:.3f})'.format(self.id, self.error, self.latency)
+
+
+def run_bulk(func, items, max_workers=DEFAULT_BULK_WORKERS):
+    """
+    Call func(item) for every item concurrently
+
+    :param func: function returning ID of created/changed object, raising ApiError on failure. Any exception it
+        raises, e.g. KeyError of a malformed item, fails only its own item
+    :param items: iterable of items
+    :param max_workers: max number of concurrent calls
+    :return: list of BulkItemResult in the same order as items
+    """
+
+    def call(item):
+        started = time.perf_counter()
+        try:
+            result = BulkItemResult(item, id=func(item))
+        except Exception as e:
+            result = BulkItemResult(item, error=e)
+        result.latency = time.perf_counter() - started
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # calls keep the operation context of the caller, see logger.operation()
+        futures = [executor.submit(contextvars.copy_context().run, call, item) for item in items]
+        return [future.result() for future in futures]
+
+
+def merge_group_updates(updates):
+    """
+    Merge updates of the same group into one, so that it's sent with a single PUT
+
+    Lists of agents and jobs are concatenated (item with the same id is replaced by the later one),
+    other attributes are overwritten by later updates.
+
+    :param updates: iterable of (group_id, attrs) pairs
+    :return: list of (group_id, attrs) pairs, one per group, in order of first appearance
+    """
+
+    merged = OrderedDict()
+    for group_id, attrs in updates:
+        group = merged.setdefault(group_id, {})
+        for key, value in attrs.items():
+            if key in MERGED_LIST_ATTRS and key in group:
+                items = OrderedDict((item['id'], item) for item in group[key])
+                items.update((item['id'], item) for item in value)
+                group[key] = list(items.values())
+            else:
+                group[key] = list(value) if key in MERGED_LIST_ATTRS else value
+
+    return list(merged.items())
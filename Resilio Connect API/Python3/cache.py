@@ -0,0 +1,178 @@
+import threading
+import time
+from collections import OrderedDict
+
+from routes import route_template
+
+# seconds to keep responses of read-heavy endpoints, route templates not listed here are not cached
+DEFAULT_TTLS = {
+    '/agents': 30,
+    '/agents/{id}': 30,
+    '/agents/config': 300,
+    '/groups': 30,
+    '/groups/{id}': 30,
+    '/jobs': 30,
+    '/jobs/{id}': 30,
+    '/jobs/{id}/groups': 30,
+}
+
+# collections whose cached responses may change when an object of the key collection is changed:
+# group membership is reported by agents and jobs, job assignments by groups
+DEPENDENT_COLLECTIONS = {
+    'agents': ('agents', 'groups', 'jobs'),
+    'groups': ('groups', 'agents', 'jobs'),
+    'jobs': ('jobs', 'groups', 'runs'),
+    'runs': ('runs',),
+}
+
+
+def _collection(path):
+    return path.lstrip('/').split('/', 1)[0].split('?', 1)[0]
+
+
+class CacheEntry:
+    __slots__ = ('data', 'etag', 'last_modified', 'expires', 'collection')
+
+    def __init__(self, data, etag, last_modified, expires, collection):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+        self.collection = collection
+
+    @property
+    def fresh(self):
+        return time.monotonic() < self.expires
+
+    def validators(self):
+        """
+        Headers for conditional request revalidating this entry
+        """
+
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    LRU cache of decoded GET responses with per-endpoint TTL
+
+    Expired entries having ETag or Last-Modified are revalidated with conditional request instead of downloading
+    the whole payload again. Entries are invalidated when the client owning the cache changes related objects.
+    Cached data is shared between callers and must not be modified.
+    """
+
+    def __init__(self, ttls=None, max_entries=256):
+        """
+        :param ttls: dict {route template: TTL in seconds}, see DEFAULT_TTLS and routes.route_template()
+        :param max_entries: max number of cached responses, least recently used ones are evicted first
+        """
+
+        self._ttls = DEFAULT_TTLS if ttls is None else ttls
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(path, params=None, base_url=None, token=None):
+        """
+        Key of GET request. MC address and token are part of it, so that clients sharing the cache never get
+        responses of another MC or token
+
+        :return: (base_url, token, path with sorted params)
+        """
+
+        if params:
+            path = '{}?{}'.format(path, '&'.join('{}={}'.format(k, params[k]) for k in sorted(params)))
+        return base_url, token, path
+
+    def ttl(self, path):
+        return self._ttls.get(route_template(path))
+
+    def lookup(self, key):
+        """
+        Get cached entry, fresh or expired
+
+        :return: CacheEntry or None
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.fresh:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return entry
+
+    def store(self, key, data, response):
+        """
+        Cache decoded response if its endpoint has TTL
+        """
+
+        path = key[2]
+        ttl = self.ttl(path)
+        if not ttl:
+            return
+
+        entry = CacheEntry(data, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                           time.monotonic() + ttl, _collection(path))
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def revalidated(self, key, entry):
+        """
+        Prolong entry after MC responded 304 Not Modified
+        """
+
+        with self._lock:
+            self.revalidations += 1
+            entry.expires = time.monotonic() + (self.ttl(key[2]) or 0)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+
+    def invalidate(self, path=None, base_url=None):
+        """
+        Drop entries which may be changed by modification of `path`, or all entries if path is None
+
+        :param base_url: drop only entries of this MC, entries of all MCs if None
+        """
+
+        with self._lock:
+            if path is None:
+                dropped = [key for key in self._entries if base_url is None or key[0] == base_url]
+            else:
+                collection = _collection(path)
+                dependent = DEPENDENT_COLLECTIONS.get(collection, (collection, ))
+                dropped = [key for key, entry in self._entries.items()
+                           if entry.collection in dependent and (base_url is None or key[0] == base_url)]
+
+            for key in dropped:
+                del self._entries[key]
+            self.invalidations += len(dropped)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+            }
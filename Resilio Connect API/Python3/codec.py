@@ -0,0 +1,79 @@
+import json
+from json import JSONDecodeError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JsonCodec:
+    """
+    JSON encoder/decoder working with bytes. Decode errors are always raised as json.JSONDecodeError
+    """
+
+    name = 'json'
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+
+    def loads(self, data):
+        # orjson.JSONDecodeError is a subclass of json.JSONDecodeError
+        return orjson.loads(data)
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+class UjsonCodec(JsonCodec):
+    name = 'ujson'
+
+    def loads(self, data):
+        try:
+            return ujson.loads(data)
+        except ValueError as e:
+            raise JSONDecodeError(str(e), data.decode('utf-8', errors='replace') if isinstance(data, bytes) else data, 0)
+
+    def dumps(self, obj):
+        return ujson.dumps(obj, ensure_ascii=False).encode()
+
+
+CODECS = {
+    'orjson': (OrjsonCodec, orjson),
+    'ujson': (UjsonCodec, ujson),
+    'json': (JsonCodec, json),
+}
+
+
+def get_codec(name=None):
+    """
+    Get JSON codec by name or the fastest installed one: orjson, ujson, stdlib json
+
+    :param name: 'orjson', 'ujson', 'json' or None for auto selection
+    :return: JsonCodec instance
+    """
+
+    if name is not None:
+        codec_class, module = CODECS[name]
+        if module is None:
+            raise ImportError('{} is not installed'.format(name))
+        return codec_class()
+
+    for codec_class, module in CODECS.values():
+        if module is not None:
+            return codec_class()
+
+
+default_codec = get_codec()
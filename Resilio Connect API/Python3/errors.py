@@ -8,3 +8,24 @@ class ApiConnectionError(ApiError):
 
 class ApiUnauthorizedError(ApiError):
     pass
+
+
+class ApiNotFoundError(ApiError):
+    pass
+
+
+def api_error_for_status(status_code, message):
+    """
+    Map failed Management Console response to exception
+
+    :param status_code: HTTP status code, >= 400
+    :param message: error message from response body
+    :return: ApiError instance
+    """
+
+    if status_code == 401:
+        return ApiUnauthorizedError(message)
+    if status_code == 404:
+        return ApiNotFoundError(message)
+
+    return ApiError(message)
@@ -3,17 +3,26 @@ import time
 from json import JSONDecodeError
 import requests
 
+from agent_directory import AgentDirectory
 from api import ApiBaseCommands
-from errors import ApiError
-from logger import logger
+from bulk import DEFAULT_BULK_WORKERS, merge_group_updates, run_bulk
+from errors import ApiError, ApiUnauthorizedError
+from logger import logger, operation
+from models import Agent
+from watcher import RunWatcher
 
 
 AGENT_API_PORT = 3840
+# agent fields returned by get_agents()
+AGENT_FIELDS = ('id', 'name', 'ip', 'os')
+# polls of a run failing in a row after which watch_transfer_status() gives up
+DEFAULT_MAX_POLL_FAILURES = 5
 
 
 class ConnectApiExample(ApiBaseCommands):
-    def __init__(self, address, token, verify=False):
-        super(ConnectApiExample, self).__init__(address, token, verify)
+    def __init__(self, address, token, verify=False, **kwargs):
+        super(ConnectApiExample, self).__init__(address, token, verify, **kwargs)
+        self._agent_directory = None
 
         if not verify:
             from requests.packages.urllib3.exceptions import InsecureRequestWarning
@@ -23,31 +32,41 @@ class ConnectApiExample(ApiBaseCommands):
         """
         Get list of all agents
 
-        :return: tuple with dict items or None in case of error:
-        {
-            'id': '<agent_id>',
-            'name': '<agent_name>',
-            'ip': '<agent_ip>',
-            'os': '<agent_os>'
-        }
+        :return: tuple of models.Agent with id, name, ip and os fields or None in case of error. Fields are read
+            as attributes or as keys: agent.id, agent['id']
         """
 
         try:
-            agents = self._get_agents()
+            # only listed fields are kept, decoded agents are freed
+            agents = self._get_agents(model=Agent, fields=AGENT_FIELDS)
         except ApiError as e:
-            logger.error("Failed to fetch list of agents {}".format(e))
+            logger.error("Failed to fetch list of agents %s", e)
             return None
         else:
             logger.info("Successfully fetched list of agents")
-            return tuple(
-                {
-                    'id': agent['id'],
-                    'name': agent['name'],
-                    'ip': agent['ip'],
-                    'os': agent['os']
-                } for agent in agents
-            )
+            return tuple(agents)
+
+    def get_agent_directory(self, refresh=False):
+        """
+        Get indexed directory of all agents, see AgentDirectory
+
+        :param refresh: re-fetch agents list from MC and apply changes to the directory
+        :return: AgentDirectory or None in case of error
+        """
+
+        try:
+            if self._agent_directory is None:
+                self._agent_directory = AgentDirectory.from_api(self)
+            elif refresh:
+                changes = self._agent_directory.refresh(self._get_agents())
+                logger.debug("Agent directory refreshed: %s", changes)
+        except ApiError as e:
+            logger.error("Failed to fetch list of agents %s", e)
+            return None
 
+        return self._agent_directory
+
+    @operation('create_group')
     def create_group(self, name, agents_ids, description=''):
         """
         Create group with agents
@@ -71,14 +90,15 @@ class ConnectApiExample(ApiBaseCommands):
 
         try:
             group_id = self._create_group(attrs)
-            logger.debug("Created group with ID {}".format(group_id))
+            logger.debug("Created group with ID %s", group_id)
         except ApiError as e:
-            logger.error("Failed to create group: {}".format(e))
+            logger.error("Failed to create group: %s", e)
             return None
         else:
-            logger.info("Successfully created group {}".format(attrs['name']))
+            logger.info("Successfully created group %s", attrs['name'])
             return group_id
 
+    @operation('delete_group')
     def delete_group(self, group_id):
         """
         Delete group by id
@@ -89,14 +109,15 @@ class ConnectApiExample(ApiBaseCommands):
 
         try:
             self._delete_group(group_id)
-            logger.debug("Deleted group with id {}".format(group_id))
+            logger.debug("Deleted group with id %s", group_id)
         except ApiError as e:
-            logger.error("Failed to delete group {}".format(e))
+            logger.error("Failed to delete group %s", e)
             return False
         else:
-            logger.info("Successfully deleted group {}".format(group_id))
+            logger.info("Successfully deleted group %s", group_id)
             return True
 
+    @operation('add_agents_to_group')
     def add_agents_to_group(self, group_id, agents_ids):
         """
         Add new agents to existed group
@@ -118,10 +139,10 @@ class ConnectApiExample(ApiBaseCommands):
         try:
             self._update_group(group_id, attrs)
         except ApiError as e:
-            logger.error("Failed to add agents to group {}, {}".format(group_id, e))
+            logger.error("Failed to add agents to group %s, %s", group_id, e)
             return False
         else:
-            logger.info("Successfully added agents to group {}".format(group_id))
+            logger.info("Successfully added agents to group %s", group_id)
             return True
 
     def get_group_agents(self, group_id):
@@ -136,12 +157,13 @@ class ConnectApiExample(ApiBaseCommands):
             response = self._get_group(group_id)
             agents_ids = tuple(d["id"] for d in response["agents"])
         except ApiError as e:
-            logger.error("Failed to get group agents {}".format(e))
+            logger.error("Failed to get group agents %s", e)
             return None
         else:
             logger.info("Successfully fetched group agents")
             return agents_ids
 
+    @operation('create_job')
     def create_job(self, job_name, job_type, description=None, groups_data=None):
         """
         Create a job
@@ -180,14 +202,15 @@ class ConnectApiExample(ApiBaseCommands):
 
         try:
             job_id = self._create_job(attrs)
-            logger.debug("Created job with ID {}".format(job_id))
+            logger.debug("Created job with ID %s", job_id)
         except ApiError as e:
-            logger.error("Failed to create job {}".format(e))
+            logger.error("Failed to create job %s", e)
             return None
         else:
             logger.info("Successfully created job")
             return job_id
 
+    @operation('create_job_run')
     def create_job_run(self, job_id):
         """
         Create run for a job
@@ -202,14 +225,15 @@ class ConnectApiExample(ApiBaseCommands):
 
         try:
             job_run_id = self._create_job_run(attrs)
-            logger.debug("Created job run {}".format(job_run_id))
+            logger.debug("Created job run %s", job_run_id)
         except ApiError as e:
-            logger.error("Failed to create job run {}".format(e))
+            logger.error("Failed to create job run %s", e)
             return None
         else:
-            logger.info("Successfully created job run {}".format(job_run_id))
+            logger.info("Successfully created job run %s", job_run_id)
             return job_run_id
 
+    @operation('assign_jobs_to_group')
     def assign_jobs_to_group(self, group_id, jobs_data):
         """
         Assign existing jobs to existing group
@@ -235,12 +259,13 @@ class ConnectApiExample(ApiBaseCommands):
         try:
             self._update_group(group_id, attrs)
         except ApiError as e:
-            logger.error("Failed to assign jobs to group {}".format(e))
+            logger.error("Failed to assign jobs to group %s", e)
             return False
         else:
             logger.info("Successfully assigned jobs to group")
             return True
 
+    @operation('distribute_folder')
     def distribute_folder(self, job_name, job_desc, src_group_data, dst_groups_data):
         """
         Distribute folder from src to dst
@@ -298,28 +323,21 @@ class ConnectApiExample(ApiBaseCommands):
         """
 
         try:
-            job_run_agents = self._get_job_run_agents(job_run_id)
-            logger.debug("Job run agents: {}".format(job_run_agents))
-        except ApiError as e:
-            logger.error("Failed to get agents info for job run {}".format(e))
-            return None
-        else:
-            logger.info("Successfully get agents info for job run {}".format(job_run_id))
-
-            if agents_ids is None:
-                return tuple(
-                    {
-                        "agent_id": item["agent_id"],
-                        "job_run_status": item["status"]
-                    } for item in job_run_agents["data"]
-                )
-
-            return tuple(
+            # agents are fetched page by page, so that only the selected fields of big runs are kept in memory
+            statuses = tuple(
                 {
                     "agent_id": item["agent_id"],
                     "job_run_status": item["status"]
-                } for item in job_run_agents["data"] if item["agent_id"] in agents_ids
+                } for item in self.iter_job_run_agents(job_run_id)
+                if agents_ids is None or item["agent_id"] in agents_ids
             )
+            logger.debug("Job run agents statuses: %s", statuses)
+        except ApiError as e:
+            logger.error("Failed to get agents info for job run %s", e)
+            return None
+        else:
+            logger.info("Successfully get agents info for job run %s", job_run_id)
+            return statuses
 
     def _get_local_agent_id(self):
         """
@@ -335,14 +353,15 @@ class ConnectApiExample(ApiBaseCommands):
             logger.error(e)
             return None
 
-        all_agents = self._get_agents()
-        logger.debug("All agents: {}".format(all_agents))
+        directory = self.get_agent_directory()
+        agent = directory.by_deviceid(local_device_id) if directory is not None else None
 
-        for a in all_agents:
-            if a["deviceid"] == local_device_id:
-                return a["id"]
+        if agent is None:
+            # agent may have been added after directory was built
+            directory = self.get_agent_directory(refresh=True)
+            agent = directory.by_deviceid(local_device_id) if directory is not None else None
 
-        return None
+        return agent["id"] if agent is not None else None
 
     def check_transfer_status_of_local_agent(self, job_run_id):
         """
@@ -363,7 +382,7 @@ class ConnectApiExample(ApiBaseCommands):
         try:
             job_run_local_agent = self._get_job_run_agent(job_run_id, local_agent_id)
         except ApiError as e:
-            logger.error("Failed to fetch job run for local agent {}".format(e))
+            logger.error("Failed to fetch job run for local agent %s", e)
             return None
         else:
             logger.info("Successfully fetched job run for local agent")
@@ -378,14 +397,202 @@ class ConnectApiExample(ApiBaseCommands):
         """
 
         try:
-            job_run_agents = self._get_job_run_agents(job_run_id)
+            agents_ids = tuple(agent['agent_id'] for agent in self.iter_job_run_agents(job_run_id))
         except ApiError as e:
-            logger.error("Failed to get agents info for job run {}".format(e))
+            logger.error("Failed to get agents info for job run %s", e)
             return None
         else:
-            logger.info("Successfully get agents info for job run {}".format(job_run_id))
+            logger.info("Successfully get agents info for job run %s", job_run_id)
+
+        return agents_ids
+
+    def watch_transfer_status(self, job_run_ids, interval=5, max_failures=DEFAULT_MAX_POLL_FAILURES):
+        """
+        Watch job runs and yield only changes instead of full statuses of all agents
+
+        :param job_run_ids: iterable object with Job Run IDs
+        :param interval: seconds between polls
+        :param max_failures: number of polls of a run failing in a row after which its ApiError is raised.
+            ApiUnauthorizedError is raised right away, polling with rejected token can't succeed
+        :return: generator of watcher.RunEvent, ends after all runs are done or removed:
+            'status', 'progress' and 'error' events of agents, 'run' events with totals, throughput and ETA,
+            'done' or 'removed' event per run
+        """
+
+        watcher = RunWatcher(self, interval)
+        for job_run_id in job_run_ids:
+            watcher.watch(job_run_id)
+
+        # {run id: number of polls failed in a row}
+        failures = {}
+        while watcher.watched():
+            started = time.monotonic()
+            for job_run_id in watcher.watched():
+                try:
+                    events = watcher.poll_run(job_run_id)
+                except ApiUnauthorizedError:
+                    raise
+                except ApiError as e:
+                    failures[job_run_id] = failures.get(job_run_id, 0) + 1
+                    logger.error("Failed to poll job run %s agents (%d in a row) %s", job_run_id,
+                                 failures[job_run_id], e)
+                    if failures[job_run_id] >= max_failures:
+                        raise
+                    continue
+                failures.pop(job_run_id, None)
+                for event in events:
+                    yield event
+            if watcher.watched():
+                time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    # Bulk operations
+    def _log_bulk_results(self, action, results):
+        failed = [r for r in results if not r.ok]
+        for r in failed:
+            logger.error("Failed to %s %s: %s", action, r.item, r.error)
+        logger.info("%s: %s succeeded, %s failed", action, len(results) - len(failed), len(failed))
+
+    @operation('create_groups')
+    def create_groups(self, groups, max_workers=DEFAULT_BULK_WORKERS):
+        """
+        Create several groups concurrently
+
+        :param groups: iterable of dict items with create_group() arguments:
+        {
+            'name': <group_name>,
+            'agents_ids': <agent IDs iterable object>,
+            'description': <group_description>  # optional
+        }
+        :param max_workers: max number of concurrent requests
+        :return: list of BulkItemResult with group IDs, in the same order as groups
+        """
+
+        def create(group):
+            return self._create_group({
+                'name': group['name'],
+                'description': group.get('description', ''),
+                'agents': [
+                    {'id': agent_id} for agent_id in group.get('agents_ids', ())
+                ]
+            })
+
+        results = run_bulk(create, groups, max_workers)
+        self._log_bulk_results("create group", results)
+        return results
+
+    @operation('update_groups')
+    def update_groups(self, updates, max_workers=DEFAULT_BULK_WORKERS):
+        """
+        Update several groups concurrently. Updates of the same group are merged and sent with one request
+
+        :param updates: iterable of (group_id, attrs) pairs, attrs are the same as for _update_group()
+        :param max_workers: max number of concurrent requests
+        :return: list of BulkItemResult with group IDs, one per group
+        """
+
+        def update(group_update):
+            group_id, attrs = group_update
+            self._update_group(group_id, attrs)
+            return group_id
+
+        results = run_bulk(update, merge_group_updates(updates), max_workers)
+        self._log_bulk_results("update group", results)
+        return results
+
+    @operation('add_agents_to_groups')
+    def add_agents_to_groups(self, assignments, max_workers=DEFAULT_BULK_WORKERS):
+        """
+        Add agents to several groups concurrently
+
+        :param assignments: iterable of (group_id, agents_ids) pairs
+        :param max_workers: max number of concurrent requests
+        :return: list of BulkItemResult with group IDs, one per group
+        """
+
+        return self.update_groups(
+            ((group_id, {'agents': [{'id': agent_id} for agent_id in agents_ids]})
+             for group_id, agents_ids in assignments),
+            max_workers
+        )
+
+    @operation('assign_jobs_to_groups')
+    def assign_jobs_to_groups(self, assignments, max_workers=DEFAULT_BULK_WORKERS):
+        """
+        Assign jobs to several groups concurrently
+
+        :param assignments: iterable of (group_id, jobs_data) pairs, see assign_jobs_to_group()
+        :param max_workers: max number of concurrent requests
+        :return: list of BulkItemResult with group IDs, one per group
+        """
+
+        return self.update_groups(
+            ((group_id, {'jobs': list(jobs_data)}) for group_id, jobs_data in assignments),
+            max_workers
+        )
+
+    @operation('delete_groups')
+    def delete_groups(self, group_ids, max_workers=DEFAULT_BULK_WORKERS):
+        """
+        Delete several groups concurrently
+
+        :param group_ids: iterable of group IDs
+        :param max_workers: max number of concurrent requests
+        :return: list of BulkItemResult with group IDs
+        """
+
+        def delete(group_id):
+            self._delete_group(group_id)
+            return group_id
+
+        results = run_bulk(delete, group_ids, max_workers)
+        self._log_bulk_results("delete group", results)
+        return results
+
+    @operation('create_jobs')
+    def create_jobs(self, jobs, max_workers=DEFAULT_BULK_WORKERS):
+        """
+        Create several jobs concurrently
+
+        :param jobs: iterable of dict items with create_job() arguments:
+        {
+            'job_name': <job_name>,
+            'job_type': <job_type>,
+            'description': <job_description>,  # optional
+            'groups_data': <groups_data>  # optional
+        }
+        :param max_workers: max number of concurrent requests
+        :return: list of BulkItemResult with job IDs, in the same order as jobs
+        """
 
-        return tuple(agent['agent_id'] for agent in job_run_agents["data"])
+        def create(job):
+            return self._create_job({
+                'name': job['job_name'],
+                'type': job['job_type'],
+                'description': job.get('description') or '',
+                'groups': list(job.get('groups_data') or [])
+            })
+
+        results = run_bulk(create, jobs, max_workers)
+        self._log_bulk_results("create job", results)
+        return results
+
+    @operation('delete_jobs')
+    def delete_jobs(self, job_ids, max_workers=DEFAULT_BULK_WORKERS):
+        """
+        Delete several jobs concurrently
+
+        :param job_ids: iterable of job IDs
+        :param max_workers: max number of concurrent requests
+        :return: list of BulkItemResult with job IDs
+        """
+
+        def delete(job_id):
+            self._delete_job(job_id)
+            return job_id
+
+        results = run_bulk(delete, job_ids, max_workers)
+        self._log_bulk_results("delete job", results)
+        return results
 
 
 if __name__ == "__main__":
@@ -396,7 +603,7 @@ if __name__ == "__main__":
 
     # print all agents
     agents = connect_api.get_agents()
-    print(json.dumps(agents, indent=4, sort_keys=True))
+    print(json.dumps([agent.as_dict() for agent in agents], indent=4, sort_keys=True))
 
     # create src group
     src_group_id = connect_api.create_group("Src group", (1, 107, 128, 143, 194), description='Source group')
@@ -472,3 +679,5 @@ if __name__ == "__main__":
     """
     job_run_status_for_local_agent = connect_api.check_transfer_status_of_local_agent(job_run_id)
     print(job_run_status_for_local_agent)
+
+    connect_api.close()
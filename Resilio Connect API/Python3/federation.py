@@ -0,0 +1,175 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from examples import ConnectApiExample
+from logger import logger
+
+# attribute added to every record returned by FederatedClient
+DEFAULT_TAG = 'mc'
+# client arguments holding state of a single MC, built for every MC by factories
+PER_TARGET_KWARGS = ('cache', 'snapshot', 'throttle')
+
+
+class FederatedResult:
+    """
+    Result of a call made on every Management Console
+
+    records - merged list of records, each one tagged with name of MC it came from
+    results - {mc name: raw result} of MCs which answered
+    errors - {mc name: exception} of MCs which failed
+    latencies - {mc name: seconds} of every MC
+    elapsed - wall time of the whole call
+    """
+
+    __slots__ = ('records', 'results', 'errors', 'latencies', 'elapsed')
+
+    def __init__(self):
+        self.records = []
+        self.results = {}
+        self.errors = {}
+        self.latencies = {}
+        self.elapsed = 0.0
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __repr__(self):
+        return 'FederatedResult({} records, errors={!r}, elapsed={:.3f})'.format(len(self.records), self.errors,
+                                                                                 self.elapsed)
+
+
+class FederatedClient:
+    """
+    Sends the same call to several Management Consoles at once and merges the results
+
+    Total time of a call is the latency of the slowest MC instead of the sum of all of them. MCs which fail
+    don't fail the call, their errors are reported in FederatedResult.errors.
+    """
+
+    def __init__(self, targets, tag=DEFAULT_TAG, client_class=ConnectApiExample, factories=None, **client_kwargs):
+        """
+        :param targets: iterable of (address, token, verify) tuples, MCs are named by their addresses,
+            or dict {name: (address, token, verify)}
+        :param tag: name of attribute added to records, holds MC name
+        :param client_class: ApiBaseCommands subclass created for every MC
+        :param factories: {client argument: callable(mc name)} building a separate object for every MC, e.g.
+            {'throttle': lambda name: Throttle(), 'snapshot': lambda name: InventorySnapshot(name + '.db')}
+        :param client_kwargs: other client arguments shared by all MCs, e.g. retry, hooks or single_flight.
+            cache, snapshot and throttle keep state of one MC and are accepted only in factories
+        """
+
+        shared = sorted(set(client_kwargs) & set(PER_TARGET_KWARGS))
+        if shared:
+            raise ValueError("{} can't be shared between MCs, pass factories instead".format(', '.join(shared)))
+
+        if not isinstance(targets, dict):
+            targets = {target[0]: target for target in targets}
+
+        factories = factories or {}
+        self.tag = tag
+        self.clients = {}
+        for name, (address, token, verify) in targets.items():
+            kwargs = dict(client_kwargs, **{key: factory(name) for key, factory in factories.items()})
+            self.clients[name] = client_class(address, token, verify, **kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.clients)), thread_name_prefix='federation')
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for client in self.clients.values():
+            client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _tagged(self, name, result):
+        # records may be shared with response cache, tag copies
+        if isinstance(result, dict):
+            return [dict(result, **{self.tag: name})]
+        if result is None:
+            return []
+        return [dict(record, **{self.tag: name}) if isinstance(record, dict) else {self.tag: name, 'value': record}
+                for record in result]
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call client method on every MC concurrently
+
+        :param func: name of client method, e.g. '_get_agents', or function taking client as the first argument.
+            It should return a record or an iterable of records, any exception it raises is the MC's error
+        :return: FederatedResult
+        """
+
+        def call_one(item):
+            name, client = item
+            method = getattr(client, func) if isinstance(func, str) else lambda *a, **kw: func(client, *a, **kw)
+            started = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+                # generators (iter_* methods) are consumed here, in parallel with other MCs
+                if result is not None and not isinstance(result, (dict, list, tuple)):
+                    result = list(result)
+                error = None
+            # one failing MC must not fail the others, whatever the failure is
+            except Exception as e:
+                result, error = None, e
+            return name, result, error, time.perf_counter() - started
+
+        federated = FederatedResult()
+        started = time.perf_counter()
+        # calls keep the operation context of the caller, see logger.operation()
+        futures = [self._executor.submit(contextvars.copy_context().run, call_one, item)
+                   for item in self.clients.items()]
+        for name, result, error, latency in (future.result() for future in futures):
+            federated.latencies[name] = latency
+            if error is not None:
+                logger.error("Call %s failed on %s: %s", getattr(func, '__name__', func), name, error)
+                federated.errors[name] = error
+            else:
+                federated.results[name] = result
+                federated.records.extend(self._tagged(name, result))
+        federated.elapsed = time.perf_counter() - started
+
+        return federated
+
+    # Fleet-wide queries
+
+    def get_agents(self, **criteria):
+        """
+        Get agents of all MCs
+
+        :param criteria: attribute values agents must have, e.g. version='2.12.0', online=True
+        :return: FederatedResult
+        """
+
+        result = self.call('_get_agents')
+        if criteria:
+            result.records = [agent for agent in result.records
+                              if all(agent.get(key) == value for key, value in criteria.items())]
+        return result
+
+    def get_groups(self):
+        return self.call('_get_groups')
+
+    def get_jobs(self):
+        return self.call('_get_jobs')
+
+    def get_job_runs(self, attrs=None):
+        """
+        Get job runs of all MCs page by page, e.g. get_job_runs({'status': 'failed'})
+
+        :param attrs: filters of _get_job_runs()
+        :return: FederatedResult
+        """
+
+        return self.call('iter_job_runs', attrs)
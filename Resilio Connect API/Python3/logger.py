@@ -1,12 +1,171 @@
 from sys import stdout, stderr
+import atexit
+import contextvars
+import functools
+import inspect
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import time
+import uuid
 
 IS_DEBUG = os.getenv("DEBUG") == "1"
 
+# overflow policies of queue mode
+OVERFLOW_DROP = 'drop'
+OVERFLOW_BLOCK = 'block'
+
+# rotation of structured log file
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+# (correlation ID, operation path) of the operation in progress, see operation()
+_current_operation = contextvars.ContextVar('operation', default=None)
+
+
+class _Operation:
+    def __init__(self, name, correlation_id):
+        self.name = name
+        self.correlation_id = correlation_id
+        self._token = None
+
+    def __enter__(self):
+        parent = _current_operation.get()
+        if parent is None:
+            current = (self.correlation_id or uuid.uuid4().hex[:16], self.name)
+        else:
+            current = (self.correlation_id or parent[0], parent[1] + '/' + self.name)
+        self._token = _current_operation.set(current)
+        return current[0]
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _current_operation.reset(self._token)
+
+    def __call__(self, func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with _Operation(self.name, self.correlation_id):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Operation(self.name, self.correlation_id):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def operation(name, correlation_id=None):
+    """
+    Context manager or decorator of sync and async functions marking an operation made of several API calls.
+    Log and trace records made inside carry correlation ID shared with enclosing operations and operation path,
+    e.g. 'distribute_folder/create_job_run'.
+
+    The context follows calls in the same thread and asyncio tasks, thread pools must run tasks in
+    contextvars.copy_context()
+
+    :param name: operation name
+    :param correlation_id: ID to use instead of the one of enclosing operation or a new random one
+    :return: context manager returning correlation ID
+    """
+
+    return _Operation(name, correlation_id)
+
+
+def current_operation():
+    """
+    :return: (correlation ID, operation path) or None outside of operations
+    """
+
+    return _current_operation.get()
+
+
+class _OperationFilter(logging.Filter):
+    # runs in the thread making the log call, before the record is queued
+    def filter(self, record):
+        record.correlation_id, record.operation = _current_operation.get() or (None, None)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats record as one line JSON object: time, level, message, correlation_id and operation if the record was
+    made inside an operation, fields of trace records
+    """
+
+    def format(self, record):
+        entry = {
+            'time': '{}.{:03d}'.format(time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)),
+                                       int(record.msecs)),
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'correlation_id', None):
+            entry['correlation_id'] = record.correlation_id
+            entry['operation'] = record.operation
+        entry.update(getattr(record, 'trace', ()))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records to a bounded queue, drops them or waits for free space when the queue is full
+    """
+
+    def __init__(self, log_queue, overflow):
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def prepare(self, record):
+        # message is formatted by the listener thread, not by the thread making API calls,
+        # so arguments must not be modified after the logging call.
+        # exception is formatted here, so that queued records don't keep its frames alive
+        if record.exc_info:
+            record.exc_text = Logger.FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.overflow == OVERFLOW_BLOCK:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _RoutingQueueListener(logging.handlers.QueueListener):
+    """
+    Passes records of every logger to its own handler, like they were passed without the queue
+    """
+
+    def __init__(self, log_queue, routes):
+        super().__init__(log_queue, respect_handler_level=True)
+        # {logger name: handlers}, Logger changes it in place
+        self.routes = routes
+
+    def enqueue_sentinel(self):
+        # the queue may be full, wait until listener thread makes room
+        self.queue.put(self._sentinel)
+
+    def handle(self, record):
+        for handler in self.routes.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
 
 class Logger:
     FORMATTER = logging.Formatter('[ %(asctime)s ][ %(levelname)s ] %(message)s')
+    JSON_FORMATTER = JsonFormatter()
     LOG_LEVEL = logging.DEBUG if IS_DEBUG else logging.INFO
 
     def __init__(self):
@@ -32,6 +191,141 @@ class Logger:
 
         self.error_logger.addHandler(self.stderr_handler)
 
+        # trace logger, writes only in structured mode
+        self.trace_logger = logging.getLogger("trace")
+        self.trace_logger.setLevel(logging.INFO)
+        self.trace_logger.propagate = False
+
+        operation_filter = _OperationFilter()
+        for logger in (self.logger, self.error_logger, self.trace_logger):
+            logger.addFilter(operation_filter)
+
+        # handlers writing records of every logger
+        self._outputs = {self.logger.name: [self.stdout_handler],
+                         self.error_logger.name: [self.stderr_handler],
+                         self.trace_logger.name: []}
+
+        # structured mode
+        self.json_handler = None
+
+        # queue mode
+        self.queue_handler = None
+        self.listener = None
+        self._dropped = 0
+
+    def _install_handlers(self):
+        # attach handlers of _outputs, or the queue handler passing records to them in queue mode
+        for logger in (self.logger, self.error_logger, self.trace_logger):
+            for handler in list(logger.handlers):
+                if handler in (self.stdout_handler, self.stderr_handler, self.json_handler) or \
+                        isinstance(handler, _BoundedQueueHandler):
+                    logger.removeHandler(handler)
+            handlers = self._outputs[logger.name]
+            if self.queue_handler is not None and handlers:
+                handlers = [self.queue_handler]
+            for handler in handlers:
+                logger.addHandler(handler)
+
+    def start_structured(self, path=None, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT):
+        """
+        Write logs as JSON lines and enable trace records, see metrics.TraceLogHooks
+
+        :param path: file to write to in addition to stdout/stderr text logs, stdout/stderr logs become JSON if None
+        :param max_bytes: size of file after which it's rotated
+        :param backup_count: number of rotated files kept, path.1 is the newest one
+        """
+
+        if self.json_handler is not None:
+            self.stop_structured()
+
+        if path is None:
+            self.stdout_handler.setFormatter(self.JSON_FORMATTER)
+            self.stderr_handler.setFormatter(self.JSON_FORMATTER)
+            self._outputs[self.trace_logger.name] = [self.stdout_handler]
+        else:
+            self.json_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes,
+                                                                     backupCount=backup_count, encoding='utf-8')
+            self.json_handler.setFormatter(self.JSON_FORMATTER)
+            self._outputs[self.logger.name] = [self.stdout_handler, self.json_handler]
+            self._outputs[self.error_logger.name] = [self.stderr_handler, self.json_handler]
+            self._outputs[self.trace_logger.name] = [self.json_handler]
+        self._install_handlers()
+
+    def stop_structured(self):
+        """
+        Switch back to text logs and stop writing trace records
+        """
+
+        self.stdout_handler.setFormatter(self.FORMATTER)
+        self.stderr_handler.setFormatter(self.FORMATTER)
+        self._outputs[self.logger.name] = [self.stdout_handler]
+        self._outputs[self.error_logger.name] = [self.stderr_handler]
+        self._outputs[self.trace_logger.name] = []
+        self._install_handlers()
+        if self.json_handler is not None:
+            self.json_handler.close()
+            self.json_handler = None
+
+    @property
+    def structured(self):
+        return bool(self._outputs[self.trace_logger.name])
+
+    def start_queue(self, max_size=10000, overflow=OVERFLOW_DROP):
+        """
+        Write logs from a background thread, so that threads making API calls don't wait for slow consoles or pipes.
+        Records wait in a bounded queue, the queue is flushed by stop_queue() and at exit
+
+        :param max_size: max number of records waiting in the queue
+        :param overflow: OVERFLOW_DROP to lose records when the queue is full, OVERFLOW_BLOCK to wait for free space
+        """
+
+        if overflow not in (OVERFLOW_DROP, OVERFLOW_BLOCK):
+            raise ValueError("Unknown overflow policy {}".format(overflow))
+        if self.listener is not None:
+            self.stop_queue()
+
+        log_queue = queue.Queue(max_size)
+        self.queue_handler = _BoundedQueueHandler(log_queue, overflow)
+        self.listener = _RoutingQueueListener(log_queue, self._outputs)
+        self._install_handlers()
+        self.listener.start()
+        atexit.register(self.stop_queue)
+
+    def stop_queue(self):
+        """
+        Write records left in the queue and switch back to writing logs from calling threads
+        """
+
+        if self.listener is None:
+            return
+        atexit.unregister(self.stop_queue)
+        queue_handler, self.queue_handler = self.queue_handler, None
+        self._install_handlers()
+        self.listener.stop()
+        self.listener = None
+        for handlers in self._outputs.values():
+            for handler in handlers:
+                handler.flush()
+        if queue_handler.dropped:
+            self._dropped += queue_handler.dropped
+            self.warning("%s log records dropped, log queue was full", queue_handler.dropped)
+
+    @property
+    def dropped(self):
+        """
+        Number of records dropped by queue mode because the queue was full
+        """
+
+        return self._dropped + (self.queue_handler.dropped if self.queue_handler is not None else 0)
+
+    def trace(self, message, **fields):
+        """
+        Write trace record with fields, only in structured mode
+        """
+
+        if self._outputs[self.trace_logger.name]:
+            self.trace_logger.info(message, extra={'trace': fields})
+
     def error(self, *args, backtrace=False):
         self.error_logger.error(*args, exc_info=backtrace)
 
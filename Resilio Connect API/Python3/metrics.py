@@ -0,0 +1,311 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+
+from logger import logger
+from routes import route_template
+
+# latency histogram upper bounds in seconds
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class RequestCall:
+    """
+    Single attempt of API request passed to hooks
+
+    Attributes set before on_start(): method, path, route, attempt (1 for the first try), bytes_out, started.
+    Set before on_response(): status, bytes_in, elapsed. Set before on_error(): elapsed.
+    `context` is a dict hooks may use to keep their own per call state
+    """
+
+    __slots__ = ('method', 'path', 'route', 'attempt', 'bytes_out', 'started', 'status', 'bytes_in', 'elapsed',
+                 'context')
+
+    def __init__(self, method, path, attempt, bytes_out):
+        self.method = method
+        self.path = path
+        self.route = route_template(path)
+        self.attempt = attempt
+        self.bytes_out = bytes_out
+        self.started = time.perf_counter()
+        self.status = None
+        self.bytes_in = 0
+        self.elapsed = 0.0
+        self.context = {}
+
+    def __repr__(self):
+        return 'RequestCall({} {} attempt={} status={})'.format(self.method, self.route, self.attempt, self.status)
+
+
+class RequestHooks:
+    """
+    Base class of request hooks, pass instances to client in `hooks` list
+
+    Hooks are called for every attempt, so a retried request calls on_start() several times, and on_complete()
+    once after the last attempt. They run in the thread (or event loop) sending the request and must not raise
+    """
+
+    def on_start(self, call):
+        pass
+
+    def on_response(self, call):
+        pass
+
+    def on_error(self, call, error):
+        pass
+
+    def on_complete(self, call, elapsed, error):
+        """
+        :param call: RequestCall of the last attempt
+        :param elapsed: seconds since the first attempt, including retry delays
+        :param error: ApiError raised by the request or None
+        """
+
+        pass
+
+
+def call_hooks_start(hooks, method, path, attempt, data):
+    """
+    Create RequestCall and pass it to on_start() of hooks, used by sync and async clients
+    """
+
+    call = RequestCall(method, path, attempt, len(data) if isinstance(data, (bytes, str)) else 0)
+    for hook in hooks:
+        hook.on_start(call)
+    return call
+
+
+def call_hooks_response(hooks, call, status, bytes_in):
+    call.elapsed = time.perf_counter() - call.started
+    call.status = status
+    call.bytes_in = bytes_in
+    for hook in hooks:
+        hook.on_response(call)
+
+
+def call_hooks_error(hooks, call, error):
+    call.elapsed = time.perf_counter() - call.started
+    for hook in hooks:
+        hook.on_error(call, error)
+
+
+def call_hooks_complete(hooks, call, started, error=None):
+    elapsed = time.perf_counter() - started
+    for hook in hooks:
+        hook.on_complete(call, elapsed, error)
+
+
+class _RouteStats:
+    __slots__ = ('buckets', 'latency_sum', 'count', 'bytes_in', 'bytes_out', 'retries', 'statuses', 'errors')
+
+    def __init__(self, buckets_count):
+        self.buckets = [0] * (buckets_count + 1)
+        self.latency_sum = 0.0
+        self.count = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.retries = 0
+        self.statuses = {}
+        self.errors = {}
+
+
+class RequestMetrics(RequestHooks):
+    """
+    Collector of request metrics per method and route template: latency histogram, bytes sent and received,
+    retries, response statuses, connection errors and number of requests in flight
+
+    Recording takes a single lock and a bisect per request, cheap enough to keep enabled in production.
+    """
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS, prefix='resilio_api'):
+        """
+        :param buckets: latency histogram upper bounds in seconds, ascending
+        :param prefix: name prefix of exported Prometheus metrics
+        """
+
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self.in_flight = 0
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def _route_stats(self, call):
+        key = (call.method, call.route)
+        stats = self._routes.get(key)
+        if stats is None:
+            stats = self._routes[key] = _RouteStats(len(self.buckets))
+        return stats
+
+    def _record(self, call, stats):
+        stats.buckets[bisect_left(self.buckets, call.elapsed)] += 1
+        stats.latency_sum += call.elapsed
+        stats.count += 1
+        stats.bytes_out += call.bytes_out
+        if call.attempt > 1:
+            stats.retries += 1
+
+    def on_start(self, call):
+        with self._lock:
+            self.in_flight += 1
+
+    def on_response(self, call):
+        with self._lock:
+            self.in_flight -= 1
+            stats = self._route_stats(call)
+            self._record(call, stats)
+            stats.bytes_in += call.bytes_in
+            stats.statuses[call.status] = stats.statuses.get(call.status, 0) + 1
+
+    def on_error(self, call, error):
+        name = type(error).__name__
+        with self._lock:
+            self.in_flight -= 1
+            stats = self._route_stats(call)
+            self._record(call, stats)
+            stats.errors[name] = stats.errors.get(name, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._routes = {}
+
+    def snapshot(self):
+        """
+        Get current metrics as JSON serializable dict:
+        {
+            'in_flight': <count>,
+            'routes': [
+                {
+                    'method': 'GET',
+                    'route': '/runs/{id}/agents',
+                    'count': <requests>,
+                    'latency_sum': <seconds>,
+                    'latency_buckets': {'0.005': <count>, ..., '+Inf': <count>},   # cumulative
+                    'bytes_in': <bytes>,
+                    'bytes_out': <bytes>,
+                    'retries': <count>,
+                    'statuses': {'200': <count>, ...},
+                    'errors': {'ConnectionError': <count>, ...}
+                }, ...
+            ]
+        }
+        """
+
+        with self._lock:
+            routes = []
+            for (method, route), stats in sorted(self._routes.items()):
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip(self.buckets + (float('inf'), ), stats.buckets):
+                    cumulative += count
+                    buckets['+Inf' if bound == float('inf') else repr(bound)] = cumulative
+
+                routes.append({
+                    'method': method,
+                    'route': route,
+                    'count': stats.count,
+                    'latency_sum': stats.latency_sum,
+                    'latency_buckets': buckets,
+                    'bytes_in': stats.bytes_in,
+                    'bytes_out': stats.bytes_out,
+                    'retries': stats.retries,
+                    'statuses': {str(status): count for status, count in sorted(stats.statuses.items())},
+                    'errors': dict(stats.errors),
+                })
+
+            return {'in_flight': self.in_flight, 'routes': routes}
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def prometheus_text(self):
+        """
+        Get current metrics in Prometheus text exposition format
+        """
+
+        snapshot = self.snapshot()
+        p = self.prefix
+        lines = [
+            '# HELP {}_requests_in_flight Requests waiting for response'.format(p),
+            '# TYPE {}_requests_in_flight gauge'.format(p),
+            '{}_requests_in_flight {}'.format(p, snapshot['in_flight']),
+        ]
+
+        def labels(route, **extra):
+            items = [('method', route['method']), ('route', route['route'])] + sorted(extra.items())
+            return ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in items)
+
+        lines.append('# HELP {}_request_duration_seconds Request latency'.format(p))
+        lines.append('# TYPE {}_request_duration_seconds histogram'.format(p))
+        for route in snapshot['routes']:
+            for bound, count in route['latency_buckets'].items():
+                lines.append('{}_request_duration_seconds_bucket{{{}}} {}'.format(p, labels(route, le=bound), count))
+            lines.append('{}_request_duration_seconds_sum{{{}}} {}'.format(p, labels(route), route['latency_sum']))
+            lines.append('{}_request_duration_seconds_count{{{}}} {}'.format(p, labels(route), route['count']))
+
+        counters = (
+            ('responses_total', 'Responses by status', 'statuses', 'status'),
+            ('errors_total', 'Connection errors by type', 'errors', 'error'),
+        )
+        for name, help_text, key, label in counters:
+            lines.append('# HELP {}_{} {}'.format(p, name, help_text))
+            lines.append('# TYPE {}_{} counter'.format(p, name))
+            for route in snapshot['routes']:
+                for value, count in route[key].items():
+                    lines.append('{}_{}{{{}}} {}'.format(p, name, labels(route, **{label: value}), count))
+
+        for name, help_text, key in (('received_bytes_total', 'Response body bytes', 'bytes_in'),
+                                     ('sent_bytes_total', 'Request body bytes', 'bytes_out'),
+                                     ('retries_total', 'Retried attempts', 'retries')):
+            lines.append('# HELP {}_{} {}'.format(p, name, help_text))
+            lines.append('# TYPE {}_{} counter'.format(p, name))
+            for route in snapshot['routes']:
+                lines.append('{}_{}{{{}}} {}'.format(p, name, labels(route), route[key]))
+
+        return '\n'.join(lines) + '\n'
+
+
+class SpanHooks(RequestHooks):
+    """
+    Adapter creating a span per request attempt with OpenTelemetry-style tracer, e.g.
+    SpanHooks(opentelemetry.trace.get_tracer('resilio-api'))
+
+    Only start_span(), set_attribute(), record_exception() and end() are used, so any compatible tracer works
+    """
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    def on_start(self, call):
+        span = self.tracer.start_span('{} {}'.format(call.method, call.route))
+        span.set_attribute('http.method', call.method)
+        span.set_attribute('http.route', call.route)
+        span.set_attribute('http.target', call.path)
+        span.set_attribute('http.resend_count', call.attempt - 1)
+        call.context[self] = span
+
+    def on_response(self, call):
+        span = call.context.pop(self, None)
+        if span is not None:
+            span.set_attribute('http.status_code', call.status)
+            span.set_attribute('http.response_content_length', call.bytes_in)
+            span.end()
+
+    def on_error(self, call, error):
+        span = call.context.pop(self, None)
+        if span is not None:
+            span.record_exception(error)
+            span.end()
+
+
+class TraceLogHooks(RequestHooks):
+    """
+    Writes one trace record per request (all its attempts) to the structured log, see Logger.start_structured().
+    Records carry correlation ID of the operation making the request, see logger.operation()
+    """
+
+    def on_complete(self, call, elapsed, error):
+        logger.trace('{} {}'.format(call.method, call.route), method=call.method, route=call.route, path=call.path,
+                     status=call.status, duration=round(elapsed, 6), bytes_out=call.bytes_out,
+                     bytes_in=call.bytes_in, retries=call.attempt - 1,
+                     error=None if error is None else '{}: {}'.format(type(error).__name__, error))
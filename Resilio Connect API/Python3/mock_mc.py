@@ -0,0 +1,525 @@
+"""
+Mock Management Console serving the /api/v2 endpoints used by the example clients
+
+Keeps agents, groups, jobs and runs in memory. Runs progress on their own and finish `run_duration` seconds after
+creation. Latency, error rate and payload size are configurable to reproduce slow or overloaded MC.
+
+Usage:
+    python3 mock_mc.py [--port 8443] [--agents 1000] [--latency 0.02] [--error-rate 0.01] [--padding 200]
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import random
+import re
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from api import BASE_API_URL
+from routes import route_template
+
+# query params which are not list filters
+_PAGING_PARAMS = ('limit', 'offset', 'ignore_errors')
+
+_ROUTE = re.compile(r'^/(?P<collection>[a-z]+)(?:/(?P<id>\d+))?(?:/(?P<sub>[a-z]+))?(?:/(?P<sub_id>\d+|stop|restart))?$')
+
+
+class MockMcError(Exception):
+    def __init__(self, status, message):
+        super(MockMcError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class MockMcState:
+    """
+    In-memory MC inventory and runs, safe to use from several server threads
+    """
+
+    def __init__(self, agents=100, groups=10, jobs=10, run_duration=5.0, run_size=1 << 30, padding=0, seed=0):
+        """
+        :param agents: number of agents
+        :param groups: number of groups, agents are spread over them evenly
+        :param jobs: number of jobs
+        :param run_duration: seconds run takes to finish on every agent
+        :param run_size: bytes transferred by every agent of a run
+        :param padding: size of extra string attribute added to every object to inflate payloads
+        :param seed: random seed of generated inventory
+        """
+
+        self.run_duration = run_duration
+        self.run_size = run_size
+        self.padding = 'x' * padding if padding else None
+        self.lock = threading.Lock()
+        self.requests = {}
+
+        rnd = random.Random(seed)
+        self.agents = {}
+        for i in range(1, agents + 1):
+            self.agents[i] = self._padded({
+                'id': i,
+                'name': 'agent-{:05d}'.format(i),
+                'deviceid': '{:040X}'.format(rnd.getrandbits(160)),
+                'ip': '10.{}.{}.{}'.format(i // 65536, i // 256 % 256, i % 256),
+                'os': ('linux', 'win', 'osx')[i % 3],
+                'version': '2.12.0',
+                'online': rnd.random() > 0.1,
+                'tags': [{'name': 'site', 'value': 'dc{}'.format(i % 4)}],
+            })
+
+        self.groups = {}
+        for i in range(1, groups + 1):
+            self.groups[i] = self._padded({
+                'id': i,
+                'name': 'Group {}'.format(i),
+                'description': '',
+                'agents': [{'id': agent_id} for agent_id in self.agents if agent_id % groups == i % groups],
+                'jobs': [],
+            })
+
+        self.jobs = {}
+        for i in range(1, jobs + 1):
+            self.jobs[i] = self._padded({
+                'id': i,
+                'name': 'Job {}'.format(i),
+                'type': 'distribution',
+                'description': '',
+                'groups': [],
+                'agents': [],
+            })
+
+        self.runs = {}
+        self._next_ids = {'groups': groups + 1, 'jobs': jobs + 1, 'runs': 1}
+
+    def _padded(self, obj):
+        if self.padding:
+            obj['padding'] = self.padding
+        return obj
+
+    def _next_id(self, collection):
+        next_id = self._next_ids[collection]
+        self._next_ids[collection] += 1
+        return next_id
+
+    def count_request(self, method, path):
+        key = '{} {}'.format(method, route_template(path))
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': dict(self.requests),
+                'agents': len(self.agents),
+                'groups': len(self.groups),
+                'jobs': len(self.jobs),
+                'runs': len(self.runs),
+            }
+
+    # Runs
+    def _job_agents(self, job):
+        agent_ids = [item['id'] for item in job.get('agents', ())]
+        for item in job.get('groups', ()):
+            group = self.groups.get(item['id'])
+            if group is not None:
+                agent_ids.extend(agent['id'] for agent in group['agents'])
+        return sorted(set(agent_ids))
+
+    def _run_progress(self, run, now):
+        if run['stopped_at'] is not None:
+            now = run['stopped_at']
+        if self.run_duration <= 0:
+            return 1.0
+        return min(1.0, (now - run['started']) / self.run_duration)
+
+    def run_view(self, run, now):
+        progress = self._run_progress(run, now)
+        if run['stopped_at'] is not None:
+            status = 'stopped'
+        else:
+            status = 'finished' if progress >= 1.0 else 'working'
+        agents_count = len(run['agents'])
+        size_total = self.run_size * agents_count
+        return self._padded({
+            'id': run['id'],
+            'job_id': run['job_id'],
+            'name': run['name'],
+            'type': 'distribution',
+            'status': status,
+            'created_at': int(run['started']),
+            'finished_at': int(run['started'] + self.run_duration) if status == 'finished' else None,
+            'eta': None if status != 'working' else int(self.run_duration * (1.0 - progress)),
+            'stats': {
+                'agents_total': agents_count,
+                'size_total': size_total,
+                'size_completed': int(size_total * progress),
+            },
+        })
+
+    def run_agent_view(self, run, agent_id, now):
+        progress = self._run_progress(run, now)
+        if run['stopped_at'] is not None:
+            status = 'stopped'
+        else:
+            status = 'finished' if progress >= 1.0 else 'working'
+        agent = self.agents.get(agent_id, {})
+        return self._padded({
+            'agent_id': agent_id,
+            'name': agent.get('name', ''),
+            'status': status,
+            'eta': None if status != 'working' else int(self.run_duration * (1.0 - progress)),
+            'stats': {
+                'size_total': self.run_size,
+                'size_completed': int(self.run_size * progress),
+            },
+            'errors': [],
+        })
+
+    def create_run(self, attrs):
+        job = self.jobs.get(attrs.get('job_id'))
+        if job is None:
+            raise MockMcError(404, 'Job not found')
+
+        run_id = self._next_id('runs')
+        self.runs[run_id] = {
+            'id': run_id,
+            'job_id': job['id'],
+            'name': job['name'],
+            'agents': self._job_agents(job),
+            'started': time.time(),
+            'stopped_at': None,
+        }
+        return run_id
+
+
+def _page(items, query):
+    offset = int(query.get('offset', 0))
+    limit = query.get('limit')
+    return items[offset:] if limit is None else items[offset:offset + int(limit)]
+
+
+def _filter(items, query):
+    filters = {key: value for key, value in query.items() if key not in _PAGING_PARAMS}
+    if not filters:
+        return items
+    return [item for item in items if all(str(item.get(key)) == value for key, value in filters.items())]
+
+
+def handle_request(state, method, path, query, body):
+    """
+    Handle API request
+
+    :param state: MockMcState
+    :param method: HTTP method
+    :param path: API path without /api/v2 prefix
+    :param query: dict of query params
+    :param body: decoded request body or None
+    :return: response object to be JSON encoded
+    """
+
+    if path == '/info':
+        return {'version': '2.12.0', 'mock': True}
+
+    match = _ROUTE.match(path)
+    if match is None:
+        raise MockMcError(404, 'Not found')
+
+    collection, obj_id, sub, sub_id = match.group('collection', 'id', 'sub', 'sub_id')
+    obj_id = None if obj_id is None else int(obj_id)
+    now = time.time()
+
+    with state.lock:
+        if collection == 'runs':
+            return _handle_runs(state, method, obj_id, sub, sub_id, query, body, now)
+
+        objects = getattr(state, collection, None)
+        if collection not in ('agents', 'groups', 'jobs') or sub_id is not None:
+            raise MockMcError(404, 'Not found')
+
+        if obj_id is None and sub is not None:
+            if collection == 'agents' and sub == 'config' and method == 'GET':
+                return {'folders_storage_path': '/var/lib/resilio-agent'}
+            raise MockMcError(404, 'Not found')
+
+        if obj_id is None:
+            if method == 'GET':
+                return _page(_filter(list(objects.values()), query), query)
+            if method == 'POST' and collection != 'agents':
+                obj_id = state._next_id(collection)
+                objects[obj_id] = state._padded(dict(body or {}, id=obj_id))
+                return {'id': obj_id}
+            raise MockMcError(405, 'Method not allowed')
+
+        obj = objects.get(obj_id)
+        if obj is None:
+            raise MockMcError(404, '{} {} not found'.format(collection[:-1].capitalize(), obj_id))
+
+        if sub is not None:
+            if collection == 'jobs' and sub == 'groups' and method == 'GET':
+                return obj.get('groups', [])
+            raise MockMcError(404, 'Not found')
+
+        if method == 'GET':
+            return obj
+        if method == 'PUT':
+            obj.update(body or {})
+            return {}
+        if method == 'DELETE':
+            del objects[obj_id]
+            return {}
+        raise MockMcError(405, 'Method not allowed')
+
+
+def _handle_runs(state, method, run_id, sub, sub_id, query, body, now):
+    if run_id is None:
+        if method == 'GET':
+            runs = [state.run_view(run, now) for run in state.runs.values()]
+            runs = _filter(runs, query)
+            return {'data': _page(runs, query), 'total': len(runs)}
+        if method == 'POST':
+            return {'id': state.create_run(body or {})}
+        raise MockMcError(405, 'Method not allowed')
+
+    run = state.runs.get(run_id)
+    if run is None:
+        raise MockMcError(404, 'Run {} not found'.format(run_id))
+
+    if sub is None:
+        if method == 'GET':
+            return state.run_view(run, now)
+        raise MockMcError(405, 'Method not allowed')
+
+    if sub == 'stop' and method == 'PUT':
+        if run['stopped_at'] is None:
+            run['stopped_at'] = now
+        return {}
+
+    if sub == 'agents':
+        if sub_id is None and method == 'GET':
+            agents = [state.run_agent_view(run, agent_id, now) for agent_id in run['agents']]
+            agents = _filter(agents, query)
+            return {'data': _page(agents, query), 'total': len(agents)}
+        if sub_id is None and method == 'POST':
+            run['agents'] = sorted(set(run['agents']) | {item['id'] for item in (body or {}).get('agents', ())})
+            return {}
+        if sub_id in ('stop', 'restart') and method == 'PUT':
+            return {}
+        if sub_id is not None and sub_id.isdigit() and method == 'GET':
+            if int(sub_id) not in run['agents']:
+                raise MockMcError(404, 'Agent {} is not in run {}'.format(sub_id, run_id))
+            return state.run_agent_view(run, int(sub_id), now)
+
+    raise MockMcError(404, 'Not found')
+
+
+class MockMcHandler(BaseHTTPRequestHandler):
+    # keep-alive requires HTTP/1.1
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, avoid Nagle + delayed ACK stalls on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.handle_api('GET')
+
+    def do_POST(self):
+        self.handle_api('POST')
+
+    def do_PUT(self):
+        self.handle_api('PUT')
+
+    def do_DELETE(self):
+        self.handle_api('DELETE')
+
+    def handle_api(self, method):
+        server = self.server
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length) if length else b''
+
+        if url.path == '/_mock/stats':
+            return self.reply(200, server.state.stats())
+
+        if server.latency:
+            time.sleep(server.latency * (0.5 + server.random.random()))
+
+        if not url.path.startswith(BASE_API_URL):
+            return self.reply(404, {'code': 404, 'message': 'Not found'})
+
+        path = url.path[len(BASE_API_URL):] or '/'
+        server.state.count_request(method, path)
+
+        if server.token is not None and self.headers.get('Authorization') != 'Token {}'.format(server.token):
+            return self.reply(401, {'code': 401, 'message': 'Unauthorized'})
+
+        if server.error_rate and server.random.random() < server.error_rate:
+            return self.reply(503, {'code': 503, 'message': 'Service unavailable'}, {'Retry-After': '0'})
+
+        try:
+            body = json.loads(raw_body) if raw_body else None
+            result = handle_request(server.state, method, path, dict(parse_qsl(url.query)), body)
+        except MockMcError as e:
+            return self.reply(e.status, {'code': e.status, 'message': e.message})
+        except (ValueError, KeyError, TypeError) as e:
+            return self.reply(400, {'code': 400, 'message': 'Bad request: {}'.format(e)})
+
+        self.reply(200, result, conditional=method == 'GET')
+
+    def reply(self, status, result, headers=None, conditional=False):
+        body = json.dumps(result, separators=(',', ':')).encode()
+
+        if conditional:
+            etag = '"{}"'.format(hashlib.blake2b(body, digest_size=8).hexdigest())
+            headers = dict(headers or {}, ETag=etag)
+            if self.headers.get('If-None-Match') == etag:
+                status, body = 304, b''
+
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if status != 304:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MockMc:
+    """
+    Mock MC server running in a background thread of the current process, see MockMcState for inventory options
+
+    with MockMc(agents=1000, latency=0.01) as mc:
+        api = ConnectApiExample(mc.address, mc.token)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, token='mock-token', latency=0.0, error_rate=0.0,
+                 certfile=None, keyfile=None, seed=0, **state_options):
+        """
+        :param host: address to listen on
+        :param port: port to listen on, 0 picks a free one
+        :param token: API token clients must send, None accepts any
+        :param latency: average response delay in seconds, actual delay is uniform in [latency/2, latency*3/2]
+        :param error_rate: fraction of API requests answered with 503
+        :param certfile: serve over TLS with this certificate, like real MC on :8443
+        :param keyfile: certificate key
+        :param seed: random seed of inventory, latency and errors
+        :param state_options: MockMcState options: agents, groups, jobs, run_duration, run_size, padding
+        """
+
+        self.state = MockMcState(seed=seed, **state_options)
+        self.server = ThreadingHTTPServer((host, port), MockMcHandler)
+        self.server.daemon_threads = True
+        self.server.state = self.state
+        self.server.token = token
+        self.server.latency = latency
+        self.server.error_rate = error_rate
+        self.server.random = random.Random(seed)
+        self.token = token
+
+        scheme = 'http'
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+            scheme = 'https'
+
+        self.host = host
+        self.port = self.server.server_port
+        self.address = '{}://{}:{}'.format(scheme, host, self.port)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='mock-mc', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self.server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def _serve(options, ready):
+    mc = MockMc(**options)
+    ready.send((mc.address, mc.port))
+    ready.close()
+    mc.server.serve_forever()
+
+
+class MockMcProcess:
+    """
+    Mock MC running in a child process, so that its CPU time and memory don't affect measurements of the client.
+    Accepts the same options as MockMc
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.token = options.get('token', 'mock-token')
+        self.address = None
+        self.port = None
+        self._process = None
+
+    def start(self):
+        parent, child = multiprocessing.Pipe(duplex=False)
+        self._process = multiprocessing.Process(target=_serve, args=(self.options, child), daemon=True)
+        self._process.start()
+        child.close()
+        self.address, self.port = parent.recv()
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--token', default='mock-token')
+    parser.add_argument('--agents', type=int, default=100)
+    parser.add_argument('--groups', type=int, default=10)
+    parser.add_argument('--jobs', type=int, default=10)
+    parser.add_argument('--run-duration', type=float, default=60.0)
+    parser.add_argument('--padding', type=int, default=0, help='bytes of padding added to every object')
+    parser.add_argument('--latency', type=float, default=0.0, help='average response delay in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests failing with 503')
+    parser.add_argument('--certfile')
+    parser.add_argument('--keyfile')
+    args = parser.parse_args()
+
+    mc = MockMc(host=args.host, port=args.port, token=args.token, latency=args.latency, error_rate=args.error_rate,
+                certfile=args.certfile, keyfile=args.keyfile, agents=args.agents, groups=args.groups,
+                jobs=args.jobs, run_duration=args.run_duration, padding=args.padding)
+    print('Mock Management Console at {} (token {})'.format(mc.address, mc.token))
+    try:
+        mc.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
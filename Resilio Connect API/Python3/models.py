@@ -0,0 +1,202 @@
+class _LazyField:
+    """
+    Field parsed from raw dict on first access and cached in `_<name>` slot
+    """
+
+    def __init__(self, name, parser):
+        self.name = name
+        self.slot = '_' + name
+        self.parser = parser
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self
+
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            pass
+
+        if obj._raw is None:
+            raise AttributeError('{} was not projected and raw data is not kept'.format(self.name))
+
+        value = self.parser(obj._raw.get(self.name))
+        setattr(obj, self.slot, value)
+        return value
+
+
+class _ModelMeta(type):
+    # builds __slots__ from FIELDS and LAZY declarations
+    def __new__(mcs, name, bases, namespace):
+        fields = tuple(namespace.get('FIELDS', ()))
+        lazy = dict(namespace.get('LAZY', {}))
+
+        namespace.setdefault('__slots__', fields + tuple('_' + field for field in lazy))
+        for field, parser in lazy.items():
+            namespace[field] = _LazyField(field, parser)
+
+        return super(_ModelMeta, mcs).__new__(mcs, name, bases, namespace)
+
+
+class Model(metaclass=_ModelMeta):
+    """
+    Compact read-only view of API object
+
+    Scalar FIELDS are copied into slots, nested LAZY fields are parsed on first access. Attributes missing in
+    the model are looked up in the raw dict, if it's kept.
+
+    :param raw: dict as returned by API
+    :param fields: names of fields to copy, all FIELDS by default. Use it to keep only what the caller needs
+    :param keep_raw: keep reference to raw dict for lazy fields and fallback lookups. By default decoded JSON is
+        freed: lazy fields listed in `fields` are parsed right away, other ones are unavailable
+    """
+
+    __slots__ = ('_raw', )
+    FIELDS = ()
+    LAZY = {}
+
+    def __init__(self, raw, fields=None, keep_raw=False):
+        for field in self.FIELDS if fields is None else fields:
+            if field in self.LAZY:
+                if not keep_raw:
+                    setattr(self, '_' + field, self.LAZY[field](raw.get(field)))
+            elif field in self.FIELDS:
+                setattr(self, field, raw.get(field))
+            else:
+                raise ValueError('{} has no field {}'.format(type(self).__name__, field))
+
+        self._raw = raw if keep_raw else None
+
+    def __getattr__(self, name):
+        # only called for attributes not set in slots: projected out fields or extra API attributes
+        if name.startswith('_'):
+            raise AttributeError(name)
+        raw = self._raw
+        if raw is not None and name in raw:
+            return raw[name]
+        raise AttributeError('{} has no attribute {}'.format(type(self).__name__, name))
+
+    # dict-style access, so that models replace API dicts in code doing agent['id']
+    def __getitem__(self, name):
+        if not isinstance(name, str) or name.startswith('_'):
+            raise KeyError(name)
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    @property
+    def raw(self):
+        """
+        Raw dict the model was created from, None if it's not kept
+        """
+
+        return self._raw
+
+    def as_dict(self):
+        """
+        Dict with fields set in the model
+        """
+
+        result = {}
+        for field in self.FIELDS:
+            try:
+                result[field] = getattr(self, field)
+            except AttributeError:
+                pass
+        return result
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.as_dict() == other.as_dict()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join('{}={!r}'.format(k, v) for k, v in self.as_dict().items()))
+
+
+class Assignment(Model):
+    """
+    Group in a job or job in a group: id, permission and path per OS ({'linux': ..., 'win': ..., 'osx': ...})
+    """
+
+    FIELDS = ('id', 'permission', 'path')
+
+
+def _ids(items):
+    return tuple(item['id'] for item in items or ())
+
+
+def _assignments(items):
+    return tuple(Assignment(item) for item in items or ())
+
+
+def _tags(tags):
+    # tags are reported either as plain strings or as {'name': ..., 'value': ...} dicts
+    return tuple((tag.get('name'), tag.get('value')) if isinstance(tag, dict) else (tag, None) for tag in tags or ())
+
+
+def _as_is(value):
+    return value
+
+
+class Agent(Model):
+    FIELDS = ('id', 'name', 'deviceid', 'ip', 'os', 'version', 'online')
+    LAZY = {'tags': _tags, 'groups': _ids}
+
+
+class Group(Model):
+    FIELDS = ('id', 'name', 'description')
+    LAZY = {'agents': _ids, 'jobs': _assignments}
+
+
+class Job(Model):
+    FIELDS = ('id', 'name', 'type', 'description')
+    LAZY = {'groups': _assignments, 'agents': _assignments, 'settings': _as_is}
+
+
+class JobRun(Model):
+    FIELDS = ('id', 'job_id', 'name', 'type', 'status', 'created_at', 'finished_at')
+    LAZY = {'stats': _as_is}
+
+
+class RunAgent(Model):
+    FIELDS = ('agent_id', 'name', 'status')
+    LAZY = {'stats': _as_is, 'errors': _as_is}
+
+
+def iter_models(model, items, fields=None, keep_raw=False):
+    """
+    Wrap API dicts into models lazily, e.g. iter_models(RunAgent, api._get_job_run_agents(run_id), ('agent_id', ))
+
+    :param model: Model subclass
+    :param items: iterable of dicts
+    :param fields: fields to copy, see Model
+    :param keep_raw: keep raw dicts, see Model
+    """
+
+    for item in items:
+        yield model(item, fields, keep_raw)
+
+
+def parse_list(model, items, fields=None, keep_raw=False):
+    """
+    Same as iter_models() returning a list
+    """
+
+    return list(iter_models(model, items, fields, keep_raw))
+
+
+async def aiter_models(model, items, fields=None, keep_raw=False):
+    """
+    Same as iter_models() for async iterables
+    """
+
+    async for item in items:
+        yield model(item, fields, keep_raw)
@@ -0,0 +1,191 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# statuses returned by busy or restarting Management Console
+RETRY_STATUSES = (429, 502, 503, 504)
+# methods which are safe to repeat
+IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
+
+
+def parse_retry_after(value):
+    """
+    Parse Retry-After header
+
+    :param value: header value, number of seconds or HTTP date
+    :return: delay in seconds or None if header is missing or invalid
+    """
+
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=4, backoff=0.5, max_backoff=30.0, jitter=True, deadline=120.0,
+                 retry_statuses=RETRY_STATUSES, retry_post=False, respect_retry_after=True):
+        """
+        :param max_attempts: max number of attempts including the first one, 1 disables retries
+        :param backoff: delay before the first retry in seconds, doubled for every next one
+        :param max_backoff: max delay between attempts in seconds
+        :param jitter: randomize delays ("full jitter") so that clients don't retry in lockstep
+        :param deadline: max total time in seconds spent on a request including all retries, None for no limit
+        :param retry_statuses: response statuses to retry
+        :param retry_post: retry POST requests too. Enable only for calls which are safe to repeat,
+            otherwise MC may create a duplicate object when the first response was lost
+        :param respect_retry_after: wait at least as long as Retry-After header of 429/503 response asks
+        """
+
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_post = retry_post
+        self.respect_retry_after = respect_retry_after
+
+    def copy(self, **kwargs):
+        """
+        Create policy with some options changed, e.g. policy.copy(retry_post=True)
+        """
+
+        attrs = dict(vars(self), **kwargs)
+        return RetryPolicy(**attrs)
+
+    def allows(self, method):
+        """
+        Check if requests with this HTTP method may be retried
+        """
+
+        return self.max_attempts > 1 and (method in IDEMPOTENT_METHODS or (method == 'POST' and self.retry_post))
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Get delay before the next attempt
+
+        :param attempt: number of failed attempts so far, starting from 1
+        :param retry_after: delay requested by MC in Retry-After header
+        :return: delay in seconds
+        """
+
+        delay = min(self.max_backoff, self.backoff * (2 ** (attempt - 1)))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+
+        if retry_after is not None and self.respect_retry_after:
+            delay = max(delay, retry_after)
+
+        return delay
+
+    def next_delay(self, attempt, started, retry_after=None):
+        """
+        Get delay before the next attempt or None if request should not be retried anymore
+
+        :param attempt: number of failed attempts so far, starting from 1
+        :param started: time.monotonic() of the first attempt
+        :param retry_after: delay requested by MC in Retry-After header
+        """
+
+        if attempt >= self.max_attempts:
+            return None
+
+        delay = self.delay(attempt, retry_after)
+
+        if self.deadline is not None and time.monotonic() + delay - started > self.deadline:
+            return None
+
+        return delay
+
+
+NO_RETRY = RetryPolicy(max_attempts=1)
+
+
+class RetryStats:
+    """
+    Thread-safe counters showing how much retries cost
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.retried_requests = 0
+        self.gave_up = 0
+        self.wait_time = 0.0
+        self.statuses = {}
+
+    def record_retry(self, first_retry, delay, status=None):
+        with self._lock:
+            self.retries += 1
+            self.wait_time += delay
+            if first_retry:
+                self.retried_requests += 1
+            if status is not None:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def record_request(self, attempts, failed):
+        with self._lock:
+            self.requests += 1
+            if failed and attempts > 1:
+                self.gave_up += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'retried_requests': self.retried_requests,
+                'gave_up': self.gave_up,
+                'wait_time': self.wait_time,
+                'statuses': dict(self.statuses)
+            }
+
+
+class RetryState:
+    """
+    Retry bookkeeping of a single request, shared by sync and async clients
+    """
+
+    def __init__(self, policy, method, stats):
+        self.policy = policy
+        self.stats = stats
+        self.enabled = policy.allows(method)
+        self.started = time.monotonic()
+        self.attempts = 0
+
+    def retry_delay(self, status=None, retry_after=None):
+        """
+        Register finished attempt and get delay before the next one
+
+        :param status: response status or None if connection failed
+        :param retry_after: Retry-After header of the response
+        :return: delay in seconds or None if request succeeded or should not be retried
+        """
+
+        self.attempts += 1
+
+        if not self.enabled:
+            return None
+
+        if status is not None and status not in self.policy.retry_statuses:
+            return None
+
+        delay = self.policy.next_delay(self.attempts, self.started, parse_retry_after(retry_after))
+        if delay is not None:
+            self.stats.record_retry(self.attempts == 1, delay, status)
+
+        return delay
+
+    def finish(self, failed):
+        self.stats.record_request(max(self.attempts, 1), failed)
@@ -0,0 +1,23 @@
+import re
+from functools import lru_cache
+
+_API_PREFIX = re.compile(r'^/api/v\d+')
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+# cached since it's called for every request by throttle and metrics
+@lru_cache(maxsize=4096)
+def route_template(path):
+    """
+    Get route template of API path, so that calls to the same endpoint can be grouped
+
+    '/runs/15/agents/3?limit=10' -> '/runs/{id}/agents/{id}'
+
+    :param path: API path, with or without '/api/v2' prefix
+    :return: route template
+    """
+
+    path = path.split('?', 1)[0]
+    path = _API_PREFIX.sub('', path)
+
+    return _ID_SEGMENT.sub('/{id}', path) or '/'
@@ -0,0 +1,192 @@
+import asyncio
+import threading
+import time
+
+# recent results kept for micro-cache window are pruned once there are more of them
+_MAX_RECENT = 1024
+
+
+class _SingleFlightStats:
+    def _init_stats(self):
+        self.calls = 0
+        self.executed = 0
+        self.shared = 0
+        self.window_hits = 0
+
+    @property
+    def deduplicated(self):
+        """
+        Number of calls answered without sending a request: joined in-flight one or hit micro-cache window
+        """
+
+        return self.shared + self.window_hits
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'executed': self.executed,
+            'shared': self.shared,
+            'window_hits': self.window_hits,
+            'deduplicated': self.deduplicated,
+        }
+
+    def _recent_result(self, key):
+        # SingleFlight calls it under lock
+        recent = self._recent.get(key)
+        if recent is None:
+            return False, None
+        if recent[0] > time.monotonic():
+            self.window_hits += 1
+            return True, recent[1]
+        del self._recent[key]
+        return False, None
+
+    def _remember(self, key, result):
+        # SingleFlight calls it under lock
+        if not self.window:
+            return
+        now = time.monotonic()
+        if len(self._recent) >= _MAX_RECENT:
+            self._recent = {k: v for k, v in self._recent.items() if v[0] > now}
+        self._recent[key] = (now + self.window, result)
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(_SingleFlightStats):
+    """
+    Coalesces identical concurrent calls: while a call with some key is in flight, other callers with the same
+    key wait for it and receive its result or exception instead of calling again
+
+    Results are shared between callers and must not be modified. May be shared between clients and threads.
+    """
+
+    def __init__(self, window=0.0):
+        """
+        :param window: seconds to keep returning the result after the call completed, 0 to share only calls
+            in flight
+        """
+
+        self.window = window
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._recent = {}
+        self._init_stats()
+
+    def do(self, key, func):
+        """
+        Call func() or join the identical call in flight
+
+        :param key: hashable call identity
+        :param func: function without arguments
+        :return: result of func()
+        """
+
+        with self._lock:
+            self.calls += 1
+            found, result = self._recent_result(key)
+            if found:
+                return result
+
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                # call may be forgotten by invalidate() meanwhile, don't remember its result then
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                    if call.error is None:
+                        self._remember(key, call.result)
+            call.event.set()
+
+        return call.result
+
+    def invalidate(self):
+        """
+        Forget calls in flight and remembered results, so that the next call sends a new request.
+        Callers already waiting still receive results of the forgotten calls
+        """
+
+        with self._lock:
+            self._calls = {}
+            self._recent = {}
+
+
+class AsyncSingleFlight(_SingleFlightStats):
+    """
+    asyncio version of SingleFlight, must be used from a single event loop
+    """
+
+    def __init__(self, window=0.0):
+        self.window = window
+        self._calls = {}
+        self._recent = {}
+        self._init_stats()
+
+    async def do(self, key, coro_func):
+        """
+        Await coro_func() or join the identical call in flight
+
+        :param key: hashable call identity
+        :param coro_func: coroutine function without arguments
+        :return: result of coro_func()
+        """
+
+        self.calls += 1
+        found, result = self._recent_result(key)
+        if found:
+            return result
+
+        task = self._calls.get(key)
+        if task is None:
+            # the call runs in its own task, so that cancellation of any caller, the first one included,
+            # only detaches that caller
+            task = self._calls[key] = asyncio.ensure_future(self._run(key, coro_func))
+            # mark exception as retrieved, all callers may be gone
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self.executed += 1
+        else:
+            self.shared += 1
+
+        return await asyncio.shield(task)
+
+    async def _run(self, key, coro_func):
+        task = asyncio.current_task()
+        try:
+            result = await coro_func()
+        finally:
+            # call may be forgotten by invalidate() meanwhile, don't remember its result then
+            current = self._calls.get(key) is task
+            if current:
+                del self._calls[key]
+        if current:
+            self._remember(key, result)
+        return result
+
+    def invalidate(self):
+        self._calls = {}
+        self._recent = {}
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from cache import DEPENDENT_COLLECTIONS
+from errors import ApiError
+from logger import logger
+
+# snapshot kinds and API paths they are fetched from
+INVENTORY_PATHS = {
+    'agents': '/agents',
+    'groups': '/groups',
+    'jobs': '/jobs',
+}
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS objects (
+    kind TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    hash BLOB NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (kind, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS refreshes (
+    kind TEXT PRIMARY KEY,
+    refreshed_at REAL NOT NULL
+);
+'''
+
+
+# load() uses snapshot max_age when staleness bound is not passed
+_DEFAULT_MAX_AGE = object()
+
+
+def _record_hash(data):
+    return hashlib.blake2b(data.encode(), digest_size=16).digest()
+
+
+class InventorySnapshot:
+    """
+    On-disk SQLite snapshot of MC agents, groups and jobs
+
+    Scripts read inventory from the snapshot at startup without waiting for MC, refresh only writes records
+    which were added, changed or removed since the previous one. Snapshot may be used by several threads.
+    """
+
+    def __init__(self, path, max_age=300):
+        """
+        :param path: SQLite database file
+        :param max_age: default staleness bound in seconds, older data is re-fetched from MC.
+            None accepts data of any age, e.g. for read-only reporting that should never hit MC
+        """
+
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+
+        self._refresh_thread = None
+        self._stop = threading.Event()
+
+    def close(self):
+        self.stop_background_refresh()
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def age(self, kind):
+        """
+        :return: seconds since the last refresh of `kind` or None if it was never fetched
+        """
+
+        with self._lock:
+            row = self._db.execute('SELECT refreshed_at FROM refreshes WHERE kind = ?', (kind, )).fetchone()
+
+        return None if row is None else time.time() - row[0]
+
+    def load(self, kind, max_age=_DEFAULT_MAX_AGE):
+        """
+        Load records of `kind` from snapshot
+
+        :param kind: 'agents', 'groups' or 'jobs'
+        :param max_age: staleness bound in seconds, defaults to snapshot max_age, None accepts any age
+        :return: list of records or None if snapshot is missing or stale
+        """
+
+        if max_age is _DEFAULT_MAX_AGE:
+            max_age = self.max_age
+
+        age = self.age(kind)
+        if age is None or (max_age is not None and age > max_age):
+            return None
+
+        with self._lock:
+            rows = self._db.execute('SELECT data FROM objects WHERE kind = ? ORDER BY id', (kind, )).fetchall()
+
+        return [json.loads(data) for data, in rows]
+
+    def store(self, kind, records):
+        """
+        Replace records of `kind`, writing only the difference with the current snapshot
+
+        :return: dict with numbers of 'added', 'changed' and 'removed' records
+        """
+
+        new = {}
+        for record in records:
+            data = json.dumps(record, sort_keys=True, separators=(',', ':'))
+            new[record['id']] = (_record_hash(data), data)
+
+        with self._lock, self._db:
+            current = dict(self._db.execute('SELECT id, hash FROM objects WHERE kind = ?', (kind, )))
+
+            upserts = [(kind, record_id, record_hash, data) for record_id, (record_hash, data) in new.items()
+                       if current.get(record_id) != record_hash]
+            removed = [(kind, record_id) for record_id in current if record_id not in new]
+
+            self._db.executemany('INSERT OR REPLACE INTO objects (kind, id, hash, data) VALUES (?, ?, ?, ?)', upserts)
+            self._db.executemany('DELETE FROM objects WHERE kind = ? AND id = ?', removed)
+            self._db.execute('INSERT OR REPLACE INTO refreshes (kind, refreshed_at) VALUES (?, ?)',
+                             (kind, time.time()))
+
+        added = sum(1 for _, record_id, _, _ in upserts if record_id not in current)
+        return {'added': added, 'changed': len(upserts) - added, 'removed': len(removed)}
+
+    def expire(self, path):
+        """
+        Mark kinds which may be changed by modification of API `path` as stale
+        """
+
+        collection = path.lstrip('/').split('/', 1)[0]
+        kinds = [kind for kind in DEPENDENT_COLLECTIONS.get(collection, (collection, )) if kind in INVENTORY_PATHS]
+
+        with self._lock, self._db:
+            self._db.executemany('DELETE FROM refreshes WHERE kind = ?', [(kind, ) for kind in kinds])
+
+    def refresh(self, api, kinds=tuple(INVENTORY_PATHS)):
+        """
+        Fetch inventory from MC and apply changes to snapshot
+
+        :param api: ApiBaseCommands instance
+        :param kinds: kinds to refresh
+        :return: dict {kind: changes}
+        """
+
+        changes = {}
+        for kind in kinds:
+            # _get_json bypasses snapshot lookup done by _get_agents() and friends
+            changes[kind] = self.store(kind, api._get_json(INVENTORY_PATHS[kind]))
+        return changes
+
+    def start_background_refresh(self, api, interval=60, kinds=tuple(INVENTORY_PATHS)):
+        """
+        Refresh snapshot every `interval` seconds in a daemon thread
+        """
+
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    logger.debug("Inventory snapshot refreshed: %s", self.refresh(api, kinds))
+                except ApiError as e:
+                    logger.error("Failed to refresh inventory snapshot %s", e)
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._refresh_thread = threading.Thread(target=loop, name='inventory-snapshot', daemon=True)
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        if self._refresh_thread is not None:
+            self._stop.set()
+            self._refresh_thread.join()
+            self._refresh_thread = None
@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# client modules are flat files next to the tests folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_mc import MockMc  # noqa: E402
+
+
+@pytest.fixture
+def mc():
+    with MockMc(agents=20, groups=2, run_duration=60) as mc:
+        yield mc
@@ -0,0 +1,57 @@
+from bulk import merge_group_updates, run_bulk
+from errors import ApiError, ApiNotFoundError
+from examples import ConnectApiExample
+
+
+def test_results_keep_order_of_items():
+    results = run_bulk(lambda item: item * 10, range(20), max_workers=4)
+
+    assert [result.id for result in results] == [item * 10 for item in range(20)]
+    assert all(result.ok for result in results)
+
+
+def test_failed_items_dont_fail_the_batch():
+    def func(item):
+        if item == 'api':
+            raise ApiError('rejected')
+        return item['id']
+
+    results = run_bulk(func, [{'id': 1}, 'api', {}, None, {'id': 5}])
+
+    assert [result.id for result in results] == [1, None, None, None, 5]
+    assert [type(result.error) for result in results] == [type(None), ApiError, KeyError, TypeError, type(None)]
+    assert results[2].item == {}
+
+
+def test_partial_failure_against_mc(mc):
+    with ConnectApiExample(mc.address, mc.token) as api:
+        results = api.delete_groups([1, 1000, 2])
+
+        assert [result.ok for result in results] == [True, False, True]
+        assert isinstance(results[1].error, ApiNotFoundError)
+        assert api._get_groups() == []
+
+
+def test_created_ids_per_item(mc):
+    with ConnectApiExample(mc.address, mc.token) as api:
+        results = api.create_groups([{'name': 'a', 'agents_ids': [1, 2]}, {'agents_ids': [3]}, {'name': 'c'}])
+
+        assert results[0].ok and results[2].ok
+        assert isinstance(results[1].error, KeyError)
+        names = {group['id']: group['name'] for group in api._get_groups()}
+        assert names[results[0].id] == 'a'
+        assert names[results[2].id] == 'c'
+
+
+def test_merge_group_updates():
+    merged = merge_group_updates([
+        (1, {'agents': [{'id': 1}], 'name': 'old'}),
+        (2, {'jobs': [{'id': 7, 'permission': 'ro'}]}),
+        (1, {'agents': [{'id': 2}], 'name': 'new'}),
+        (2, {'jobs': [{'id': 7, 'permission': 'rw'}]}),
+    ])
+
+    assert merged == [
+        (1, {'agents': [{'id': 1}, {'id': 2}], 'name': 'new'}),
+        (2, {'jobs': [{'id': 7, 'permission': 'rw'}]}),
+    ]
@@ -0,0 +1,73 @@
+import time
+
+from cache import ResponseCache
+from examples import ConnectApiExample
+from mock_mc import MockMc
+
+
+def requests_served(mc, route):
+    return mc.state.stats()['requests'].get(route, 0)
+
+
+def test_fresh_entry_is_served_from_cache(mc):
+    cache = ResponseCache()
+    with ConnectApiExample(mc.address, mc.token, cache=cache) as api:
+        first = api._get_groups()
+        assert api._get_groups() is first
+
+    assert requests_served(mc, 'GET /groups') == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_write_invalidates_dependent_entries(mc):
+    cache = ResponseCache()
+    with ConnectApiExample(mc.address, mc.token, cache=cache) as api:
+        groups = api._get_groups()
+        api._get_agents()
+        api._get_job(1)
+
+        group_id = api._create_group({'name': 'new group', 'agents': []})
+
+        # agents and jobs report group membership, their entries are dropped along with groups list
+        assert group_id in [group['id'] for group in api._get_groups()]
+        assert len(api._get_groups()) == len(groups) + 1
+        assert cache.stats()['invalidations'] == 3
+
+        api._delete_group(group_id)
+        assert group_id not in [group['id'] for group in api._get_groups()]
+
+
+def test_expired_entry_is_revalidated(mc):
+    cache = ResponseCache(ttls={'/groups': 0.05})
+    with ConnectApiExample(mc.address, mc.token, cache=cache) as api:
+        first = api._get_groups()
+        time.sleep(0.1)
+        assert api._get_groups() is first
+
+    assert requests_served(mc, 'GET /groups') == 2
+    assert cache.stats()['revalidations'] == 1
+
+
+def test_uncached_route_is_always_requested(mc):
+    cache = ResponseCache()
+    with ConnectApiExample(mc.address, mc.token, cache=cache) as api:
+        api._get_job_runs()
+        api._get_job_runs()
+
+    assert requests_served(mc, 'GET /runs') == 2
+    assert cache.stats()['entries'] == 0
+
+
+def test_shared_cache_keeps_consoles_apart(mc):
+    cache = ResponseCache()
+    with MockMc(agents=3) as other:
+        with ConnectApiExample(mc.address, mc.token, cache=cache) as api, \
+                ConnectApiExample(other.address, other.token, cache=cache) as other_api:
+            assert len(api._get_agents()) == 20
+            assert len(other_api._get_agents()) == 3
+
+            # a write drops entries of its own MC only
+            other_api._create_group({'name': 'new group', 'agents': []})
+            api._get_agents()
+
+    assert cache.stats()['hits'] == 1
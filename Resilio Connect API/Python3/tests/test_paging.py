@@ -0,0 +1,68 @@
+import pytest
+
+import api as api_module
+from api import ApiBaseCommands
+
+ITEMS = [{'id': i} for i in range(12)]
+
+
+@pytest.fixture
+def run_id(mc):
+    # both groups of the mock MC, 20 agents
+    path = {'linux': '/data', 'win': 'C:\\data', 'osx': '/data'}
+    with ApiBaseCommands(mc.address, mc.token, False) as client:
+        job_id = client._create_job({'name': 'job', 'type': 'distribution',
+                                     'groups': [{'id': 1, 'path': path, 'permission': 'rw'},
+                                                {'id': 2, 'path': path, 'permission': 'ro'}]})
+        return client._create_job_run({'job_id': job_id})
+
+
+def run_agent_pages(mc):
+    return mc.state.stats()['requests'].get('GET /runs/{id}/agents', 0)
+
+
+@pytest.mark.parametrize('prefetch, incremental', [(False, False), (True, False), (False, True)])
+def test_iterates_all_pages_and_stops_at_total(mc, run_id, prefetch, incremental):
+    if incremental and api_module.ijson is None:
+        pytest.skip('ijson is not installed')
+
+    with ApiBaseCommands(mc.address, mc.token, False) as client:
+        agents = list(client.iter_job_run_agents(run_id, page_size=6, prefetch=prefetch, incremental=incremental))
+
+    assert sorted(agent['agent_id'] for agent in agents) == list(range(1, 21))
+    # 6 + 6 + 6 + 2, the short page ends iteration without another request
+    assert run_agent_pages(mc) == 4
+
+
+def test_page_filled_up_to_total_ends_iteration(mc, run_id):
+    with ApiBaseCommands(mc.address, mc.token, False) as client:
+        agents = list(client.iter_job_run_agents(run_id, page_size=5, prefetch=False))
+
+    assert len(agents) == 20
+    assert run_agent_pages(mc) == 4
+
+
+def fake_client(response):
+    client = ApiBaseCommands.__new__(ApiBaseCommands)
+    client._get_json = lambda url, params=None: response(params['offset'], params['limit'])
+    return client
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+@pytest.mark.parametrize('name, response, expected', [
+    ('paged', lambda offset, limit: {'data': ITEMS[offset:offset + limit], 'total': len(ITEMS)}, ITEMS),
+    ('paged without total', lambda offset, limit: {'data': ITEMS[offset:offset + limit]}, ITEMS),
+    ('ignores offset', lambda offset, limit: {'data': ITEMS[:limit]}, ITEMS[:5]),
+    ('ignores limit', lambda offset, limit: {'data': ITEMS[offset:]}, ITEMS),
+    ('ignores paging, no total', lambda offset, limit: {'data': ITEMS[:5]}, ITEMS[:5]),
+    ('plain list', lambda offset, limit: ITEMS[:5], ITEMS[:5]),
+])
+def test_iteration_terminates(name, response, expected, prefetch):
+    assert list(fake_client(response)._iter_paged('/runs', None, 5, prefetch, False)) == expected
+
+
+def test_offset_of_attrs_is_the_start(mc, run_id):
+    with ApiBaseCommands(mc.address, mc.token, False) as client:
+        agents = list(client.iter_job_run_agents(run_id, {'offset': 15}, page_size=10, prefetch=False))
+
+    assert len(agents) == 5
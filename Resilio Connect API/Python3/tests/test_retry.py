@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+from errors import ApiError, ApiUnauthorizedError
+from examples import ConnectApiExample
+from mock_mc import MockMc
+from retry import NO_RETRY, RetryPolicy, parse_retry_after
+
+
+@pytest.fixture
+def failing_mc():
+    # every API request is answered with 503 and Retry-After: 0
+    with MockMc(agents=5, error_rate=1.0) as mc:
+        yield mc
+
+
+def requests_served(mc):
+    return sum(mc.state.stats()['requests'].values())
+
+
+def test_retries_up_to_max_attempts(failing_mc):
+    policy = RetryPolicy(max_attempts=3, backoff=0, jitter=False)
+    with ConnectApiExample(failing_mc.address, failing_mc.token, retry=policy) as api:
+        with pytest.raises(ApiError):
+            api._get_agents()
+
+        assert requests_served(failing_mc) == 3
+        stats = api.retry_stats.as_dict()
+        assert stats['retries'] == 2
+        assert stats['gave_up'] == 1
+        assert stats['statuses'] == {503: 2}
+
+
+def test_deadline_stops_retries(failing_mc):
+    policy = RetryPolicy(max_attempts=100, backoff=0.1, max_backoff=0.1, jitter=False, deadline=0.35)
+    with ConnectApiExample(failing_mc.address, failing_mc.token, retry=policy) as api:
+        started = time.monotonic()
+        with pytest.raises(ApiError):
+            api._get_agents()
+
+        # attempts 0.1s apart, the one which would start after 0.35s is not made
+        assert time.monotonic() - started < 1.0
+        assert 1 < requests_served(failing_mc) <= 4
+
+
+def test_post_is_not_retried_by_default(failing_mc):
+    with ConnectApiExample(failing_mc.address, failing_mc.token, retry=RetryPolicy(backoff=0)) as api:
+        with pytest.raises(ApiError):
+            api._create_group({'name': 'group'})
+
+        assert requests_served(failing_mc) == 1
+
+
+def test_no_retry(failing_mc):
+    with ConnectApiExample(failing_mc.address, failing_mc.token, retry=NO_RETRY) as api:
+        with pytest.raises(ApiError):
+            api._get_agents()
+
+        assert requests_served(failing_mc) == 1
+
+
+def test_unauthorized_is_not_retried(mc):
+    with ConnectApiExample(mc.address, 'wrong-token', retry=RetryPolicy(backoff=0)) as api:
+        with pytest.raises(ApiUnauthorizedError):
+            api._get_agents()
+
+        assert api.retry_stats.as_dict()['retries'] == 0
+
+
+def test_retry_after_delay_is_respected():
+    policy = RetryPolicy(backoff=0.01, jitter=False)
+    assert policy.delay(1, retry_after=2.0) == 2.0
+    assert policy.copy(respect_retry_after=False).delay(1, retry_after=2.0) == 0.01
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after('-1') == 0.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from examples import ConnectApiExample
+from singleflight import AsyncSingleFlight, SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'value': 1}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('key', slow))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 5 and all(result is results[0] for result in results)
+
+
+def test_errors_are_shared_and_not_remembered():
+    flight = SingleFlight(window=60)
+
+    def failing():
+        raise KeyError('x')
+
+    with pytest.raises(KeyError):
+        flight.do('key', failing)
+    assert flight.do('key', lambda: 2) == 2
+
+
+def test_window_and_invalidate():
+    flight = SingleFlight(window=60)
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.do('key', lambda: 2) == 1
+
+    flight.invalidate()
+    assert flight.do('key', lambda: 3) == 3
+
+
+def test_writes_invalidate_client_single_flight(mc):
+    flight = SingleFlight(window=60)
+    with ConnectApiExample(mc.address, mc.token, single_flight=flight) as api:
+        count = len(api._get_groups())
+        api._create_group({'name': 'new group', 'agents': []})
+        assert len(api._get_groups()) == count + 1
+
+
+def test_async_cancelled_first_caller_doesnt_fail_others():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return 42
+
+    async def main():
+        first = asyncio.ensure_future(flight.do('key', slow))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flight.do('key', slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == 42
+    assert len(calls) == 1
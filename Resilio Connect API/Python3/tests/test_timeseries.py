@@ -0,0 +1,91 @@
+import pytest
+
+from api import ApiBaseCommands
+from timeseries import AGENT_COLUMNS, RUN_COLUMNS, RingBuffer, TransferStatsCollector, dump, load
+
+
+def filled(columns, capacity, count):
+    buffer = RingBuffer(columns, capacity)
+    for i in range(count):
+        buffer.append([1700000000 + 300 * i] + [i * (n + 1) for n in range(len(columns) - 1)])
+    return buffer
+
+
+def test_ring_buffer_overwrites_oldest_samples():
+    buffer = filled(RUN_COLUMNS, 4, 6)
+
+    assert len(buffer) == 4
+    assert list(buffer.column('size_completed')) == [2, 3, 4, 5]
+    assert buffer.last()['size_completed'] == 5
+    assert buffer.nbytes == 4 * 32
+
+
+def test_ring_buffer_grows_up_to_capacity():
+    buffer = filled(AGENT_COLUMNS, 1000, 3)
+
+    assert len(buffer) == 3
+    assert buffer.nbytes == 3 * 23
+    assert RingBuffer(AGENT_COLUMNS, 1000).last() is None
+
+
+@pytest.mark.parametrize('count', [0, 3, 4, 10])
+def test_dump_load_round_trip(tmp_path, count):
+    series = {
+        ('run', 7): filled(RUN_COLUMNS, 4, count),
+        ('agent', 7, 1): filled(AGENT_COLUMNS, 4, count),
+        'plain key': filled((('time', 'I'), ('rate', 'd')), 8, count),
+    }
+    path = str(tmp_path / 'stats.bin')
+
+    dump(path, series, {'statuses': ['', 'working']})
+    loaded, metadata = load(path)
+
+    assert metadata == {'statuses': ['', 'working']}
+    assert set(loaded) == set(series)
+    for key, buffer in series.items():
+        assert loaded[key].columns == buffer.columns
+        assert loaded[key].capacity == buffer.capacity
+        for name, _ in buffer.columns:
+            assert list(loaded[key].column(name)) == list(buffer.column(name))
+
+
+def test_loaded_buffer_keeps_wrapping(tmp_path):
+    path = str(tmp_path / 'stats.bin')
+    dump(path, {'key': filled(RUN_COLUMNS, 4, 6)})
+    buffer = load(path)[0]['key']
+
+    buffer.append([0, 100, 0, 0, 0, 0])
+
+    assert list(buffer.column('size_completed')) == [3, 4, 5, 100]
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / 'stats.bin'
+    path.write_bytes(b'not a dump')
+
+    with pytest.raises(ValueError):
+        load(str(path))
+
+
+def test_collector_dump_and_restore(mc, tmp_path):
+    path = {'linux': '/data', 'win': 'C:\\data', 'osx': '/data'}
+    with ApiBaseCommands(mc.address, mc.token, False) as client:
+        job_id = client._create_job({'name': 'job', 'type': 'distribution',
+                                     'groups': [{'id': 1, 'path': path, 'permission': 'rw'}]})
+        run_id = client._create_job_run({'job_id': job_id})
+
+        collector = TransferStatsCollector(client, capacity=16)
+        collector.watch(run_id)
+        collector.sample()
+        collector.sample()
+        dump_path = str(tmp_path / 'collector.bin')
+        collector.dump(dump_path)
+
+        restored = TransferStatsCollector(client, capacity=16)
+        restored.restore(dump_path)
+
+    assert restored.watched() == [run_id]
+    assert len(restored.series(run_id)) == 2
+    assert list(restored.series(run_id).column('agents_total')) == [10, 10]
+    agent_series = restored.series(run_id, 1)
+    assert restored.status_name(agent_series.last()['status']) == 'working'
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from api import ApiBaseCommands
+from errors import ApiUnauthorizedError
+from examples import ConnectApiExample
+from mock_mc import MockMc
+from watcher import RunWatcher
+
+PATH = {'linux': '/data', 'win': 'C:\\data', 'osx': '/data'}
+
+
+def create_run(client, groups=(1, )):
+    job_id = client._create_job({'name': 'job', 'type': 'distribution',
+                                 'groups': [{'id': group_id, 'path': PATH, 'permission': 'rw'}
+                                            for group_id in groups]})
+    return client._create_job_run({'job_id': job_id})
+
+
+def test_first_poll_reports_agents_then_only_changes(mc):
+    with ApiBaseCommands(mc.address, mc.token, False) as client:
+        run_id = create_run(client)
+        watcher = RunWatcher(client)
+        watcher.watch(run_id)
+
+        events = watcher.poll()
+        assert sum(event.kind == 'agent_added' for event in events) == 10
+        assert events[-1].kind == 'run'
+        assert events[-1].new.statuses == {'working': 10}
+
+
+def test_finished_run_ends_with_done():
+    with MockMc(agents=4, groups=1, run_duration=0.1) as mc:
+        with ApiBaseCommands(mc.address, mc.token, False) as client:
+            run_id = create_run(client)
+            watcher = RunWatcher(client)
+            watcher.watch(run_id)
+            watcher.poll()
+
+            time.sleep(0.2)
+            events = watcher.poll()
+
+    assert events[-1].kind == 'done'
+    assert watcher.watched() == []
+
+
+def test_removed_run_ends_with_removed(mc):
+    with ApiBaseCommands(mc.address, mc.token, False) as client:
+        watcher = RunWatcher(client)
+        watcher.watch(1000)
+        events = watcher.poll()
+
+    assert [event.kind for event in events] == ['removed']
+    assert watcher.watched() == []
+
+
+def test_watch_transfer_status_raises_rejected_token(mc):
+    with ConnectApiExample(mc.address, mc.token) as api:
+        run_id = create_run(api)
+
+    with ConnectApiExample(mc.address, 'revoked') as api:
+        with pytest.raises(ApiUnauthorizedError):
+            list(api.watch_transfer_status([run_id], interval=0.01))
@@ -0,0 +1,203 @@
+import threading
+import time
+from fnmatch import fnmatchcase
+
+from routes import route_template
+
+# statuses meaning that Management Console is overloaded
+OVERLOAD_STATUSES = (429, 503)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: allows `rate` requests per second on average and bursts of up to `burst` requests
+    """
+
+    def __init__(self, rate, burst=None):
+        self._lock = threading.Lock()
+        self._rate = float(rate)
+        self._capacity = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self._rate = float(rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Take one token, block until it's available
+
+        :return: time spent waiting in seconds
+        """
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self._rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+class Limit:
+    def __init__(self, rate=20.0, burst=None, max_in_flight=8, adaptive=False, target_latency=2.0,
+                 min_rate=1.0, max_rate=None, decrease_factor=0.7, increase_step=1.0):
+        """
+        Limits of a class of endpoints
+
+        :param rate: max average number of requests per second
+        :param burst: max number of requests sent at once after idle period, defaults to rate
+        :param max_in_flight: max number of requests waiting for response at the same time
+        :param adaptive: adjust rate to MC response: decrease it on 429/503 or when latency exceeds
+            target_latency, slowly increase it back while MC responds fast
+        :param target_latency: response time in seconds considered healthy
+        :param min_rate: adaptive rate lower bound
+        :param max_rate: adaptive rate upper bound, defaults to initial rate
+        :param decrease_factor: rate multiplier applied when MC is overloaded
+        :param increase_step: requests per second added to rate after each `rate` healthy responses
+        """
+
+        self.bucket = TokenBucket(rate, burst)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.min_rate = min_rate
+        self.max_rate = max_rate if max_rate is not None else rate
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+
+        self._lock = threading.Lock()
+        self._last_decrease = 0.0
+
+    def record(self, latency, status):
+        """
+        Adjust rate to the finished request
+        """
+
+        if not self.adaptive:
+            return
+
+        with self._lock:
+            rate = self.bucket.rate
+            now = time.monotonic()
+
+            if status in OVERLOAD_STATUSES or latency > self.target_latency:
+                # requests sent before the previous decrease report the same overload, don't punish twice
+                if now - self._last_decrease < latency:
+                    return
+                self._last_decrease = now
+                rate = max(self.min_rate, rate * self.decrease_factor)
+            else:
+                rate = min(self.max_rate, rate + self.increase_step / max(rate, 1.0))
+
+            self.bucket.set_rate(rate)
+
+
+class _Slot:
+    """
+    Permission to send one request. Set `status` to the response status before leaving the context
+    """
+
+    def __init__(self, limit, throttle):
+        self.status = None
+        self._limit = limit
+        self._throttle = throttle
+        self._started = None
+
+    def __enter__(self):
+        if self._limit is not None:
+            self._limit.in_flight.acquire()
+            self._throttle._record_wait(self._limit.bucket.acquire())
+        self._started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._limit is not None:
+            self._limit.in_flight.release()
+            self._limit.record(time.monotonic() - self._started, self.status)
+
+
+class Throttle:
+    """
+    Client side rate and concurrency limiter
+
+    One Throttle may be shared between any number of ApiBaseCommands instances and threads talking to the same MC,
+    limits are applied to all of them together. Separate processes should use adaptive limits to back off
+    when MC reports overload caused by other clients.
+
+    Limits are set per endpoint class, first matching rule wins:
+
+        Throttle([
+            ('GET /agents/{id}', Limit(rate=50, max_in_flight=16)),
+            ('POST /jobs', Limit(rate=1, max_in_flight=1)),
+            ('* /runs*', Limit(rate=10, adaptive=True)),
+        ], default=Limit(rate=20))
+
+    Rule is shell-style pattern matched against "<METHOD> <route template>", see routes.route_template().
+    """
+
+    def __init__(self, rules=(), default=None):
+        """
+        :param rules: iterable of (pattern, Limit) pairs
+        :param default: Limit for requests not matching any rule, None for no limit
+        """
+
+        self._rules = [(pattern, limit) for pattern, limit in rules]
+        self._default = default
+        self._lock = threading.Lock()
+        self._cache = {}
+        self.wait_time = 0.0
+
+    def _limit_for(self, method, route):
+        key = '{} {}'.format(method, route)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        limit = self._default
+        for pattern, rule_limit in self._rules:
+            if fnmatchcase(key, pattern):
+                limit = rule_limit
+                break
+
+        self._cache[key] = limit
+        return limit
+
+    def _record_wait(self, waited):
+        if waited:
+            with self._lock:
+                self.wait_time += waited
+
+    def request(self, method, path):
+        """
+        Wait until request may be sent:
+
+            with throttle.request('GET', '/agents/5') as slot:
+                response = session.get(...)
+                slot.status = response.status_code
+
+        :param method: HTTP method
+        :param path: API path
+        :return: context manager
+        """
+
+        return _Slot(self._limit_for(method.upper(), route_template(path)), self)
+
+
+NO_THROTTLE = Throttle()
@@ -0,0 +1,519 @@
+import json
+import operator
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from itertools import accumulate, chain
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from errors import ApiError, ApiNotFoundError
+from logger import logger
+from watcher import TERMINAL_STATUSES
+
+# columns of per-agent series: (name, array typecode). 23 bytes per sample
+AGENT_COLUMNS = (
+    ('time', 'I'),
+    ('size_completed', 'q'),
+    ('size_total', 'q'),
+    ('status', 'B'),
+    ('errors', 'H'),
+)
+
+# columns of per-run series, totals of run agents. 32 bytes per sample
+RUN_COLUMNS = (
+    ('time', 'I'),
+    ('size_completed', 'q'),
+    ('size_total', 'q'),
+    ('agents_total', 'I'),
+    ('agents_finished', 'I'),
+    ('errors', 'I'),
+)
+
+# one sample every 5 minutes for a week
+DEFAULT_CAPACITY = 2016
+
+# finished runs whose series are kept by TransferStatsCollector
+DEFAULT_KEEP_FINISHED = 10
+
+_DUMP_MAGIC = b'RSTS'
+_DUMP_VERSION = 1
+
+
+class RingBuffer:
+    """
+    Series of numeric samples stored column by column in arrays. Arrays grow up to capacity, then the oldest
+    samples are overwritten
+    """
+
+    def __init__(self, columns, capacity=DEFAULT_CAPACITY):
+        """
+        :param columns: sequence of (name, array typecode) pairs
+        :param capacity: max number of samples kept
+        """
+
+        self.columns = tuple(columns)
+        self.capacity = capacity
+        self._arrays = tuple(array(typecode) for _, typecode in self.columns)
+        self._index = {name: i for i, (name, _) in enumerate(self.columns)}
+        self._start = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def nbytes(self):
+        return sum(a.itemsize * len(a) for a in self._arrays)
+
+    def append(self, values):
+        """
+        :param values: sequence of values in order of columns
+        """
+
+        if self._len < self.capacity:
+            # not full buffer starts at 0 and ends at the end of arrays
+            for column, value in zip(self._arrays, values):
+                column.append(value)
+            self._len += 1
+            return
+
+        position = self._start
+        self._start = (self._start + 1) % self.capacity
+
+        for column, value in zip(self._arrays, values):
+            column[position] = value
+
+    def column(self, name):
+        """
+        :return: array with values of the column, the oldest first
+        """
+
+        data = self._arrays[self._index[name]]
+        end = self._start + self._len
+        if end <= self.capacity:
+            return data[self._start:end]
+        return data[self._start:] + data[:end - self.capacity]
+
+    def last(self):
+        """
+        :return: dict with the latest sample or None
+        """
+
+        if not self._len:
+            return None
+        position = (self._start + self._len - 1) % self.capacity
+        return {name: data[position] for (name, _), data in zip(self.columns, self._arrays)}
+
+    def extend_columns(self, columns):
+        """
+        Append samples given as {column name: sequence of values}, e.g. loaded with load()
+        """
+
+        names = [name for name, _ in self.columns]
+        length = len(columns[names[0]]) if names else 0
+
+        # empty buffer is filled by copying whole arrays
+        if not self._len and length <= self.capacity:
+            for name, data in zip(names, self._arrays):
+                data[:length] = array(data.typecode, columns[name])
+            self._start = 0
+            self._len = length
+            return
+
+        for values in zip(*(columns[name] for name in names)):
+            self.append(values)
+
+
+# Rollups. Work on any sequences, use numpy when it's installed
+
+def _as_float_array(values):
+    if isinstance(values, array):
+        return numpy.frombuffer(values, dtype=values.typecode).astype('f8')
+    return numpy.asarray(values, dtype='f8')
+
+
+def rate(series, column='size_completed'):
+    """
+    Per second rate of a counter column between consecutive samples, e.g. transfer speed in bytes per second
+
+    :param series: RingBuffer
+    :return: list of rates, one less than samples. Counter drops (agent restarted transfer) give 0
+    """
+
+    times = series.column('time')
+    values = series.column(column)
+    if len(times) < 2:
+        return []
+
+    if numpy is not None:
+        dt = numpy.diff(_as_float_array(times))
+        dv = numpy.clip(numpy.diff(_as_float_array(values)), 0, None)
+        return numpy.divide(dv, dt, out=numpy.zeros_like(dv), where=dt > 0).tolist()
+
+    rates = []
+    for i in range(1, len(times)):
+        dt = times[i] - times[i - 1]
+        dv = values[i] - values[i - 1]
+        rates.append(max(0, dv) / float(dt) if dt > 0 else 0.0)
+    return rates
+
+
+def percentile(values, q):
+    """
+    :param values: sequence of numbers
+    :param q: percentile, 0..100
+    :return: linearly interpolated percentile or None for empty values
+    """
+
+    if not len(values):
+        return None
+
+    if numpy is not None:
+        return float(numpy.percentile(_as_float_array(values), q))
+
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100.0
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def moving_average(values, window):
+    """
+    :param values: sequence of numbers
+    :param window: number of samples averaged
+    :return: list of averages, one per full window
+    """
+
+    if len(values) < window:
+        return []
+
+    if numpy is not None:
+        sums = numpy.cumsum(numpy.concatenate(([0.0], _as_float_array(values))))
+        return ((sums[window:] - sums[:-window]) / window).tolist()
+
+    averages = []
+    total = float(sum(values[:window]))
+    averages.append(total / window)
+    for i in range(window, len(values)):
+        total += values[i] - values[i - window]
+        averages.append(total / window)
+    return averages
+
+
+# Columnar dump
+
+def _encode_column(values, typecode):
+    # integer columns are delta encoded: timestamps and counters become runs of similar small numbers
+    if typecode in 'fd':
+        data = array(typecode, values)
+    else:
+        data = array('q', map(operator.sub, values, chain((0, ), values)))
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def _decode_column(raw, typecode):
+    data = array(typecode if typecode in 'fd' else 'q')
+    data.frombytes(raw)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    if typecode not in 'fd':
+        data = array(typecode, accumulate(data))
+    return data
+
+
+def dump(path, series, metadata=None):
+    """
+    Write series to zlib compressed columnar file
+
+    :param path: file path
+    :param series: dict {key: RingBuffer}, key is a string or a tuple of strings/numbers
+    :param metadata: JSON serializable dict stored along
+    """
+
+    header = {'version': _DUMP_VERSION, 'metadata': metadata or {}, 'series': []}
+    chunks = []
+    for key, buffer in series.items():
+        entry = {'key': list(key) if isinstance(key, tuple) else key, 'length': len(buffer),
+                 'capacity': buffer.capacity, 'columns': []}
+        for name, typecode in buffer.columns:
+            raw = _encode_column(buffer.column(name), typecode)
+            entry['columns'].append([name, typecode, len(raw)])
+            chunks.append(raw)
+        header['series'].append(entry)
+
+    header = json.dumps(header, separators=(',', ':')).encode()
+    with open(path, 'wb') as f:
+        f.write(_DUMP_MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        f.write(zlib.compress(b''.join(chunks), 6))
+
+
+def load(path):
+    """
+    Read file written by dump()
+
+    :return: (dict {key: RingBuffer}, metadata)
+    """
+
+    with open(path, 'rb') as f:
+        if f.read(4) != _DUMP_MAGIC:
+            raise ValueError('{} is not a time series dump'.format(path))
+        header_size, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_size))
+        body = zlib.decompress(f.read())
+
+    if header['version'] != _DUMP_VERSION:
+        raise ValueError('Unsupported time series dump version {}'.format(header['version']))
+
+    series = {}
+    offset = 0
+    for entry in header['series']:
+        columns = {}
+        for name, typecode, size in entry['columns']:
+            columns[name] = _decode_column(body[offset:offset + size], typecode)
+            offset += size
+
+        buffer = RingBuffer([(name, typecode) for name, typecode, _ in entry['columns']], entry['capacity'])
+        buffer.extend_columns(columns)
+        key = entry['key']
+        series[tuple(key) if isinstance(key, list) else key] = buffer
+
+    return series, header['metadata']
+
+
+class TransferStatsCollector:
+    """
+    Samples transfer stats of watched job runs and their agents into ring buffers
+
+    Each sample of a run costs one paged GET /runs/{id}/agents. Series keys are ('run', run_id) for run totals and
+    ('agent', run_id, agent_id) for agents. Memory is bounded: series grow up to capacity samples of 23 bytes per
+    agent and 32 bytes per run, e.g. a week of 5 minute samples of 1000 agents takes 46 MB. Delta encoded dump of
+    it takes well under 1 MB, since sizes and timestamps change by similar steps.
+
+    Runs which finished or were removed are not sampled anymore, series of the latest `keep_finished` of them are
+    kept for rollups and dumps, older ones are freed. unwatch() frees series of the run right away
+    """
+
+    def __init__(self, api, interval=300, capacity=DEFAULT_CAPACITY, page_size=500,
+                 keep_finished=DEFAULT_KEEP_FINISHED):
+        """
+        :param api: ApiBaseCommands instance
+        :param interval: seconds between samples of background thread
+        :param capacity: samples kept per series
+        :param page_size: run agents requested per page
+        :param keep_finished: number of finished runs whose series are kept
+        """
+
+        self.api = api
+        self.interval = interval
+        self.capacity = capacity
+        self.page_size = page_size
+        self.keep_finished = keep_finished
+
+        self._lock = threading.Lock()
+        self._runs = set()
+        self._series = {}
+        # finished runs with series kept, the oldest first
+        self._finished = []
+        # agent statuses are stored as codes in 'status' column
+        self.statuses = ['']
+        self._status_codes = {'': 0}
+
+        self._thread = None
+        self._stop = threading.Event()
+
+    def watch(self, run_id):
+        with self._lock:
+            self._runs.add(run_id)
+
+    def unwatch(self, run_id):
+        """
+        Stop sampling run and free its series
+        """
+
+        with self._lock:
+            self._runs.discard(run_id)
+            if run_id in self._finished:
+                self._finished.remove(run_id)
+            self._drop_series(run_id)
+
+    def watched(self):
+        with self._lock:
+            return list(self._runs)
+
+    def finished(self):
+        """
+        :return: IDs of finished runs whose series are kept, the oldest first
+        """
+
+        with self._lock:
+            return list(self._finished)
+
+    def _drop_series(self, run_id):
+        for key in [key for key in self._series if key[1] == run_id]:
+            del self._series[key]
+
+    def _finish(self, run_id):
+        # called under lock
+        if run_id not in self._runs:
+            return
+        self._runs.discard(run_id)
+        self._finished.append(run_id)
+        while len(self._finished) > self.keep_finished:
+            self._drop_series(self._finished.pop(0))
+
+    def series(self, run_id, agent_id=None):
+        """
+        :return: RingBuffer of run totals or of run agent, None if it was not sampled
+        """
+
+        key = ('run', run_id) if agent_id is None else ('agent', run_id, agent_id)
+        with self._lock:
+            return self._series.get(key)
+
+    def status_name(self, code):
+        return self.statuses[code]
+
+    def _status_code(self, status):
+        code = self._status_codes.get(status)
+        if code is None:
+            if len(self.statuses) > 255:
+                return 0
+            code = self._status_codes[status] = len(self.statuses)
+            self.statuses.append(status)
+        return code
+
+    def _buffer(self, key, columns):
+        buffer = self._series.get(key)
+        if buffer is None:
+            buffer = self._series[key] = RingBuffer(columns, self.capacity)
+        return buffer
+
+    def sample(self):
+        """
+        Sample all watched runs once
+        """
+
+        with self._lock:
+            runs = list(self._runs)
+
+        for run_id in runs:
+            try:
+                self.sample_run(run_id)
+            except ApiNotFoundError:
+                logger.info("Job run %s was removed, not sampled anymore", run_id)
+                with self._lock:
+                    self._finish(run_id)
+            except ApiError as e:
+                logger.error("Failed to sample job run %s stats %s", run_id, e)
+
+    def sample_run(self, run_id):
+        """
+        Sample one run, the run is finished once all its agents are in terminal statuses
+        """
+
+        agents = list(self.api.iter_job_run_agents(run_id, page_size=self.page_size))
+        if agents:
+            finished = all(item.get('status') in TERMINAL_STATUSES for item in agents)
+        else:
+            # run without agents is over when its own status says so
+            finished = self.api._get_job_run(run_id).get('status') in TERMINAL_STATUSES
+        now = int(time.time())
+
+        totals = [now, 0, 0, len(agents), 0, 0]
+        with self._lock:
+            for item in agents:
+                stats = item.get('stats') or item
+                size_completed = stats.get('size_completed') or 0
+                size_total = stats.get('size_total') or 0
+                errors = len(item.get('errors') or ())
+                self._buffer(('agent', run_id, item['agent_id']), AGENT_COLUMNS).append(
+                    (now, size_completed, size_total, self._status_code(item.get('status')), min(errors, 0xffff)))
+
+                totals[1] += size_completed
+                totals[2] += size_total
+                totals[4] += item.get('status') == 'finished'
+                totals[5] += errors
+
+            self._buffer(('run', run_id), RUN_COLUMNS).append(totals)
+            if finished:
+                self._finish(run_id)
+
+    def rollup(self, run_id, agent_id=None, window=12):
+        """
+        Transfer speed summary of run or run agent
+
+        :param window: samples in moving average
+        :return: dict with 'last', 'p50', 'p95', 'max' rates in bytes per second and 'moving_average' list,
+            None if there are less than two samples
+        """
+
+        buffer = self.series(run_id, agent_id)
+        if buffer is None or len(buffer) < 2:
+            return None
+
+        with self._lock:
+            rates = rate(buffer)
+        return {
+            'last': rates[-1],
+            'p50': percentile(rates, 50),
+            'p95': percentile(rates, 95),
+            'max': max(rates),
+            'moving_average': moving_average(rates, min(window, len(rates))),
+        }
+
+    def dump(self, path):
+        with self._lock:
+            dump(path, dict(self._series), {'statuses': self.statuses, 'finished': self._finished})
+
+    def restore(self, path):
+        """
+        Load series written by dump(), replacing the current ones
+        """
+
+        series, metadata = load(path)
+        with self._lock:
+            self._series = series
+            self.statuses = list(metadata.get('statuses', ['']))
+            self._status_codes = {status: code for code, status in enumerate(self.statuses)}
+            self._finished = list(metadata.get('finished', []))
+            self._runs.update(key[1] for key in series if key[0] == 'run' and key[1] not in self._finished)
+
+    def start(self):
+        """
+        Sample watched runs every `interval` seconds in a daemon thread
+        """
+
+        def loop():
+            while not self._stop.is_set():
+                started = time.monotonic()
+                self.sample()
+                self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, name='transfer-stats', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,371 @@
+import queue
+import threading
+import time
+
+from errors import ApiError, ApiNotFoundError
+from logger import logger
+
+# run agent statuses after which agent won't transfer anymore
+TERMINAL_STATUSES = ('finished', 'stopped', 'failed', 'cancelled')
+
+# weight of the latest throughput sample in smoothed run throughput
+THROUGHPUT_SMOOTHING = 0.3
+
+
+class RunEvent:
+    """
+    Change of job run noticed by RunWatcher
+
+    kind is one of:
+        'agent_added'   agent appeared in the run, new is its status
+        'agent_removed' agent left the run, old is its last status
+        'status'        agent status changed from old to new
+        'progress'      agent transferred more data: old and new are completed bytes
+        'error'         agent reported new errors: old is number of errors before, new is a list of new ones
+        'run'           run totals changed, new is RunProgress
+        'done'          all agents are in terminal statuses or the run finished without agents, the run is not
+                        watched anymore, new is RunProgress
+        'removed'       the run doesn't exist on MC anymore, it's not watched anymore, new is the last RunProgress
+    """
+
+    __slots__ = ('kind', 'run_id', 'agent_id', 'old', 'new', 'time')
+
+    def __init__(self, kind, run_id, agent_id=None, old=None, new=None, time=None):
+        self.kind = kind
+        self.run_id = run_id
+        self.agent_id = agent_id
+        self.old = old
+        self.new = new
+        self.time = time
+
+    def __repr__(self):
+        return 'RunEvent({}, run={}, agent={}, {!r} -> {!r})'.format(self.kind, self.run_id, self.agent_id,
+                                                                      self.old, self.new)
+
+
+class RunProgress:
+    """
+    Totals of job run computed from agent deltas
+    """
+
+    __slots__ = ('run_id', 'size_total', 'size_completed', 'throughput', 'statuses', 'errors')
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.size_total = 0
+        self.size_completed = 0
+        # bytes per second, smoothed over polls
+        self.throughput = None
+        # {status: number of agents}
+        self.statuses = {}
+        self.errors = 0
+
+    @property
+    def fraction(self):
+        return float(self.size_completed) / self.size_total if self.size_total else None
+
+    @property
+    def eta(self):
+        """
+        Seconds left at current throughput, None if unknown
+        """
+
+        if not self.throughput:
+            return None
+        return max(0.0, (self.size_total - self.size_completed) / self.throughput)
+
+    def copy(self):
+        progress = RunProgress(self.run_id)
+        for attr in self.__slots__:
+            setattr(progress, attr, getattr(self, attr))
+        progress.statuses = dict(self.statuses)
+        return progress
+
+    def __repr__(self):
+        return 'RunProgress(run={}, {}/{} bytes, throughput={}, eta={}, statuses={})'.format(
+            self.run_id, self.size_completed, self.size_total, self.throughput, self.eta, self.statuses)
+
+
+def _agent_state(item):
+    # compact (status, size_completed, size_total, errors count) kept per agent between polls
+    stats = item.get('stats') or item
+    return (item.get('status'), stats.get('size_completed') or 0, stats.get('size_total') or 0,
+            len(item.get('errors') or ()))
+
+
+class _WatchedRun:
+    __slots__ = ('agents', 'progress', 'polled_at')
+
+    def __init__(self, run_id):
+        self.agents = {}
+        self.progress = RunProgress(run_id)
+        self.polled_at = None
+
+
+class RunSubscription:
+    """
+    Iterable of RunEvent delivered to one subscriber, see RunWatcher.subscribe()
+    """
+
+    def __init__(self, watcher, run_ids, max_events):
+        self._watcher = watcher
+        self.run_ids = None if run_ids is None else set(run_ids)
+        self._queue = queue.Queue(max_events)
+        self.dropped = 0
+        self.closed = False
+
+    def _put(self, event):
+        if self.run_ids is not None and event.run_id not in self.run_ids:
+            return
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # slow subscriber loses events instead of blocking watcher and other subscribers
+            self.dropped += 1
+
+    def get(self, timeout=None):
+        """
+        Get next event
+
+        :return: RunEvent or None if there was no event for `timeout` seconds or subscription is closed
+        """
+
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.closed = True
+        self._watcher._unsubscribe(self)
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def __iter__(self):
+        while not self.closed:
+            event = self._queue.get()
+            if event is not None:
+                yield event
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RunWatcher:
+    """
+    Polls agents of watched job runs and publishes only what changed since the previous poll
+
+    Every watched run costs one paged GET /runs/{id}/agents per poll, regardless of the number of subscribers.
+    Watcher keeps a compact state per agent, so big runs are cheap to diff.
+    """
+
+    def __init__(self, api, interval=5.0, page_size=500, unwatch_done=True):
+        """
+        :param api: ApiBaseCommands instance
+        :param interval: seconds between polls of background thread
+        :param page_size: run agents requested per page
+        :param unwatch_done: stop watching run after all its agents reached terminal statuses
+        """
+
+        self.api = api
+        self.interval = interval
+        self.page_size = page_size
+        self.unwatch_done = unwatch_done
+
+        self._lock = threading.Lock()
+        self._runs = {}
+        self._subscriptions = []
+        self._thread = None
+        self._stop = threading.Event()
+
+    def watch(self, run_id):
+        with self._lock:
+            self._runs.setdefault(run_id, _WatchedRun(run_id))
+
+    def unwatch(self, run_id):
+        with self._lock:
+            self._runs.pop(run_id, None)
+
+    def watched(self):
+        with self._lock:
+            return list(self._runs)
+
+    def progress(self, run_id):
+        """
+        :return: copy of RunProgress of watched run or None
+        """
+
+        with self._lock:
+            run = self._runs.get(run_id)
+            return None if run is None else run.progress.copy()
+
+    def subscribe(self, run_ids=None, max_events=10000):
+        """
+        Subscribe to events of all or some runs
+
+        :param run_ids: iterable of run IDs to receive events of, all runs if None
+        :param max_events: max number of events waiting in the subscription, the newer ones are dropped
+        :return: RunSubscription
+        """
+
+        subscription = RunSubscription(self, run_ids, max_events)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def _publish(self, events):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for event in events:
+            for subscription in subscriptions:
+                subscription._put(event)
+
+    def poll(self):
+        """
+        Poll all watched runs once and publish events
+
+        :return: list of published events
+        """
+
+        events = []
+        for run_id in self.watched():
+            try:
+                events.extend(self.poll_run(run_id))
+            except ApiError as e:
+                logger.error("Failed to poll job run %s agents %s", run_id, e)
+        return events
+
+    def poll_run(self, run_id):
+        """
+        Poll one watched run and publish its events
+
+        :return: list of published events
+        """
+
+        current = {}
+        # error lists are kept only for agents having them, until diff picks new ones
+        errors = {}
+        try:
+            for item in self.api.iter_job_run_agents(run_id, page_size=self.page_size):
+                current[item['agent_id']] = _agent_state(item)
+                if item.get('errors'):
+                    errors[item['agent_id']] = item['errors']
+            # run without agents never produces events, its own status tells if it's over
+            finished = not current and self.unwatch_done and \
+                self.api._get_job_run(run_id).get('status') in TERMINAL_STATUSES
+        except ApiNotFoundError:
+            return self._end(run_id, 'removed')
+        now = time.time()
+
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None:
+                return []
+            events = self._diff(run_id, run, current, errors, now)
+
+        if finished or events and self.unwatch_done and current and \
+                all(state[0] in TERMINAL_STATUSES for state in current.values()):
+            events.extend(self._end(run_id, 'done', publish=False))
+
+        self._publish(events)
+        return events
+
+    def _end(self, run_id, kind, publish=True):
+        # stop watching run and report it with 'done' or 'removed' event
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return []
+        events = [RunEvent(kind, run_id, new=run.progress.copy(), time=time.time())]
+        if publish:
+            self._publish(events)
+        return events
+
+    @staticmethod
+    def _diff(run_id, run, current, errors, now):
+        events = []
+        previous = run.agents
+
+        for agent_id, state in current.items():
+            old = previous.get(agent_id)
+            if old is None:
+                events.append(RunEvent('agent_added', run_id, agent_id, None, state[0], now))
+                if state[3]:
+                    events.append(RunEvent('error', run_id, agent_id, 0, list(errors[agent_id]), now))
+                continue
+            if old[0] != state[0]:
+                events.append(RunEvent('status', run_id, agent_id, old[0], state[0], now))
+            if old[1] != state[1]:
+                events.append(RunEvent('progress', run_id, agent_id, old[1], state[1], now))
+            if state[3] > old[3]:
+                events.append(RunEvent('error', run_id, agent_id, old[3], list(errors[agent_id][old[3]:]), now))
+
+        for agent_id, old in previous.items():
+            if agent_id not in current:
+                events.append(RunEvent('agent_removed', run_id, agent_id, old[0], None, now))
+
+        run.agents = current
+        progress = run.progress
+        size_completed = sum(state[1] for state in current.values())
+
+        # the first poll only establishes the baseline, throughput is known from the second one.
+        # Polls without changes count too: they slow throughput down and push ETA away
+        if run.polled_at is not None and now > run.polled_at:
+            sample = max(0, size_completed - progress.size_completed) / (now - run.polled_at)
+            if progress.throughput is None:
+                progress.throughput = sample
+            else:
+                progress.throughput += THROUGHPUT_SMOOTHING * (sample - progress.throughput)
+        run.polled_at = now
+        progress.size_completed = size_completed
+
+        if not events:
+            return events
+
+        progress.size_total = sum(state[2] for state in current.values())
+        progress.errors = sum(state[3] for state in current.values())
+        statuses = {}
+        for state in current.values():
+            statuses[state[0]] = statuses.get(state[0], 0) + 1
+        progress.statuses = statuses
+
+        events.append(RunEvent('run', run_id, new=progress.copy(), time=now))
+        return events
+
+    def start(self):
+        """
+        Poll watched runs every `interval` seconds in a daemon thread
+        """
+
+        def loop():
+            while not self._stop.is_set():
+                started = time.monotonic()
+                self.poll()
+                self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, name='run-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
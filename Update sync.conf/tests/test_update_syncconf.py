@@ -0,0 +1,103 @@
+import fcntl
+import importlib.util
+import json
+import os
+import threading
+
+import pytest
+
+# script name has a dash, load it as a module
+_spec = importlib.util.spec_from_file_location(
+    'update_syncconf', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'update-syncconf.py'))
+syncconf = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(syncconf)
+
+CONFIG = {'device_name': 'agent', 'management_server': {'host': 'mc:8444'}}
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / 'sync.conf'
+    path.write_text(json.dumps(CONFIG))
+    os.chmod(str(path), 0o600)
+    return str(path)
+
+
+def leftovers(config_path):
+    folder = os.path.dirname(config_path)
+    return sorted(name for name in os.listdir(folder) if name.startswith('.'))
+
+
+def test_save_replaces_config_and_keeps_backup(config_path):
+    original = open(config_path).read()
+
+    assert syncconf.save_agent_config(config_path, dict(CONFIG, use_gui=False))
+
+    assert json.load(open(config_path)) == dict(CONFIG, use_gui=False)
+    assert open(config_path + '.bak').read() == original
+    assert os.stat(config_path).st_mode & 0o777 == 0o600
+    assert leftovers(config_path) == []
+
+
+def test_save_without_backup(config_path):
+    assert syncconf.save_agent_config(config_path, dict(CONFIG, use_gui=False), backup=False)
+    assert not os.path.exists(config_path + '.bak')
+
+
+def test_identical_content_is_not_rewritten(config_path):
+    assert syncconf.save_agent_config(config_path, CONFIG)
+    mtime = os.stat(config_path).st_mtime_ns
+
+    assert not syncconf.save_agent_config(config_path, CONFIG)
+    assert os.stat(config_path).st_mtime_ns == mtime
+
+
+def test_failed_write_leaves_config_intact(config_path, monkeypatch):
+    original = open(config_path).read()
+
+    def full_disk(fd):
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(syncconf.os, 'fsync', full_disk)
+    with pytest.raises(OSError):
+        syncconf.save_agent_config(config_path, dict(CONFIG, use_gui=False))
+
+    assert open(config_path).read() == original
+    assert leftovers(config_path) == []
+
+
+def test_lock_is_exclusive(config_path):
+    def try_lock(result):
+        with open(config_path + '.lock', 'a') as handle:
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                result.append('locked')
+            except (IOError, OSError):
+                result.append('busy')
+
+    held, free = [], []
+    with syncconf.lock_config(config_path):
+        thread = threading.Thread(target=try_lock, args=(held, ))
+        thread.start()
+        thread.join()
+    try_lock(free)
+
+    assert held == ['busy']
+    assert free == ['locked']
+
+
+def test_update_config_file_applies_changes_once(config_path):
+    changes = [('set', 'use_gui', False), ('set', 'host', 'new-mc:8444'), ('delete', 'device_name')]
+
+    path, status, _, _ = syncconf.update_config_file((config_path, changes, True), quiet=True)
+    assert (path, status) == (config_path, 'updated')
+    assert json.load(open(config_path)) == {'use_gui': False, 'management_server': {'host': 'new-mc:8444'}}
+
+    assert syncconf.update_config_file((config_path, changes, True), quiet=True)[1] == 'unchanged'
+
+
+def test_update_config_file_reports_invalid_json(tmp_path):
+    path = tmp_path / 'sync.conf'
+    path.write_text('{not json')
+
+    assert syncconf.update_config_file((str(path), [('set', 'use_gui', False)], True), quiet=True)[1] == 'failed'
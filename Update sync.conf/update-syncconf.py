@@ -10,15 +10,42 @@
 # ==============================================================================
 
 import argparse
+import contextlib
+import ctypes
+import ctypes.util
+import errno
+import glob
+import hashlib
 import json
 import logging
+import multiprocessing
 import os
+import select
+import shutil
 import signal
 import subprocess
 import sys
+import tempfile
 import time
 import stat
+import struct
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+# launchd plist of the agent, set by --launch_daemon
+launch_daemon_path = None
+
+# Automator application restarting the agent, lies next to the script regardless of working directory
+restart_app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'restart_agent_detached.app')
 
 management_server_args = ['bootstrap_token',
                           'cert_authority_fingerprint',
@@ -27,14 +54,26 @@ management_server_args = ['bootstrap_token',
 
 
 def main():
+    global launch_daemon_path
+
     args = get_args()
     init_logging(args.log)
-    logging.info('Reading {}'.format(args.config) + os.linesep)
-    config = read_agent_config(args.config)
+    launch_daemon_path = args.launch_daemon
 
-    logging.info('Current sync.conf is:' + os.linesep + str(config) + os.linesep)
+    if args.watch is not None:
+        watch_configs(args)
+        sys.exit(0)
 
-    process_tasks(config, args)
+    if args.manifest is not None or args.glob is not None:
+        sys.exit(1 if process_batch(args) else 0)
+
+    with lock_config(args.config):
+        logging.info('Reading {}'.format(args.config) + os.linesep)
+        config = read_agent_config(args.config)
+
+        logging.info('Current sync.conf is:' + os.linesep + str(config) + os.linesep)
+
+        process_tasks(config, args)
 
     sys.exit(0)
 
@@ -47,9 +86,28 @@ def init_logging(log_to_file=False):
 
 
 def process_tasks(config, args):
-    create_new_config = False
+    changes = build_changes(args)
+
+    if changes:
+        apply_changes(config, changes)
+        if save_agent_config(args.config, config, backup=not args.no_backup):
+            logging.info(Colors.green + 'New sync.conf is:' + os.linesep + str(config) + Colors.end + os.linesep)
+        else:
+            logging.info('sync.conf already has this content, not rewritten' + os.linesep)
+
+    if args.restart_agent:
+        restart_agent()
+
+    if args.restart_agent_daemon:
+        restart_agent_daemon()
+
+
+def build_changes(args):
+    """
+    Collect changes requested by arguments as a list of ('set', name, value) and ('delete', name) tuples
+    """
+    changes = []
     if args.parameter is not None:
-        create_new_config = True
         for parameter in args.parameter:
             try:
                 name, value = parameter.split('=')
@@ -57,57 +115,387 @@ def process_tasks(config, args):
                 raise argparse.ArgumentTypeError('--parameter has <name>=<value> syntax' + os.linesep +
                                                  'Multiple values can be set')
             name = verify_name(name)
-            value = verify_value(value)
-            set_parameter(name, config, value)
-
-    if args.bootstrap_token is not None:
-        create_new_config = True
-        value = verify_value(args.bootstrap_token)
-        set_parameter('bootstrap_token', config, value)
-
-    if args.disable_cert_check is not None:
-        create_new_config = True
-        value = verify_value(args.disable_cert_check)
-        set_parameter('disable_cert_check', config, value)
-
-    if args.fingerprint is not None:
-        create_new_config = True
-        value = verify_value(args.fingerprint)
-        set_parameter('cert_authority_fingerprint', config, value)
-
-    if args.folders_storage_path is not None:
-        create_new_config = True
-        value = verify_value(args.folders_storage_path)
-        set_parameter('folders_storage_path', config, value)
-
-    if args.host is not None:
-        create_new_config = True
-        value = verify_value(args.host)
-        set_parameter('host', config, value)
-
-    if args.tags is not None:
-        create_new_config = True
-        value = verify_value(args.tags)
-        set_parameter('tags', config, value)
-
-    if args.use_gui is not None:
-        create_new_config = True
-        value = verify_value(args.use_gui)
-        set_parameter('use_gui', config, value)
+            changes.append(('set', name, verify_value(value)))
+
+    for name, value in (('bootstrap_token', args.bootstrap_token),
+                        ('disable_cert_check', args.disable_cert_check),
+                        ('cert_authority_fingerprint', args.fingerprint),
+                        ('folders_storage_path', args.folders_storage_path),
+                        ('host', args.host),
+                        ('tags', args.tags),
+                        ('use_gui', args.use_gui)):
+        if value is not None:
+            changes.append(('set', name, verify_value(value)))
 
     if args.delete is not None:
-        create_new_config = True
-        delete_parameter(args.delete, config)
+        changes.append(('delete', args.delete))
+
+    return changes
+
+
+def apply_changes(config, changes, quiet=False):
+    """
+    quiet - don't log every change and deleted parameters which are missing already
+    """
+    for change in changes:
+        if change[0] == 'set':
+            set_parameter(change[1], config, change[2], quiet)
+        elif change[0] == 'set_server':
+            config.setdefault('management_server', {})[change[1]] = change[2]
+        else:
+            delete_parameter(change[1], config, quiet)
+
+
+def process_batch(args):
+    """
+    Apply changes to every config of the manifest and glob patterns in worker processes.
+    Prints a line per file and returns number of failed files
+    """
+    changes = build_changes(args)
+    paths = collect_config_paths(args.manifest, args.glob)
+    if not paths:
+        logging.error(Colors.red + 'No sync.conf files to update' + Colors.end)
+        return 1
+
+    started = time.time()
+    workers = min(args.workers or multiprocessing.cpu_count(), len(paths))
+    pool = multiprocessing.Pool(workers, initializer=init_batch_worker)
+    try:
+        results = pool.imap(update_config_file, [(path, changes, not args.no_backup) for path in paths], chunksize=4)
+        counts = {'updated': 0, 'unchanged': 0, 'failed': 0}
+        for path, status, elapsed, message in results:
+            counts[status] += 1
+            color = {'updated': Colors.green, 'unchanged': '', 'failed': Colors.red}[status]
+            logging.info('{}{:<9} {:8.3f}s  {}{}{}'.format(color, status, elapsed, path,
+                                                          '  ' + message if message else '',
+                                                          Colors.end if color else ''))
+    finally:
+        pool.close()
+        pool.join()
+
+    logging.info(os.linesep + '{} files in {:.2f}s: {} updated, {} unchanged, {} failed'.format(
+        len(paths), time.time() - started, counts['updated'], counts['unchanged'], counts['failed']))
+
+    if counts['updated']:
+        if args.restart_agent:
+            restart_agent()
+        if args.restart_agent_daemon:
+            restart_agent_daemon()
+
+    return counts['failed']
+
+
+def collect_config_paths(manifest, patterns):
+    """
+    Paths listed in manifest file (one per line, # starts a comment) and matching glob patterns, without duplicates
+    """
+    paths = []
+    if manifest is not None:
+        with open(manifest) as handle:
+            for line in handle:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    paths.append(os.path.expanduser(line))
+
+    for pattern in patterns or ():
+        paths.extend(sorted(glob.glob(os.path.expanduser(pattern))))
+
+    seen = set()
+    unique = []
+    for path in paths:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            unique.append(path)
+
+    return unique
+
+
+def init_batch_worker():
+    # per parameter messages of workers would drown the summary
+    logging.getLogger().setLevel(logging.WARNING)
+    # Ctrl+C is handled by the parent process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def config_digest(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def update_config_file(task, quiet=False):
+    """
+    Apply changes to one sync.conf in a worker process or watch mode.
+    Returns (path, status, seconds, message), status is 'updated', 'unchanged' or 'failed'
+    """
+    path, changes, backup = task
+    started = time.time()
+    try:
+        with lock_config(path):
+            with open(path, 'r') as handle:
+                config = json.load(handle)
+            digest = config_digest(config)
+            apply_changes(config, changes, quiet)
+            new_digest = config_digest(config)
+            if new_digest == digest or not save_agent_config(path, config, backup):
+                return path, 'unchanged', time.time() - started, ''
+        return path, 'updated', time.time() - started, new_digest[:12]
+    except (IOError, OSError, ValueError) as e:
+        return path, 'failed', time.time() - started, str(e)
+
+
+def load_desired_state(path):
+    """
+    Read desired state file and convert it to changes:
+    {
+        "parameters": {"<name>": <value>, ...},
+        "management_server": {"<field>": <value>, ...},
+        "delete": ["<name>", ...]
+    }
+    """
+    with open(path, 'r') as handle:
+        state = json.load(handle)
+
+    changes = [('set', name, value) for name, value in sorted(state.get('parameters', {}).items())]
+    changes.extend(('set_server', name, value) for name, value in sorted(state.get('management_server', {}).items()))
+    changes.extend(('delete', name) for name in state.get('delete', []))
+    return changes
+
+
+def encode_path(path):
+    return path if isinstance(path, bytes) else path.encode(sys.getfilesystemencoding())
+
+
+def decode_path(path):
+    return path if isinstance(path, str) else path.decode(sys.getfilesystemencoding())
+
+
+class InotifyWatcher(object):
+    """
+    Reports files changed in watched folders via Linux inotify. Folders are watched instead of files:
+    sync.conf is replaced by rename, which ends watches of the file itself
+    """
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self.folders = {}
+
+    def set_paths(self, paths):
+        watched = set(self.folders.values())
+        for folder in set(os.path.dirname(os.path.abspath(path)) for path in paths) - watched:
+            wd = self.libc.inotify_add_watch(self.fd, encode_path(folder), self.IN_CLOSE_WRITE | self.IN_MOVED_TO |
+                                             self.IN_CREATE | self.IN_DELETE)
+            if wd < 0:
+                logging.error(Colors.warn + 'Can\'t watch {}: {}'.format(folder, os.strerror(ctypes.get_errno())) +
+                              Colors.end)
+                continue
+            self.folders[wd] = folder
+
+    def wait(self, timeout):
+        """
+        Returns list of paths changed during timeout seconds, None if events were lost and everything should be
+        checked
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+
+        data = os.read(self.fd, 64 * 1024)
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                return None
+            if wd in self.folders and name:
+                paths.append(os.path.join(self.folders[wd], decode_path(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """
+    Reports files whose size, mtime or inode changed, for systems without inotify (e.g. macOS)
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.stats = {}
+
+    def file_stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size, st.st_ino
+
+    def set_paths(self, paths):
+        self.stats = dict((os.path.abspath(path), self.stats.get(os.path.abspath(path), self.file_stat(path)))
+                          for path in paths)
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        paths = []
+        for path, old in self.stats.items():
+            new = self.file_stat(path)
+            if new != old:
+                self.stats[path] = new
+                paths.append(path)
+        return paths
+
+    def close(self):
+        pass
 
-    if create_new_config:
-        save_agent_config(args.config, config)
-        logging.info(Colors.green + 'New sync.conf is:' + os.linesep + str(config) + Colors.end + os.linesep)
 
-    if args.restart_agent:
-        restart_agent()
+def create_watcher(poll_interval):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError) as e:
+            logging.error(Colors.warn + 'inotify is not available ({}), polling files'.format(e) + Colors.end)
+    return PollingWatcher(poll_interval)
+
+
+class RestartLimiter(object):
+    """
+    Restarts agent at most once per interval seconds: restarts requested meanwhile are merged into one,
+    made when the interval ends
+    """
+    def __init__(self, interval, restart):
+        self.interval = interval
+        self.restart = restart
+        self.last = None
+        self.pending = False
+
+    def request(self):
+        self.pending = True
+
+    def due(self, now):
+        """
+        Returns time of the pending restart, None if there is no pending restart
+        """
+        if not self.pending:
+            return None
+        return now if self.last is None else max(now, self.last + self.interval)
+
+    def run_due(self, now):
+        due = self.due(now)
+        if due is None or due > now:
+            return
+        self.pending = False
+        self.last = now
+        try:
+            self.restart()
+        except (OSError, subprocess.CalledProcessError, SystemExit) as e:
+            # restart functions exit when the agent can't be found, the watch goes on
+            logging.error(Colors.red + 'Failed to restart Resilio Connect Agent: {}'.format(e) + Colors.end)
+
+
+def watch_configs(args):
+    """
+    Keep configs in the desired state: apply it to every config, then again to configs changed by someone else.
+    Changes of the desired state file are applied to all configs
+    """
+    state_path = os.path.abspath(args.watch)
+    changes = load_desired_state(state_path)
+    backup = not args.no_backup
+
+    def select_paths():
+        if args.manifest is None and args.glob is None:
+            return [args.config]
+        return collect_config_paths(args.manifest, args.glob)
+
+    def reconcile(paths):
+        updated = 0
+        for path in sorted(paths):
+            path, status, elapsed, message = update_config_file((path, changes, backup), quiet=True)
+            if status == 'updated':
+                updated += 1
+                logging.info(Colors.green + 'Updated {} in {:.3f}s'.format(path, elapsed) + Colors.end)
+            elif status == 'failed':
+                logging.error(Colors.red + 'Failed to update {}: {}'.format(path, message) + Colors.end)
+        if updated and (args.restart_agent or args.restart_agent_daemon):
+            limiter.request()
+        return updated
+
+    restart = restart_agent_daemon if args.restart_agent_daemon else restart_agent
+    limiter = RestartLimiter(args.restart_interval, restart)
+    watcher = create_watcher(args.poll_interval)
+
+    paths = dict((os.path.abspath(path), path) for path in select_paths())
+    watcher.set_paths(list(paths) + [state_path])
+    logging.info('Watching {} sync.conf files, desired state {}'.format(len(paths), state_path))
+    reconcile(paths.values())
+    next_rescan = time.time() + args.rescan
+
+    # changed configs wait until there are no new changes for debounce seconds, but not longer than max_delay
+    max_delay = args.debounce * 10
+    pending = set()
+    state_changed = False
+    first_change = last_change = None
 
-    if args.restart_agent_daemon:
-        restart_agent_daemon()
+    try:
+        while True:
+            now = time.time()
+            deadlines = [next_rescan]
+            if pending or state_changed:
+                deadlines.append(min(last_change + args.debounce, first_change + max_delay))
+            restart_due = limiter.due(now)
+            if restart_due is not None:
+                deadlines.append(restart_due)
+            changed = watcher.wait(max(0.0, min(deadlines) - now))
+
+            now = time.time()
+            if changed is None:
+                changed = list(paths) + [state_path]
+            for path in changed:
+                path = os.path.abspath(path)
+                if path == state_path:
+                    state_changed = True
+                elif path in paths:
+                    pending.add(paths[path])
+                else:
+                    continue
+                first_change = first_change or now
+                last_change = now
+
+            if (pending or state_changed) and \
+                    (now >= last_change + args.debounce or now >= first_change + max_delay):
+                if state_changed:
+                    try:
+                        changes = load_desired_state(state_path)
+                        logging.info('Desired state changed, checking all sync.conf files')
+                        pending = set(paths.values())
+                    except (IOError, OSError, ValueError) as e:
+                        logging.error(Colors.red + 'Invalid desired state {}: {}'.format(state_path, e) + Colors.end)
+                reconcile(pending)
+                pending = set()
+                state_changed = False
+                first_change = last_change = None
+
+            if now >= next_rescan:
+                # picks up agents added since start and changes of lost events
+                paths = dict((os.path.abspath(path), path) for path in select_paths())
+                watcher.set_paths(list(paths) + [state_path])
+                reconcile(paths.values())
+                next_rescan = now + args.rescan
+
+            limiter.run_due(time.time())
+    except KeyboardInterrupt:
+        logging.info('Stopped watching')
+    finally:
+        watcher.close()
 
 
 def restart_agent():
@@ -122,7 +510,7 @@ def restart_agent_daemon():
 
 
 def stop_agent_daemon():
-    if os.path.isfile(launch_daemon_path):
+    if launch_daemon_path and os.path.isfile(launch_daemon_path):
         logging.info('Stopping Resilio Connect Agent daemon.')
         subprocess.call(['sudo', 'launchctl', 'unload', '-w', launch_daemon_path])
         logging.info('Done.')
@@ -135,7 +523,7 @@ def stop_agent_daemon():
 
 
 def start_agent_daemon():
-    if os.path.isfile(launch_daemon_path):
+    if launch_daemon_path and os.path.isfile(launch_daemon_path):
         logging.info('Starting Resilio Connect Agent daemon.')
         subprocess.call(['sudo', 'launchctl', 'load', '-w', launch_daemon_path])
         logging.info('Done. Resilio Connect Agent should start in a 90 seconds')
@@ -152,16 +540,17 @@ def initialize_cron():
 
 
 def change_permissions():
-    st = os.stat('restart_agent_detached.app/Contents/MacOS/Application Stub')
-    os.chmod('restart_agent_detached.app/Contents/MacOS/Application Stub', st.st_mode | stat.S_IEXEC)
+    stub_path = os.path.join(restart_app_path, 'Contents', 'MacOS', 'Application Stub')
+    st = os.stat(stub_path)
+    os.chmod(stub_path, st.st_mode | stat.S_IEXEC)
 
 def automator_restart():
-    cmd = ("open restart_agent_detached.app")
-    subprocess.Popen(cmd, shell=True)
+    subprocess.Popen(['open', restart_app_path])
 
 
-def delete_parameter(name, config):
-    logging.info("Deleting '{}'".format(name) + os.linesep)
+def delete_parameter(name, config, quiet=False):
+    if not quiet:
+        logging.info("Deleting '{}'".format(name) + os.linesep)
 
     if name in config:
         del config[name]
@@ -171,11 +560,13 @@ def delete_parameter(name, config):
         del config['management_server'][name]
         return
 
-    logging.error(Colors.warn + 'Can\'t find {} in sync.conf. Skipping'.format(name) + Colors.end + os.linesep)
+    if not quiet:
+        logging.error(Colors.warn + 'Can\'t find {} in sync.conf. Skipping'.format(name) + Colors.end + os.linesep)
 
 
-def set_parameter(name, config, value):
-    logging.info("Setting '{}' to '{}'".format(name, value) + os.linesep)
+def set_parameter(name, config, value, quiet=False):
+    if not quiet:
+        logging.info("Setting '{}' to '{}'".format(name, value) + os.linesep)
 
     if name in management_server_args:
         if 'management_server' not in config:
@@ -226,11 +617,80 @@ def read_agent_config(config):
     return data
 
 
-def save_agent_config(config, data):
-    handle = open(config, "w+")
-    handle.write(json.dumps(data, indent=4))
-    handle.write(os.linesep)
-    handle.close()
+@contextlib.contextmanager
+def lock_config(config):
+    """
+    Exclusive lock of sync.conf held while it's read, changed and saved, so that concurrent runs don't lose
+    each other's changes. The lock is taken on <config>.lock: the config itself is replaced on save.
+    Does nothing where fcntl is not available
+    """
+    if fcntl is None:
+        yield
+        return
+
+    handle = open(config + '.lock', 'a')
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+        yield
+    finally:
+        handle.close()
+
+
+def save_agent_config(config, data, backup=True):
+    """
+    Replace sync.conf atomically: new content is written to a temp file in the same folder, synced to disk
+    and renamed over the config, so a crash or full disk never leaves a truncated config.
+    The previous config is kept as <config>.bak. Callers hold lock_config().
+    Returns False without writing if the file already has the same content
+    """
+    # explicit separators: Python 2 puts trailing spaces after commas with indent, content would differ between versions
+    content = (json.dumps(data, indent=4, separators=(',', ': ')) + os.linesep).encode('utf-8')
+
+    try:
+        with open(config, 'rb') as handle:
+            if handle.read() == content:
+                return False
+        exists = True
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
+        exists = False
+
+    directory = os.path.dirname(os.path.abspath(config))
+    fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(config) + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(content)
+            handle.flush()
+            os.fsync(handle.fileno())
+
+        if exists:
+            st = os.stat(config)
+            os.chmod(temp_path, stat.S_IMODE(st.st_mode))
+            if hasattr(os, 'chown'):
+                try:
+                    os.chown(temp_path, st.st_uid, st.st_gid)
+                except OSError:
+                    # not permitted for other users' files unless running as root, keep the owner of the process
+                    pass
+            if backup:
+                shutil.copy2(config, config + '.bak')
+
+        os.rename(temp_path, config)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    # make the rename itself durable
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    return True
 
 
 def get_args():
@@ -268,11 +728,23 @@ class Colors:
 def parse_arguments():
     user_home = os.path.expanduser("~")
     parser = argparse.ArgumentParser()
-    parser.add_argument('--config', '-c',
-                        default='{}/Library/Application Support/Resilio Connect Agent/sync.conf'.format(user_home),
-                        metavar='<path_to_sync.conf>',
-                        required=True,
-                        help='path to sync.conf (default: %(default)s)')
+    configs = parser.add_mutually_exclusive_group(required=True)
+    configs.add_argument('--config', '-c',
+                         default='{}/Library/Application Support/Resilio Connect Agent/sync.conf'.format(user_home),
+                         metavar='<path_to_sync.conf>',
+                         help='path to sync.conf (default: %(default)s)')
+    configs.add_argument('--manifest', '-m',
+                         metavar='<path_to_manifest>',
+                         help='batch mode: file listing paths to sync.conf files, one per line')
+    configs.add_argument('--glob', '-g',
+                         metavar='<pattern>',
+                         nargs='+',
+                         help='batch mode: sync.conf files matching the patterns, e.g. "/srv/agents/*/sync.conf"')
+
+    parser.add_argument('--workers', '-w',
+                        type=int,
+                        metavar='<count>',
+                        help='batch mode: number of worker processes (default: number of CPUs)')
 
     parser.add_argument('--parameter', '-p',
                         metavar='<name>=<value>',
@@ -284,6 +756,11 @@ def parse_arguments():
                         metavar='<parameter_name>',
                         help='delete parameter')
 
+    parser.add_argument('--no_backup',
+                        default=False,
+                        help='don\'t keep previous sync.conf as sync.conf.bak',
+                        action='store_true')
+
     parser.add_argument('--restart_agent', '-r',
                         default=False,
                         help='restart Resilio Connect Agent after applying config',
@@ -294,6 +771,37 @@ def parse_arguments():
                         help='restart launchd daemon of Resilio Connect Agent after applying config',
                         action='store_true')
 
+    parser.add_argument('--launch_daemon',
+                        metavar='<path_to_plist>',
+                        help='launchd plist of Resilio Connect Agent daemon restarted by --restart_agent_daemon')
+
+    parser.add_argument('--watch',
+                        metavar='<path_to_desired_state>',
+                        help='keep running and apply desired state JSON file (parameters, management_server, '
+                             'delete) to sync.conf files whenever they or the desired state change')
+    parser.add_argument('--debounce',
+                        type=float,
+                        default=2.0,
+                        metavar='<seconds>',
+                        help='watch mode: wait for no more changes this long before applying (default: %(default)s)')
+    parser.add_argument('--restart_interval',
+                        type=float,
+                        default=300.0,
+                        metavar='<seconds>',
+                        help='watch mode: min time between agent restarts (default: %(default)s)')
+    parser.add_argument('--rescan',
+                        type=float,
+                        default=600.0,
+                        metavar='<seconds>',
+                        help='watch mode: check all sync.conf files and pick up new ones this often '
+                             '(default: %(default)s)')
+    parser.add_argument('--poll_interval',
+                        type=float,
+                        default=2.0,
+                        metavar='<seconds>',
+                        help='watch mode: how often files are checked where inotify is not available '
+                             '(default: %(default)s)')
+
     parser.add_argument('--host',
                         metavar='<value>',
                         help='value to set to host')